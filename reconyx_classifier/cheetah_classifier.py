@@ -1,6 +1,8 @@
 import sys
 import os
+import time
 import argparse
+from collections import OrderedDict
 
 import logging
 
@@ -17,8 +19,9 @@ def parse_arguments():
     optional = parser._action_groups.pop()
     required = parser.add_argument_group('required arguments')
 
-    parser.add_argument(dest='directory',
-                        help="Images to be classified.")
+    parser.add_argument(dest='directory', nargs='?', default=None,
+                        help="Images to be classified (not needed with "
+                             "--serve).")
 
     required.add_argument('--model', required=True,
                           help="Stored Keras model to load for classification.")
@@ -27,9 +30,135 @@ def parse_arguments():
                           metavar='N',
                           help="Batch size to use for classification.")
 
+    optional.add_argument('--backend', default=None,
+                          choices=['keras', 'onnx'],
+                          help="Inference backend. 'onnx' runs the model "
+                               "converted with scripts/convert_model.py "
+                               "with ONNX Runtime and is used by default "
+                               "if the converted model exists.")
+
+    optional.add_argument('--auto_tune', '--auto-tune', action='store_true',
+                          help="Use the batch size and inference thread "
+                               "counts tuned for this machine, model and "
+                               "--backend, calibrating them first if "
+                               "necessary (overrides --batch_size).")
+
+    optional.add_argument('--retune', action='store_true',
+                          help="Calibrate again with --auto_tune, even if "
+                               "there are stored settings.")
+
+    optional.add_argument('--workers', type=int, default=1,
+                          metavar='N',
+                          help="Number of threads reading image metadata.")
+
+    optional.add_argument('--decode_workers', type=int, default=2,
+                          metavar='N',
+                          help="Number of threads decoding images for "
+                               "classification.")
+
+    optional.add_argument('--prefetch', type=int, default=2,
+                          metavar='N',
+                          help="Number of batches decoded ahead of the "
+                               "batch being classified (0 to disable).")
+
+    optional.add_argument('--decode_processes', type=int, default=0,
+                          metavar='N',
+                          help="Decode images in N processes and pass them "
+                               "through shared memory instead of using "
+                               "--decode_workers threads.")
+
+    optional.add_argument('--inference_processes', type=int, default=0,
+                          metavar='N',
+                          help="Classify in N processes with one model "
+                               "each, splitting the images by event. Each "
+                               "process uses an equal share of the cores "
+                               "and decodes with --decode_workers threads "
+                               "(not with --decode_processes).")
+
+    optional.add_argument('--early_exit', type=float, default=None,
+                          metavar='CONF',
+                          help="Skip the remaining images of an event once "
+                               "one image is classified as an animal with "
+                               "at least confidence CONF (e.g. 0.95).")
+
+    optional.add_argument('--empty_threshold', type=float, default=None,
+                          metavar='T',
+                          help="Label images that change less than T from "
+                               "the other images of their event as "
+                               "'unknown' without running the model. See "
+                               "scripts/validate_empty_filter.py to choose T.")
+
+    optional.add_argument('--decoder', default='full',
+                          help="Image decoder to use, 'full' (default, "
+                               "like the training preprocessing) or one of "
+                               "the faster reduced resolution decoders "
+                               "'pil_draft', 'opencv' or 'turbojpeg', which "
+                               "change the pixels slightly (see "
+                               "scripts/benchmark_decoders.py).")
+
+    optional.add_argument('--tensor_cache', default=None, metavar='DIR',
+                          help="Cache the preprocessed images in DIR, so "
+                               "classifying them again (e.g. with a new "
+                               "model) skips the JPEG decoding.")
+
+    optional.add_argument('--tensor_cache_size', type=float, default=20,
+                          metavar='GB',
+                          help="Size limit of the tensor cache, the least "
+                               "recently used images are evicted.")
+
+    optional.add_argument('--cache', action='store_true',
+                          help="Keep a metadata cache file "
+                               "(.reconyx_metadata.sqlite) in the image "
+                               "directory, so rescans only read new or "
+                               "changed images.")
+
+    optional.add_argument('--prediction_store', default=None,
+                          metavar='FILE',
+                          help="Keep the predictions in this SQLite "
+                               "file, so images are not classified again "
+                               "by the same model and decoder. Prune it "
+                               "with scripts/prune_predictions.py.")
+
+    optional.add_argument('--dedup', action='store_true',
+                          help="Classify copies of an image (e.g. of a "
+                               "card copied twice) only once. Reads the "
+                               "start and end of every image to find "
+                               "them.")
+
+    optional.add_argument('--event_window', type=float, default=None,
+                          metavar='SECS',
+                          help="Classify successive events of a camera "
+                               "within SECS seconds as one event.")
+
+    optional.add_argument('--stream', action='store_true',
+                          help="Classify images while the directory "
+                               "is still being scanned.")
+
+    optional.add_argument('--chunk_size', type=int, default=256,
+                          metavar='N',
+                          help="Number of images per chunk in stream mode.")
+
     optional.add_argument('--copy_output', action='store_true',
                           help="Copy classified images to output directories.")
 
+    optional.add_argument('--serve', action='store_true',
+                          help="Load the model once and classify the "
+                               "directories submitted to "
+                               "http://127.0.0.1:PORT until interrupted.")
+
+    optional.add_argument('--use_daemon', action='store_true',
+                          help="Submit the directory to the --serve "
+                               "process if one is running with the same "
+                               "model and settings, else classify here.")
+
+    optional.add_argument('--port', type=int, default=8765,
+                          help="Port of the --serve process.")
+
+    optional.add_argument('--startup_report', '--startup-report',
+                          action='store_true',
+                          help="Print how long the imports, loading the "
+                               "model and the first batch took.")
+
     optional.add_argument('-v', '--verbose', help="Increase output verbosity.",
                           action='store_const', const=logging.DEBUG,
                           default=logging.INFO)
@@ -37,32 +166,140 @@ def parse_arguments():
     parser._action_groups.append(optional)
 
     args = parser.parse_args()
+    if args.directory is None and not args.serve:
+        parser.error("the directory is required unless --serve is given")
+
     return args
 
 
+def model_settings(args) -> dict:
+    """The arguments that change the results of a model, a service only
+    classifies for clients with the same ones."""
+    return {"backend": args.backend, "decoder": args.decoder,
+            "early_exit": args.early_exit,
+            "empty_threshold": args.empty_threshold}
+
+
+def classify_with_daemon(args) -> bool:
+    """Classify the directory with the running service, if there is one.
+
+    :returns: False if no service is running or it runs another model
+        or settings.
+    """
+    from data_utils.service import service_running, submit_job, \
+        job_status, cancel_job, SettingsMismatch
+
+    if not service_running(args.port):
+        log.info("No classification service on port {}, classifying "
+                 "here".format(args.port))
+        return False
+
+    try:
+        job = submit_job(args.directory, args.model, model_settings(args),
+                         args.port, event_window=args.event_window,
+                         copy_output=args.copy_output, workers=args.workers,
+                         use_cache=args.cache)
+    except SettingsMismatch as err:
+        log.warning("{}, classifying here".format(err))
+        return False
+    except ValueError as err:
+        log.error(err)
+        sys.exit(1)
+    log.info("Submitted job {} to the classification service".format(
+        job["id"]))
+    try:
+        while job["state"] in ("queued", "running"):
+            print("\rJob {}: {} {:5.1f}%".format(job["id"], job["state"],
+                                                 job["progress"]),
+                  end="", flush=True)
+            time.sleep(0.5)
+            job = job_status(job["id"], args.port)
+    except KeyboardInterrupt:
+        cancel_job(job["id"], args.port)
+        print()
+        log.error("Cancelled job {}".format(job["id"]))
+        sys.exit(1)
+    print()
+
+    if job["state"] == "done":
+        log.info("Classified {} images: {}".format(
+            job["result"]["images"], job["result"]["labels"]))
+    else:
+        log.error("Job {} {}{}".format(
+            job["id"], job["state"],
+            ": " + job["error"] if job["error"] else ""))
+        sys.exit(1)
+
+    return True
+
+
 def main():
     args = parse_arguments()
     logging.basicConfig(stream=sys.stdout, level=args.verbose,
                         format="%(levelname)-7s - %(name)-10s - %(message)s")
 
-    # import only after parsing to reduce startup delay
+    if args.use_daemon and not args.serve and classify_with_daemon(args):
+        return
+
+    # seconds spent in the startup phases, for --startup_report
+    timings = OrderedDict()
+    start = time.perf_counter()
+
+    # import only after parsing to reduce startup delay, TensorFlow is
+    # only imported once the model is loaded
     from data_utils.classifier import ImageClassifier
-    from data_utils.io import read_dir_metadata, classification_to_dir
+    from data_utils.io import read_dir_metadata, iter_dir_metadata, \
+        classification_to_dir
+    timings["imports"] = time.perf_counter() - start
 
     log.info("Initializing ImageClassifier")
+    start = time.perf_counter()
     try:
-        im_class = ImageClassifier(args.model, args.batch_size,
-                                   default_labels)
+        batch_size = args.batch_size
+        threads = {}
+        if args.auto_tune:
+            from data_utils.auto_tune import tuned_settings
+            settings = tuned_settings(args.model, args.backend,
+                                      retune=args.retune)
+            batch_size = settings.batch_size
+            # tuned for one process, the pool divides the cores itself
+            if not args.inference_processes:
+                threads = dict(intra_op_threads=settings.intra_op_threads,
+                               inter_op_threads=settings.inter_op_threads)
+
+        im_class = ImageClassifier(args.model, batch_size,
+                                   default_labels,
+                                   decode_workers=args.decode_workers,
+                                   prefetch=args.prefetch,
+                                   decoder=args.decoder,
+                                   decode_processes=args.decode_processes,
+                                   tensor_cache_dir=args.tensor_cache,
+                                   tensor_cache_bytes=int(
+                                       args.tensor_cache_size * 1024 ** 3),
+                                   backend=args.backend,
+                                   inference_processes=args.inference_processes,
+                                   early_exit=args.early_exit,
+                                   empty_threshold=args.empty_threshold,
+                                   prediction_store=args.prediction_store,
+                                   dedup=args.dedup,
+                                   **threads)
     except OSError as err:
         log.error("OS error: {}".format(err))
         sys.exit(1)
+    except ValueError as err:
+        log.error(err)
+        sys.exit(1)
+    timings["classifier init"] = time.perf_counter() - start
 
-    log.info("Classifying images in '{}'".format(args.directory))
-    data = read_dir_metadata(args.directory)
-    im_class.classify_data(data)
-
-    print()
+    if args.serve:
+        from data_utils.service import ClassificationService, serve
+        serve(ClassificationService(im_class, default_labels, args.model,
+                                    model_settings(args)), args.port)
+        im_class.close()
+        return
 
+    # create the output directory first, so we don't classify for nothing
+    classified_path = None
     if args.copy_output:
         classified_path = args.directory.rstrip('/\\') + '_classified'
         log.info("Creating dir '{}'".format(classified_path))
@@ -74,7 +311,55 @@ def main():
             ))
             return
 
-        classification_to_dir(classified_path, data, default_labels)
+    log.info("Classifying images in '{}'".format(args.directory))
+    start = time.perf_counter()
+    if args.stream:
+        # scan in the background and classify chunks of complete events
+        chunks = iter_dir_metadata(args.directory,
+                                   chunk_size=args.chunk_size,
+                                   workers=args.workers,
+                                   use_cache=args.cache,
+                                   prefetch=2,
+                                   event_window=args.event_window)
+        for data in im_class.classify_stream(chunks,
+                                             event_window=args.event_window):
+            if classified_path:
+                classification_to_dir(classified_path, data, default_labels)
+    else:
+        data = read_dir_metadata(args.directory, workers=args.workers,
+                                 use_cache=args.cache)
+        timings["metadata scan"] = time.perf_counter() - start
+        start = time.perf_counter()
+        im_class.classify_data(data, event_window=args.event_window)
+
+        if classified_path:
+            classification_to_dir(classified_path, data, default_labels)
+
+    timings["classification"] = time.perf_counter() - start
+
+    im_class.close()
+    print()
+
+    if args.startup_report:
+        print_startup_report(timings, im_class.startup_times)
+
+
+def print_startup_report(timings, model_times):
+    """Print the phases of the run, with the steps of loading the model
+    and the first batch (including the graph warm-up) indented."""
+    steps = {"classifier init": [(step, secs) for step, secs
+                                 in model_times.items()
+                                 if step != "first batch"],
+             "classification": [(step, secs) for step, secs
+                                in model_times.items()
+                                if step == "first batch"]}
+
+    print("Startup report:")
+    for phase, secs in timings.items():
+        print("  {:28s} {:8.3f} s".format(phase, secs))
+        for step, step_secs in steps.get(phase, []):
+            print("    {:26s} {:8.3f} s".format(step, step_secs))
+    print("  {:28s} {:8.3f} s".format("total", sum(timings.values())))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import platform
+from collections import namedtuple
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .backends import InferenceBackend, create_backend, model_file
+from .preprocessing import INPUT_SIZE
+
+import logging
+
+tune_log = logging.getLogger("auto_tune")
+
+# tuned settings of all machines and models
+TUNING_FILE = os.path.join(os.path.expanduser("~"), ".reconyx_classifier",
+                           "tuning.json")
+
+DEFAULT_BATCH_SIZES = [1, 4, 8, 16, 32, 64]
+
+# minimum time to measure a configuration for [in seconds]
+MEASURE_SECS = 1.0
+
+# larger batches must be this much faster to be preferred
+MIN_IMPROVEMENT = 1.05
+
+TuningSettings = namedtuple("TuningSettings",
+                            ["batch_size", "intra_op_threads",
+                             "inter_op_threads", "images_per_sec"])
+
+
+def machine_key() -> str:
+    """Identifies the machine the settings were tuned on."""
+    return "{}:{}:{}".format(platform.node(), platform.machine(),
+                             os.cpu_count())
+
+
+def model_key(model_path: str) -> str:
+    """Identifies the model file, changes if the file is replaced."""
+    stat = os.stat(model_path)
+    return "{}:{}:{}".format(os.path.abspath(model_path), stat.st_size,
+                             stat.st_mtime_ns)
+
+
+def _settings_key(model_path: str, backend: Optional[str]) -> str:
+    """Settings are stored per backend, by the file it loads."""
+    return model_key(model_file(backend, model_path))
+
+
+def load_settings(model_path: str, backend: str = None,
+                  tuning_file: str = TUNING_FILE) -> Optional[TuningSettings]:
+    """The stored settings for this machine, model and backend, or None.
+
+    With backend None, those of `backends.default_backend` are loaded.
+    """
+    try:
+        with open(tuning_file) as f:
+            tunings = json.load(f)
+        entry = tunings[machine_key()][_settings_key(model_path, backend)]
+        return TuningSettings(**entry)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_settings(model_path: str, settings: TuningSettings,
+                  backend: str = None, tuning_file: str = TUNING_FILE):
+    """Store the settings for this machine, model and backend."""
+    try:
+        with open(tuning_file) as f:
+            tunings = json.load(f)
+    except (OSError, ValueError):
+        tunings = {}
+
+    tunings.setdefault(machine_key(), {})[
+        _settings_key(model_path, backend)] = \
+        settings._asdict()
+
+    os.makedirs(os.path.dirname(tuning_file), exist_ok=True)
+    with open(tuning_file, "w") as f:
+        json.dump(tunings, f, indent=2)
+
+
+def memory_usage() -> Optional[int]:
+    """Resident memory of the process in bytes, None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+        # peak usage only, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+    except ImportError:
+        return None
+
+
+def default_memory_limit() -> Optional[int]:
+    """Half of the physical memory, None if unknown."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+    except (ValueError, AttributeError, OSError):
+        return None
+
+
+def thread_configs() -> List[Tuple[int, int]]:
+    """Candidate (intra_op, inter_op) thread counts for this machine."""
+    cores = os.cpu_count() or 1
+    configs = [(cores, 1), (cores, 2), (max(1, cores // 2), 2)]
+    return sorted(set(configs), key=configs.index)
+
+
+def _measure(model: InferenceBackend, batch_size: int) -> float:
+    """Images/sec of the model for random input of the batch size."""
+    inputs = [np.random.uniform(-1, 1, (batch_size,) + INPUT_SIZE + (3,))
+              .astype(np.float32),
+              np.random.uniform(0, 1, (batch_size, 2)).astype(np.float32)]
+
+    # the first batch of a size includes graph setup, don't count it
+    model.predict(inputs)
+
+    runs = 0
+    start = time.perf_counter()
+    while runs < 2 or time.perf_counter() - start < MEASURE_SECS:
+        model.predict(inputs)
+        runs += 1
+
+    return runs * batch_size / (time.perf_counter() - start)
+
+
+def _batch_memory(baseline: Optional[int], memory: Optional[int],
+                  batch_size: int, next_size: int) -> Optional[int]:
+    """Estimated process memory when running `next_size` batches, from
+    the memory after loading the model and after `batch_size` batches."""
+    if baseline is None or memory is None:
+        return None
+
+    return baseline + max(0, memory - baseline) * next_size // batch_size
+
+
+def _report(progress: Optional[Callable[[str], None]], batch_size: int,
+            intra_op_threads: int, inter_op_threads: int, rate: float):
+    message = "batch size {:3d}, threads {}/{}: {:6.1f} images/sec".format(
+        batch_size, intra_op_threads, inter_op_threads, rate)
+    tune_log.info(message)
+    if progress:
+        progress(message)
+
+
+def calibrate(model_path: str, backend: str = None,
+              batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+              threads: Sequence[Tuple[int, int]] = None,
+              memory_limit: Optional[int] = None,
+              progress: Callable[[str], None] = None) -> TuningSettings:
+    """Measure the throughput of the model and pick the fastest settings.
+
+    The model is loaded once, with the `backend` it is classified with
+    (by default the one of `backends.default_backend`). The batch size
+    is tuned with the first (intra_op, inter_op) thread configuration:
+    increasing sizes are run until one is not noticeably faster than the
+    best so far, as larger batches need more memory and add latency, or
+    until the memory it would need (scaled from the memory the previous
+    size used on top of the loaded model) exceeds `memory_limit`, by
+    default half of the physical memory. The other thread configurations
+    are only measured with the selected batch size.
+    """
+    threads = threads or thread_configs()
+    memory_limit = memory_limit or default_memory_limit()
+
+    intra_op_threads, inter_op_threads = threads[0]
+    model = create_backend(backend, model_path, intra_op_threads,
+                           inter_op_threads)
+    try:
+        baseline = memory_usage()
+        best = None
+        for idx, batch_size in enumerate(batch_sizes):
+            if idx > 0:
+                estimate = _batch_memory(baseline, memory_usage(),
+                                         batch_sizes[idx - 1], batch_size)
+                if memory_limit and estimate and estimate > memory_limit:
+                    tune_log.info("Batch size {} would exceed the memory "
+                                  "limit".format(batch_size))
+                    break
+
+            rate = _measure(model, batch_size)
+            _report(progress, batch_size, intra_op_threads,
+                    inter_op_threads, rate)
+            if best is not None and \
+                    rate <= best.images_per_sec * MIN_IMPROVEMENT:
+                break
+            best = TuningSettings(batch_size, intra_op_threads,
+                                  inter_op_threads, rate)
+
+        for intra_op_threads, inter_op_threads in threads[1:]:
+            model.set_threads(intra_op_threads, inter_op_threads)
+            rate = _measure(model, best.batch_size)
+            _report(progress, best.batch_size, intra_op_threads,
+                    inter_op_threads, rate)
+            if rate > best.images_per_sec:
+                best = TuningSettings(best.batch_size, intra_op_threads,
+                                      inter_op_threads, rate)
+    finally:
+        model.close()
+
+    tune_log.info("Selected batch size {}, threads {}/{} ({:.1f} images/sec)"
+                  .format(*best))
+    return best
+
+
+def tuned_settings(model_path: str, backend: str = None,
+                   retune: bool = False, **calibrate_args) -> TuningSettings:
+    """The stored settings of the model and backend, calibrated if there
+    are none."""
+    settings = None if retune else load_settings(model_path, backend)
+    if settings is None:
+        tune_log.info("Calibrating batch size and threads for '{}'".format(
+            model_file(backend, model_path)))
+        settings = calibrate(model_path, backend, **calibrate_args)
+        try:
+            save_settings(model_path, settings, backend)
+        except OSError as err:
+            tune_log.warning("Could not store tuned settings: {}".format(err))
+
+    return settings
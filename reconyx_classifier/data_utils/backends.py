@@ -0,0 +1,428 @@
+import os
+import json
+import time
+import importlib.util
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .metadata_cache import file_identity
+from .prediction_store import file_hash
+
+import logging
+
+backend_log = logging.getLogger("backends")
+
+# TensorFlow, Keras and ONNX Runtime take seconds to import, they are
+# only imported by the backend that needs them (onnxruntime is optional)
+HAS_ONNXRUNTIME = importlib.util.find_spec("onnxruntime") is not None
+
+
+class InferenceBackend:
+    """Runs the classification model on batches of network input.
+
+    The input is the [images, meta] list built by `BatchBuffer`, the
+    output the (batch_size, num_classes) softmax predictions.
+    `timings` holds the seconds spent in the steps of loading the model.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    def predict(self, inputs: List[np.ndarray]) -> np.ndarray:
+        raise NotImplementedError()
+
+    def set_threads(self, intra_op_threads: int = 0,
+                    inter_op_threads: int = 0):
+        """Use new inference thread pools (0: chosen by the backend),
+        without loading the model again."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+def session_config(intra_op_threads: int = 0,
+                   inter_op_threads: int = 0) -> 'tensorflow.ConfigProto':
+    """TensorFlow session config with the given thread pools (0: default)."""
+    from tensorflow import ConfigProto
+
+    return ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                       inter_op_parallelism_threads=inter_op_threads)
+
+
+def frozen_model_path(model_path: str) -> str:
+    """The frozen inference graph cached next to a Keras model file."""
+    return os.path.splitext(model_path)[0] + ".frozen.pb"
+
+
+def _frozen_info_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".frozen.json"
+
+
+def _source_matches(info: dict, info_path: str, model_path: str) -> bool:
+    """Whether the model file is the one the info was recorded for.
+
+    If size, mtime or inode of the file changed, its hash is compared.
+    """
+    identity = list(file_identity(os.stat(model_path)))
+    if info.get("identity") != identity:
+        if info.get("hash") != file_hash(model_path):
+            return False
+
+        # same content, e.g. a copied model, skip the hash next time
+        info["identity"] = identity
+        try:
+            with open(info_path, 'w') as f:
+                json.dump(info, f)
+        except OSError:
+            pass
+
+    return True
+
+
+def _load_frozen(model_path: str, tf_version: str) \
+        -> Optional[Tuple[bytes, dict]]:
+    """The cached frozen graph and its info, None if missing or outdated.
+
+    The cache is valid for the model file it was built from.
+    """
+    info_path = _frozen_info_path(model_path)
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+        with open(frozen_model_path(model_path), 'rb') as f:
+            graph_bytes = f.read()
+    except (OSError, ValueError):
+        return None
+
+    if info.get("tensorflow") != tf_version or \
+            not _source_matches(info, info_path, model_path):
+        return None
+
+    return graph_bytes, info
+
+
+def _freeze(model_path: str, tf_version: str) -> Tuple[bytes, dict]:
+    """Build the inference graph of the Keras model with the weights
+    folded into constants, and cache it next to the model file."""
+    import tensorflow as tf
+    import keras.backend as K
+    import keras.models
+
+    graph = tf.Graph()
+    with graph.as_default():
+        session = tf.Session(graph=graph)
+        K.set_session(session)
+        K.set_learning_phase(0)
+        model = keras.models.load_model(model_path, compile=False)
+
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            session, graph.as_graph_def(),
+            [output.op.name for output in model.outputs])
+        graph_def = tf.graph_util.remove_training_nodes(graph_def)
+        info = {"inputs": [model_input.name for model_input in model.inputs],
+                "outputs": [output.name for output in model.outputs]}
+        session.close()
+    K.clear_session()
+
+    info.update(tensorflow=tf_version, hash=file_hash(model_path),
+                identity=list(file_identity(os.stat(model_path))))
+    graph_bytes = graph_def.SerializeToString()
+
+    # write to temporary files first, so readers never see half a cache,
+    # (inference processes may build the cache at the same time)
+    try:
+        for path, mode, content in [
+                (frozen_model_path(model_path), 'wb', graph_bytes),
+                (_frozen_info_path(model_path), 'w', json.dumps(info))]:
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, mode) as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+    except OSError as err:
+        backend_log.warning("Could not cache the frozen model: {}".format(err))
+
+    return graph_bytes, info
+
+
+class KerasBackend(InferenceBackend):
+    """The Keras model, run as a frozen TensorFlow graph.
+
+    Loading the HDF5 model and building the Keras layers takes most of
+    the startup time, so the inference graph with the weights folded
+    into constants is cached next to the model file (see
+    `frozen_model_path`) and loaded directly on the next start.
+    """
+
+    name = "keras"
+
+    def __init__(self, model_path: str, intra_op_threads: int = 0,
+                 inter_op_threads: int = 0):
+        super().__init__()
+
+        start = time.perf_counter()
+        import tensorflow as tf
+        self.timings["tensorflow import"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frozen = _load_frozen(model_path, tf.__version__)
+        if frozen is None:
+            backend_log.info("Building the frozen model of '{}'".format(
+                model_path))
+            graph_bytes, info = _freeze(model_path, tf.__version__)
+            self.timings["model build (not cached)"] = \
+                time.perf_counter() - start
+        else:
+            graph_bytes, info = frozen
+            self.timings["model load (cached)"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(graph_bytes)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+
+        self.session = self._session(intra_op_threads, inter_op_threads)
+        self.inputs = [self.graph.get_tensor_by_name(name)
+                       for name in info["inputs"]]
+        self.output = self.graph.get_tensor_by_name(info["outputs"][0])
+        self.timings["graph import"] = time.perf_counter() - start
+
+    def _session(self, intra_op_threads: int, inter_op_threads: int):
+        import tensorflow as tf
+
+        config = None
+        if intra_op_threads or inter_op_threads:
+            config = session_config(intra_op_threads, inter_op_threads)
+        return tf.Session(graph=self.graph, config=config)
+
+    def predict(self, inputs: List[np.ndarray]) -> np.ndarray:
+        return self.session.run(self.output, dict(zip(self.inputs, inputs)))
+
+    def set_threads(self, intra_op_threads: int = 0,
+                    inter_op_threads: int = 0):
+        # the weights are constants of the graph, a new session of the
+        # same graph needs no initialization
+        self.session.close()
+        self.session = self._session(intra_op_threads, inter_op_threads)
+
+    def close(self):
+        self.session.close()
+
+
+def onnx_model_path(model_path: str) -> str:
+    """The ONNX model converted from a Keras model file."""
+    return os.path.splitext(model_path)[0] + ".onnx"
+
+
+def _onnx_info_path(onnx_path: str) -> str:
+    return os.path.splitext(onnx_path)[0] + ".onnx.json"
+
+
+def _load_onnx_info(onnx_path: str) -> Optional[dict]:
+    """The conversion info written by `convert_to_onnx`, None if missing
+    or written by an older version without the input names."""
+    try:
+        with open(_onnx_info_path(onnx_path)) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return info if "inputs" in info else None
+
+
+def onnx_input_names(session, onnx_path: str) -> List[str]:
+    """The input names of an ONNX Runtime session of the model, in the
+    order of the Keras model inputs (image, meta).
+
+    The converter does not keep that order, it is recorded by
+    `convert_to_onnx`. Models without the record (e.g. converted
+    elsewhere) are fed in the order of the session inputs.
+    """
+    info = _load_onnx_info(onnx_path)
+    if info is not None:
+        return info["inputs"]
+
+    return [model_input.name for model_input in session.get_inputs()]
+
+
+def copy_onnx_inputs(onnx_path: str, derived_path: str):
+    """Record the input order of a converted ONNX model for a model
+    derived from it, e.g. quantized, which has the same inputs."""
+    info = _load_onnx_info(onnx_path)
+    if info is not None:
+        with open(_onnx_info_path(derived_path), 'w') as f:
+            json.dump({"inputs": info["inputs"]}, f)
+
+
+def onnx_model_current(model_path: str) -> bool:
+    """Whether the ONNX model next to the Keras model file was converted
+    from this version of it, as recorded by `convert_to_onnx`."""
+    onnx_path = onnx_model_path(model_path)
+    info = _load_onnx_info(onnx_path)
+    if info is None:
+        return False
+
+    return _source_matches(info, _onnx_info_path(onnx_path), model_path)
+
+
+class OnnxBackend(InferenceBackend):
+    """The model converted to ONNX (see `convert_to_onnx`), run with
+    ONNX Runtime on the CPU."""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, intra_op_threads: int = 0,
+                 inter_op_threads: int = 0):
+        super().__init__()
+        if not HAS_ONNXRUNTIME:
+            raise ValueError("The 'onnx' backend needs the onnxruntime "
+                             "package")
+
+        start = time.perf_counter()
+        import onnxruntime
+        self.timings["onnxruntime import"] = time.perf_counter() - start
+
+        if not model_path.endswith(".onnx"):
+            keras_path, model_path = model_path, onnx_model_path(model_path)
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(
+                    "No ONNX model '{}', convert the model with "
+                    "scripts/convert_model.py first".format(model_path))
+            if not onnx_model_current(keras_path):
+                raise ValueError(
+                    "The ONNX model '{}' was not converted from '{}', "
+                    "convert it again with scripts/convert_model.py"
+                    .format(model_path, keras_path))
+
+        start = time.perf_counter()
+        self.model_path = model_path
+        self.session = self._session(intra_op_threads, inter_op_threads)
+        self.timings["model load"] = time.perf_counter() - start
+        self.input_names = onnx_input_names(self.session, model_path)
+
+    def _session(self, intra_op_threads: int, inter_op_threads: int):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = \
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        return onnxruntime.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"])
+
+    def predict(self, inputs: List[np.ndarray]) -> np.ndarray:
+        feed = {name: np.ascontiguousarray(value, dtype=np.float32)
+                for name, value in zip(self.input_names, inputs)}
+        return self.session.run(None, feed)[0]
+
+    def set_threads(self, intra_op_threads: int = 0,
+                    inter_op_threads: int = 0):
+        # ONNX Runtime only sets the thread pools when creating a
+        # session, which has to load the model file again
+        self.session = self._session(intra_op_threads, inter_op_threads)
+
+
+BACKENDS = OrderedDict((backend.name, backend)
+                       for backend in [KerasBackend, OnnxBackend])
+
+
+def default_backend(model_path: str) -> str:
+    """'onnx' if the runtime and a model converted from the current
+    model file exist, else 'keras'."""
+    if model_path.endswith(".onnx"):
+        return OnnxBackend.name
+
+    if HAS_ONNXRUNTIME and \
+            os.path.exists(onnx_model_path(model_path)):
+        if onnx_model_current(model_path):
+            return OnnxBackend.name
+
+        backend_log.warning("Ignoring '{}', it was not converted from the "
+                            "current '{}'".format(onnx_model_path(model_path),
+                                                  model_path))
+
+    return KerasBackend.name
+
+
+def model_file(name: str, model_path: str) -> str:
+    """The file the backend of the given name loads the model from."""
+    name = name or default_backend(model_path)
+    if name == OnnxBackend.name and not model_path.endswith(".onnx"):
+        return onnx_model_path(model_path)
+
+    return model_path
+
+
+def create_backend(name: str, model_path: str, intra_op_threads: int = 0,
+                   inter_op_threads: int = 0) -> InferenceBackend:
+    """Load the model with the backend of the given name.
+
+    With name None, the backend is chosen with `default_backend`.
+    """
+    name = name or default_backend(model_path)
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown inference backend '{}', choose from {}"
+                         .format(name, list(BACKENDS))) from None
+
+    backend_log.info("Using '{}' inference backend".format(name))
+    return backend(model_path, intra_op_threads, inter_op_threads)
+
+
+def _onnx_input_names(model, onnx_model) -> List[str]:
+    """The ONNX graph inputs in the order of the Keras model inputs.
+
+    keras2onnx names them after the Keras input layers, e.g. 'input_1'
+    or 'input_1_01' (keras2onnx 1.5), but does not keep their order.
+    """
+    graph_inputs = [graph_input.name for graph_input in onnx_model.graph.input]
+    names = []
+    for layer_name in model.input_names:
+        matches = [name for name in graph_inputs
+                   if name == layer_name or name.startswith(layer_name + ":")
+                   or name.startswith(layer_name + "_0")]
+        if len(matches) != 1:
+            raise ValueError("Cannot find the ONNX input of the Keras input "
+                             "'{}' in {}".format(layer_name, graph_inputs))
+        names += matches
+
+    return names
+
+
+def convert_to_onnx(model_path: str, onnx_path: str = None) -> str:
+    """Convert the Keras (image, meta) model to ONNX.
+
+    Needs the keras2onnx and onnx packages. Verified with keras2onnx
+    1.5.0, onnx 1.5.0 and onnxruntime 1.1.0, the last releases that
+    install with the numpy 1.14.5 of environment.yml.
+
+    :returns: The path of the ONNX model, next to the Keras model
+        unless `onnx_path` is given.
+    """
+    import onnx
+    import keras2onnx
+    import keras.models
+
+    onnx_path = onnx_path or onnx_model_path(model_path)
+    model = keras.models.load_model(model_path)
+    onnx_model = keras2onnx.convert_keras(model, model.name)
+    onnx.save_model(onnx_model, onnx_path)
+
+    # record the source model, so outdated conversions are not used
+    info = {"source": os.path.abspath(model_path),
+            "hash": file_hash(model_path),
+            "identity": list(file_identity(os.stat(model_path))),
+            "inputs": _onnx_input_names(model, onnx_model)}
+    with open(_onnx_info_path(onnx_path), 'w') as f:
+        json.dump(info, f)
+
+    return onnx_path
@@ -1,16 +1,22 @@
 import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
-import keras.backend as K
-import keras.models
-import keras.utils
-
-from tensorflow import get_default_graph, Session, global_variables_initializer
 
-from keras.applications.inception_resnet_v2 import preprocess_input
-from keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
+from typing import Generator, Iterable, List, Callable
 
-from typing import Generator, List, Callable
+from .io import extended_event_ids, add_fingerprints
+from .image_decoder import get_decoder
+from .preprocessing import BatchBuffer, PREPROCESSING_VERSION
+from .batch_ring import ring_batches
+from .tensor_cache import TensorCache, DEFAULT_MAX_BYTES
+from .backends import create_backend, model_file
+from .inference_pool import InferencePool
+from .empty_filter import EmptyFrameFilter
+from .prediction_store import PredictionStore
 
 import logging
 log = logging.getLogger("classifier")
@@ -18,32 +24,118 @@ log = logging.getLogger("classifier")
 # set TensorFlow log-level to warnings and above
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
 
-predict_generator = ImageDataGenerator()
-target_im_size = (299 + 20, 299 + 20)
+
+def _fill_batch(buffer: BatchBuffer, data_batch: pd.DataFrame,
+                start: int = 0, cache: TensorCache = None) -> List[np.ndarray]:
+    """Decode the images and metadata of the rows into the buffer."""
+    return buffer.fill(data_batch['path'].values,
+                       data_batch['ambient_temp'].values,
+                       data_batch['hour'].values, start, cache)
+
+
+def data_to_matrix(data_batch, decoder=None):
+    """Given a dataframe with image paths and metadata, convert to NN input.
+
+    :param decoder: The image decoder, see `image_decoder.get_decoder`.
+        By default, the 'full' decoder is used.
+    """
+    return _fill_batch(BatchBuffer(len(data_batch), decoder), data_batch)
 
 
-def data_to_matrix(data_batch):
-    """Given a dataframe with image paths and metadata, convert to NN input."""
-    batch_x = np.zeros((len(data_batch), 299 + 20, 299 + 20, 3),
-                       dtype=K.floatx())
-    batch_t = np.zeros((len(data_batch),), dtype=K.floatx())
-    batch_h = np.zeros((len(data_batch),), dtype=K.floatx())
+def _sequence_ranks(groups, sequence_idx: np.ndarray) -> np.ndarray:
+    """Position of every row within its group, in `sequence_idx` order."""
+    codes, _ = pd.factorize(np.asarray(groups), sort=False)
+    order = np.lexsort((sequence_idx, codes))
+    sorted_codes = codes[order]
+    starts = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
 
-    for i, (key, row) in enumerate(data_batch.iterrows()):
-        img = load_img(row['path'], grayscale=False,
-                       target_size=target_im_size)
-        x = img_to_array(img)
-        x = predict_generator.random_transform(x.astype(K.floatx()))
-        x = predict_generator.standardize(x)
-        batch_x[i] = x
-        batch_t[i] = row['ambient_temp']
-        batch_h[i] = row['hour']
+    ranks = np.empty(len(codes), dtype=np.int64)
+    group_starts = np.maximum.accumulate(
+        np.where(starts, np.arange(len(codes)), 0))
+    ranks[order] = np.arange(len(codes)) - group_starts
+
+    return ranks
+
+
+def _unique_images(data: pd.DataFrame, positions: np.ndarray):
+    """First occurrences of the images at the given row positions.
+
+    Images are the same if their 'fingerprint' (see
+    `io.content_fingerprint`) is, without that column all are unique.
+
+    :returns: (unique positions, in row order, and for every position
+        in `positions` the index of its image in the unique positions)
+    """
+    if 'fingerprint' not in data:
+        return positions, np.arange(len(positions))
 
-    batch_x = batch_x[:, 10:-10, 10:-10, :]
-    batch_x = [preprocess_input(batch_x),
-               np.stack((batch_t, batch_h), axis=1)]
+    _, first, inverse = np.unique(data['fingerprint'].values[positions],
+                                  return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    unique_idx = np.empty(len(first), dtype=np.int64)
+    unique_idx[order] = np.arange(len(first))
 
-    return batch_x
+    return positions[first[order]], unique_idx[inverse.ravel()]
+
+
+def probability_columns(class_labels: List[str]) -> List[str]:
+    """Names of the per-class probability columns of `classify_data`."""
+    return ['prob_' + label for label in class_labels]
+
+
+def prediction_matrix(data: pd.DataFrame,
+                      class_labels: List[str]) -> np.ndarray:
+    """The (N, num_classes) float32 predictions of a classified frame.
+
+    Row i is what the 'predict_probs' column of older versions held for
+    row i. The array is stacked from the columns on every call, keep it
+    rather than calling this repeatedly.
+    """
+    return np.column_stack([data[column].values for column
+                            in probability_columns(class_labels)])
+
+
+def max_labels(preds: np.ndarray, groups=None, unknown: int = 0) \
+        -> np.ndarray:
+    """Class of the strongest prediction of every row or its group.
+
+    The label of a group is the class of the maximum probability in any
+    of its rows, ties go to the first row and class. The groups are
+    reduced by segments of the rows sorted by group, so there is no
+    Python call per group. Rows with NaN predictions are ignored, rows
+    or groups without any prediction get the `unknown` label.
+
+    :param preds: numpy.ndarray
+        The (N, num_classes) predictions.
+    :param groups: Sequence
+        The group (e.g. event) of every row, or None to label every row
+        by itself.
+    """
+    missing = np.isnan(preds).all(axis=1)
+    filled = np.where(np.isnan(preds), -np.inf, preds)
+    row_labels = filled.argmax(axis=1)
+    row_labels[missing] = unknown
+    if groups is None or len(preds) == 0:
+        return row_labels
+
+    row_max = filled.max(axis=1)
+    codes, _ = pd.factorize(np.asarray(groups), sort=False)
+    # stable, the rows of a group keep their order
+    order = np.argsort(codes, kind="mergesort")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+
+    sorted_max = row_max[order]
+    group_max = np.maximum.reduceat(sorted_max, starts)
+    # first row of each group that has the group maximum
+    is_max = sorted_max == np.repeat(group_max, sizes)
+    first_max = np.minimum.reduceat(
+        np.where(is_max, np.arange(len(order)), len(order)), starts)
+
+    labels = np.empty(len(preds), dtype=row_labels.dtype)
+    labels[order] = np.repeat(row_labels[order[first_max]], sizes)
+    return labels
 
 
 class ImageClassifier:
@@ -54,84 +146,384 @@ class ImageClassifier:
     """
 
     def __init__(self, model_path: str, batch_size: int,
-                 class_labels: List[str]):
+                 class_labels: List[str], decode_workers: int = 1,
+                 prefetch: int = 0, decoder: str = None,
+                 decode_processes: int = 0, tensor_cache_dir: str = None,
+                 tensor_cache_bytes: int = DEFAULT_MAX_BYTES,
+                 intra_op_threads: int = 0, inter_op_threads: int = 0,
+                 backend: str = None, inference_processes: int = 0,
+                 early_exit: float = None, empty_threshold: float = None,
+                 prediction_store: str = None, dedup: bool = False):
         """Initialized the classifier with a Keras model.
 
         :param model_path: string
             Path to the Keras model file.
             The model should output a softmax activation of the classes.
+            Other backends load their model from next to this file.
         :param batch_size: int
             Batch size to use for classification.
         :param class_labels: List[str]
             Labels of the prediction, e.g. ['cheetah', 'leopard', 'unknown']
+        :param decode_workers: int
+            Number of threads decoding the images of upcoming batches.
+        :param prefetch: int
+            Number of batches decoded ahead of the one being classified.
+            With 0, every batch is decoded right before classification.
+        :param decoder: str
+            Name of the image decoder (see `image_decoder.decoder_names`),
+            by default 'full', which matches the training preprocessing.
+        :param decode_processes: int
+            If > 0, the images are decoded by this many processes into
+            shared memory (see `batch_ring.ring_batches`) instead of by
+            `decode_workers` threads. The calling script needs an
+            `if __name__ == '__main__':` guard, as the processes are
+            spawned.
+        :param tensor_cache_dir: str
+            If set, the preprocessed images are cached in this directory
+            (see `tensor_cache.TensorCache`), so classifying them again,
+            e.g. with a new model, skips the JPEG decoding.
+        :param tensor_cache_bytes: int
+            Size limit of the tensor cache.
+        :param intra_op_threads: int
+        :param inter_op_threads: int
+            Sizes of the inference thread pools, by default (0) chosen
+            by the backend. See `auto_tune.calibrate` to tune them.
+        :param backend: str
+            Name of the inference backend (see `backends.BACKENDS`), by
+            default the ONNX backend if the model has been converted.
+        :param inference_processes: int
+            If > 0, the images are classified by this many processes,
+            each with its own model (see `inference_pool.InferencePool`),
+            which decode with `decode_workers` threads and `prefetch`
+            (`decode_processes` are not supported with them),
+            `intra_op_threads` is then the thread count per process.
+        :param early_exit: float
+            If set, events are classified frame by frame in `sequence_idx`
+            order and the remaining frames of an event are skipped once
+            a frame predicts a class other than 'unknown' with at least
+            this confidence (see `classify_data`).
+        :param empty_threshold: float
+            If set, frames with a motion score within their event below
+            this threshold are labeled 'unknown' without running the
+            model (see `empty_filter.EmptyFrameFilter`).
+        :param prediction_store: str
+            If set, the predictions are kept in this SQLite file (see
+            `prediction_store.PredictionStore`) and images with a stored
+            prediction of the same model are not classified again.
+        :param dedup: bool
+            Whether to classify copies of an image only once. Finding
+            them reads the start and end of every image for its content
+            fingerprint (see `io.add_fingerprints`), which the prediction
+            store needs too.
         """
 
         log.info("Loading model from '{}'".format(model_path))
-
-        # store the session graph, else we get threading problems
-        self.model = keras.models.load_model(model_path)
-        self.model._make_predict_function()
-
-        self.graph = get_default_graph()
+        self.decoder = get_decoder(decoder)
+
+        if inference_processes > 0 and decode_processes > 0:
+            raise ValueError("Decoding processes can not be combined with "
+                             "inference processes, use decode_workers")
+
+        self.tensor_cache = None
+        if tensor_cache_dir:
+            self.tensor_cache = TensorCache(tensor_cache_dir,
+                                            tensor_cache_bytes,
+                                            self.decoder.__name__)
+
+        # seconds spent in the steps of loading the model, and the first
+        # batch, which includes the graph warm-up
+        self.startup_times = OrderedDict()
+        self.backend = None
+        self.inference_pool = None
+        if inference_processes > 0:
+            self.inference_pool = InferencePool(
+                inference_processes, model_path, batch_size, backend,
+                self.decoder, intra_op_threads or None, decode_workers,
+                prefetch, self.tensor_cache)
+            # the pool adds the first batch once it has classified one
+            self.startup_times = self.inference_pool.startup_times
+        else:
+            self.backend = create_backend(backend, model_path,
+                                          intra_op_threads, inter_op_threads)
+            self.startup_times.update(self.backend.timings)
 
         self.batch_size = batch_size
         self.class_labels = class_labels
+        self.decode_workers = decode_workers
+        self.prefetch = prefetch
+        self.decode_processes = decode_processes
+        self.early_exit = early_exit
+
+        self.empty_filter = None
+        if empty_threshold is not None:
+            if 'unknown' not in class_labels:
+                raise ValueError("The empty frame filter needs an 'unknown' "
+                                 "class label")
+            self.empty_filter = EmptyFrameFilter(empty_threshold,
+                                                 decode_workers)
+        # fraction of the images skipped by the last early-exit run
+        self.inferences_saved = 0.0
+        # duplicate images not classified again by the last run
+        self.dedup = dedup
+        self.duplicates_skipped = 0
+
+        self.prediction_store = None
+        if prediction_store:
+            self.prediction_store = PredictionStore.open(
+                prediction_store, model_file(backend, model_path),
+                "{}:{}".format(PREPROCESSING_VERSION, self.decoder.__name__))
         log.info("Model successfully loaded")
 
     def classify_data(self, data: pd.DataFrame,
                       classify_events: bool = True,
-                      progress: Callable[[int], bool] = None) -> pd.DataFrame:
+                      progress: Callable[[int], bool] = None,
+                      event_window: float = None) -> pd.DataFrame:
         """Classify the data described by a Pandas dataframe.
 
         :param data: pandas.DataFrame
             A data frame with columns containing at least the following:
             file path - path to the image file
-            simple_event_key - the event the image belongs to
-            event_key - the extended event when 3-image events are merged
+            event_id - the event the image belongs to
         :param classify_events: bool
             Whether to classify images in an event together. Event-
             resolution classification uses the class with strongest
             prediction confidence in any image as the event label.
+        :param event_window: float
+            If set, successive events of a camera within this many
+            seconds are classified as one event (see `extended_event_ids`).
+            The merged event is stored in an 'extended_event_id' column.
+
+        With `early_exit` set and `classify_events`, frames skipped after
+        a confident frame of their event get NaN probabilities, the event
+        label is then the strongest prediction of the classified frames.
+        Frames marked empty by the `empty_threshold` filter get NaN
+        probabilities as well, events without classified frames are
+        labeled 'unknown'. With `dedup` or the `prediction_store`, a
+        'fingerprint' column is added and rows with the same one are
+        classified once and get the same probabilities, which are taken
+        from the `prediction_store` if they were stored before.
 
         :returns: pandas.DataFrame
-            The data frame, with a new 'label' column.
+            The data frame, with a new 'label' column and a float32
+            probability column per class (see `probability_columns` and
+            `prediction_matrix`).
+
+        The output schema changed: the 'predict_probs' column of one
+        array object per row was replaced by the 'prob_<label>' columns,
+        e.g. 'prob_cheetah'. Code reading `data['predict_probs']` should
+        use `prediction_matrix(data, class_labels)` instead, the event
+        labels are the same (including ties, see `max_labels`).
         """
 
         log.info("Classifying DataFrame {}.".format(
             "WITH events" if classify_events else "WITHOUT events"
         ))
 
-        # build a sequence of images+metadata from the DataFrame
-        data_seq = DataFrameSequence(data, self.batch_size)
-
-        all_preds = []
-        # use the stored session graph to make predictions
-        with self.graph.as_default():
-                for batch_idx in range(len(data_seq)):
-                    if progress and not progress((batch_idx*100)/len(data_seq)):
-                        raise InterruptedError("Classification interrupted.")
-
-                    batch = data_seq[batch_idx]
-                    data_batch = data_to_matrix(batch)
-                    preds = self.model.predict_on_batch(data_batch)
-                    all_preds.extend(preds)
-
-        data['predict_probs'] = all_preds
+        event_groups = None
+        if classify_events:
+            if event_window is None:
+                event_groups = data['event_id']
+            else:
+                data['extended_event_id'] = extended_event_ids(data,
+                                                               event_window)
+                event_groups = data['extended_event_id']
+
+        empty = np.zeros(len(data), dtype=bool)
+        filter_secs = 0.0
+        if self.empty_filter is not None:
+            start = time.perf_counter()
+            empty = self.empty_filter.empty_mask(data)
+            filter_secs = time.perf_counter() - start
+
+        # the fingerprints are only computed if they are needed
+        if (self.dedup or self.prediction_store is not None) and \
+                'fingerprint' not in data:
+            add_fingerprints(data, self.decode_workers)
+
+        # only the frames not marked as empty are run through the model
+        keep = np.flatnonzero(~empty)
+        # and copies of an image (e.g. a card copied twice) only once
+        unique, copies = _unique_images(data, keep)
+        self.duplicates_skipped = len(keep) - len(unique)
+        if self.duplicates_skipped:
+            log.info("{} of {} images are copies, classifying {} unique "
+                     "images".format(self.duplicates_skipped, len(keep),
+                                     len(unique)))
+
+        # images classified before with this model are looked up
+        num_classes = len(self.class_labels)
+        stored = np.zeros(len(unique), dtype=bool)
+        unique_preds = np.full((len(unique), num_classes), np.nan,
+                               dtype=np.float32)
+        if self.prediction_store is not None and 'fingerprint' in data:
+            fingerprints = data['fingerprint'].values[unique]
+            stored, unique_preds = self.prediction_store.lookup(fingerprints,
+                                                                num_classes)
+            log.info("{} of {} images found in the prediction store".format(
+                stored.sum(), len(unique)))
+
+        todo = unique[~stored]
+        rows = data.iloc[todo] if len(todo) < len(data) else data
+        row_groups = None if event_groups is None \
+            else np.asarray(event_groups)[todo]
+
+        start = time.perf_counter()
+        if len(todo) == 0:
+            preds = unique_preds[:0]
+        elif classify_events and self.early_exit is not None:
+            preds = self._predict_early_exit(rows, row_groups, progress)
+        elif self.inference_pool is not None:
+            preds = self.inference_pool.predict(rows, row_groups, progress)
+        else:
+            preds = np.array(self._predict(rows, progress))
+        model_secs = time.perf_counter() - start
+
+        if self.empty_filter is not None:
+            log.info("Stages: empty filter {} images at {:.1f} images/sec, "
+                     "model {} images at {:.1f} images/sec".format(
+                         len(data), len(data) / max(filter_secs, 1e-9),
+                         len(rows), len(rows) / max(model_secs, 1e-9)))
+
+        if len(todo):
+            unique_preds[~stored] = preds
+            if self.prediction_store is not None and 'fingerprint' in data:
+                self.prediction_store.store(data['fingerprint'].values[todo],
+                                            preds)
+
+        all_preds = np.full((len(data), num_classes), np.nan,
+                            dtype=np.float32)
+        if len(keep):
+            all_preds[keep] = unique_preds[copies]
+        for idx, column in enumerate(probability_columns(self.class_labels)):
+            data[column] = all_preds[:, idx]
+
+        # frames without a prediction (filtered as empty or skipped by the
+        # early exit) are 'unknown'
+        unknown = self.class_labels.index('unknown') \
+            if 'unknown' in self.class_labels else 0
 
         # store the labels in the DataFrame. could just store indices
         # and resolve labels later, but for convenience we do it here
-        if not classify_events:
-            data['label'] = data['predict_probs'].apply(np.argmax)
+        # (an event gets the label of the maximum confidence prediction)
+        data['label'] = max_labels(all_preds, event_groups, unknown)
+
+        return data
+
+    def _predict(self, data: pd.DataFrame,
+                 progress: Callable[[int], bool] = None) -> List[np.ndarray]:
+        """Class probabilities of all rows, classified in this process."""
+        # build a sequence of images+metadata from the DataFrame
+        data_seq = DataFrameSequence(data, self.batch_size)
+        if self.decode_processes > 0:
+            batches = ring_batches(data_seq, self.decode_processes,
+                                   self.prefetch, self.decoder,
+                                   self.tensor_cache)
         else:
-            # event gets the label of the maximum confidence prediction
-            group_label = lambda x: np.argmax(np.concatenate(x.tolist())) \
-                                    % len(self.class_labels)
+            batches = decoded_batches(data_seq, self.decode_workers,
+                                      self.prefetch, self.decoder,
+                                      self.tensor_cache)
 
-            data['label'] = data['predict_probs'].\
-                            groupby(data['event_key_simple']).\
-                            transform(group_label)
+        all_preds = []
+        try:
+            for batch_idx, data_batch in enumerate(batches):
+                if progress and not progress((batch_idx*100)/len(data_seq)):
+                    raise InterruptedError("Classification interrupted.")
+
+                start = time.perf_counter()
+                preds = self.backend.predict(data_batch)
+                if "first batch" not in self.startup_times:
+                    self.startup_times["first batch"] = \
+                        time.perf_counter() - start
+                all_preds.extend(preds)
+        finally:
+            batches.close()
+
+        return all_preds
+
+    def _predict_early_exit(self, data: pd.DataFrame, event_groups,
+                            progress: Callable[[int], bool] = None) \
+            -> np.ndarray:
+        """Class probabilities, skipping frames after a confident one.
+
+        The events are classified in rounds, round i classifies the i-th
+        frame of every event without a confident frame yet, so batches
+        still hold frames of many events. Skipped frames are NaN.
+        """
+        ranks = _sequence_ranks(event_groups, data['sequence_idx'].values)
+        codes, _ = pd.factorize(np.asarray(event_groups), sort=False)
+        # classes that end an event early
+        exit_classes = [idx for idx, label in enumerate(self.class_labels)
+                        if label != 'unknown']
+
+        all_preds = None
+        open_events = np.ones(codes.max() + 1 if len(codes) else 0, bool)
+        done = 0
+        for rank in range(ranks.max() + 1 if len(ranks) else 0):
+            positions = np.flatnonzero((ranks == rank) & open_events[codes])
+            if len(positions) == 0:
+                break
+
+            round_progress = None
+            if progress:
+                round_progress = lambda p, done=done, size=len(positions): \
+                    progress((done + p * size / 100) * 100 / len(data))
+
+            rows = data.iloc[positions]
+            if self.inference_pool is not None:
+                preds = self.inference_pool.predict(rows, None,
+                                                    round_progress)
+            else:
+                preds = np.array(self._predict(rows, round_progress))
+
+            if all_preds is None:
+                all_preds = np.full((len(data), preds.shape[1]), np.nan,
+                                    dtype=preds.dtype)
+            all_preds[positions] = preds
+            done += len(positions)
+
+            confident = preds[:, exit_classes].max(axis=1) >= self.early_exit
+            open_events[codes[positions[confident]]] = False
+
+        self.inferences_saved = 1 - done / len(data) if len(data) else 0.0
+        log.info("Early exit classified {} of {} images, {:.1%} of the "
+                 "inferences saved".format(done, len(data),
+                                           self.inferences_saved))
+
+        if all_preds is None:
+            return np.empty((0, 0), dtype=np.float32)
+
+        return all_preds
+
+    def close(self):
+        """Release the model and close the prediction store."""
+        if self.backend is not None:
+            self.backend.close()
+        if self.inference_pool is not None:
+            self.inference_pool.close()
+        if self.prediction_store is not None:
+            self.prediction_store.close()
+
+    def classify_stream(self, chunks: Iterable[pd.DataFrame],
+                        classify_events: bool = True,
+                        event_window: float = None) \
+            -> Generator[pd.DataFrame, None, None]:
+        """Classify chunks of data as they arrive.
+
+        :param chunks: Iterable[pandas.DataFrame]
+            Data frames as generated by `iter_dir_metadata`. Chunks must
+            contain complete events if `classify_events` is set, i.e.
+            they should be read with the same `event_window`.
+        :param classify_events: bool
+            See `classify_data`.
+        :param event_window: float
+            See `classify_data`.
 
-        return data
+        :returns: Generator[pandas.DataFrame]
+            The chunks, each with a new 'label' column.
+        """
+        for chunk in chunks:
+            yield self.classify_data(chunk, classify_events=classify_events,
+                                     event_window=event_window)
 
     @staticmethod
     def dataframe_generator(data: pd.DataFrame, batch_size: int) \
@@ -154,8 +546,79 @@ class ImageClassifier:
             yield data_batch
 
 
-class DataFrameSequence(keras.utils.Sequence):
-    """Holds a sequence of classification derived from a dataframe."""
+def decoded_batches(data_seq: 'DataFrameSequence', workers: int = 1,
+                    prefetch: int = 0, decoder=None,
+                    cache: TensorCache = None) \
+        -> Generator[List[np.ndarray], None, None]:
+    """Yield the network input of all batches of the sequence, in order.
+
+    With `prefetch` > 0, up to that many batches after the current one are
+    decoded by a pool of `workers` threads (the JPEG decoding releases the
+    GIL), so the decoding runs while the model classifies. The images of
+    a batch are decoded in parallel if there are more workers than
+    prefetched batches. Batches not yet started are cancelled when the
+    generator is closed early, e.g. on an interrupted classification.
+
+    Images in the tensor `cache` are not decoded again.
+
+    The inputs are views of reused `BatchBuffer`s, they are only valid
+    until the next batch is requested.
+    """
+    decoder = decoder or get_decoder()
+
+    if prefetch <= 0:
+        buffer = BatchBuffer(data_seq.batch_size, decoder)
+        for batch_idx in range(len(data_seq)):
+            yield _fill_batch(buffer, data_seq[batch_idx], 0, cache)
+        return
+
+    workers = max(1, workers)
+    # split batches into parts, so that all workers have something to do
+    parts = max(1, workers // prefetch)
+
+    # the prefetched batches and the one being classified each need a
+    # buffer, a buffer is reused once its batch has been classified
+    buffers = [BatchBuffer(data_seq.batch_size, decoder)
+               for _ in range(prefetch + 1)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for batch_idx in range(len(data_seq)):
+                batch = data_seq[batch_idx]
+                buffer = buffers[batch_idx % len(buffers)]
+                part_size = int(np.ceil(len(batch) / parts))
+                futures = [executor.submit(_fill_batch, buffer,
+                                           batch[pos:pos + part_size], pos,
+                                           cache)
+                           for pos in range(0, len(batch), part_size)]
+                pending.append((buffer, len(batch), futures))
+
+                if len(pending) > prefetch:
+                    yield _wait_for_batch(*pending.popleft())
+
+            while pending:
+                yield _wait_for_batch(*pending.popleft())
+        finally:
+            for _, _, futures in pending:
+                for future in futures:
+                    future.cancel()
+
+
+def _wait_for_batch(buffer: BatchBuffer, size: int,
+                    futures) -> List[np.ndarray]:
+    """Wait until all parts of a batch are decoded into its buffer."""
+    for future in futures:
+        future.result()
+
+    return buffer.inputs(size)
+
+
+class DataFrameSequence:
+    """Holds a sequence of classification derived from a dataframe.
+
+    Like a `keras.utils.Sequence`, without importing Keras.
+    """
 
     def __init__(self, data: pd.DataFrame, batch_size: int):
         self.data = data
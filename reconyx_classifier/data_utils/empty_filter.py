@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import logging
+
+filter_log = logging.getLogger("empty_filter")
+
+# (width, height) the frames are compared at
+THUMB_SIZE = (64, 48)
+# fraction of the height cropped at the top and bottom, where the
+# Reconyx info bars show the changing time and temperature
+INFO_BAR = 0.08
+# a pixel changed if it differs from the event background by this much
+PIXEL_CHANGE = 25.0
+
+
+def load_thumbnail(path: str, size: Tuple[int, int] = THUMB_SIZE) \
+        -> np.ndarray:
+    """Small grayscale version of the image, without the info bars.
+
+    The JPEG is decoded at reduced scale (`Image.draft`), so this costs
+    a fraction of the full decode.
+    """
+    with Image.open(path) as img:
+        img.draft('L', (size[0] * 2, size[1] * 2))
+        img = img.convert('L')
+        bar = int(img.height * INFO_BAR)
+        img = img.crop((0, bar, img.width, img.height - bar))
+        thumb = np.asarray(img.resize(size, Image.BILINEAR),
+                           dtype=np.float32)
+
+    # compensate exposure changes between the frames of an event
+    return thumb - thumb.mean()
+
+
+def _event_scores(thumbs: np.ndarray) -> np.ndarray:
+    """Fraction of changed pixels of every frame of an event.
+
+    The background is the per-pixel median of the frames, so a frame
+    with an animal passing through differs from it.
+    """
+    background = np.median(thumbs, axis=0)
+    changed = np.abs(thumbs - background) > PIXEL_CHANGE
+    return changed.reshape(len(thumbs), -1).mean(axis=1)
+
+
+def motion_scores(data: pd.DataFrame, workers: int = 1) -> np.ndarray:
+    """Motion score of every row, computed within its trigger sequence.
+
+    Frames of single-frame events, which have nothing to be compared
+    to, get an infinite score, so they are never filtered.
+
+    :param data: pandas.DataFrame
+        Rows with 'path' and 'event_id'.
+    :param workers: int
+        Number of threads decoding the thumbnails.
+    """
+    scores = np.full(len(data), np.inf)
+    codes, _ = pd.factorize(data['event_id'].values, sort=False)
+    order = np.argsort(codes, kind="mergesort")
+    sorted_codes = codes[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1],
+                                  True])
+
+    paths = data['path'].values
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end - start < 2:
+                continue
+
+            positions = order[start:end]
+            thumbs = np.stack(list(executor.map(load_thumbnail,
+                                                paths[positions])))
+            scores[positions] = _event_scores(thumbs)
+
+    return scores
+
+
+def recall_threshold(scores: np.ndarray, is_animal: np.ndarray,
+                     recall: float) -> float:
+    """Largest threshold that keeps at least `recall` of the animal frames.
+
+    Frames with a score below the threshold are marked empty.
+    """
+    animal_scores = np.sort(scores[is_animal])
+    if len(animal_scores) == 0:
+        raise ValueError("No animal frames to calibrate the threshold")
+
+    idx = min(int((1 - recall) * len(animal_scores)), len(animal_scores) - 1)
+    return float(animal_scores[idx])
+
+
+class EmptyFrameFilter:
+    """First classification stage, marking clearly empty frames.
+
+    Frames whose motion score (see `motion_scores`) is below `threshold`
+    are taken to be wind or grass triggers and are not passed to the
+    main model. Use scripts/validate_empty_filter.py to choose the
+    threshold for a target recall of the animal frames.
+    """
+
+    def __init__(self, threshold: float, workers: int = 1):
+        self.threshold = threshold
+        self.workers = workers
+
+    def empty_mask(self, data: pd.DataFrame) -> np.ndarray:
+        """Boolean mask of the rows that are empty frames."""
+        empty = motion_scores(data, self.workers) < self.threshold
+        filter_log.info("{} of {} images are empty frames".format(
+            empty.sum(), len(data)))
+        return empty
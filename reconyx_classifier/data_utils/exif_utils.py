@@ -1,6 +1,8 @@
 import struct
-import array
+from collections import namedtuple
+from typing import Dict
 
+import numpy as np
 import exifread
 import datetime
 
@@ -12,123 +14,326 @@ exif_log = logging.getLogger("exif_utils")
 
 
 class Info(object):
-    offset = None
-    name = None
-    fmt = None
+    """A field of the Reconyx MakerNote, stored at a fixed byte offset."""
 
-    def __init__(self, name, offset, fmt):
+    def __init__(self, name, offset, fmt, fields):
         self.name = name
         self.offset = offset
         self.fmt = fmt
+        # names of the values the field unpacks to
+        self.fields = fields
+        self.struct = struct.Struct("<" + fmt)
 
     def read(self, blob):
-        global RECONYX_INFOS
-        idx = RECONYX_INFOS.index(self)
-        next_offset = len(blob)
-        if idx + 1 < len(RECONYX_INFOS):
-            next_offset = RECONYX_INFOS[idx + 1].offset
+        """Decode only this field, None-filled if the blob is too short."""
+        if len(blob) < self.offset + self.struct.size:
+            return (None,) * len(self.fields)
 
-        size = next_offset - self.offset
-        subbuffer = blob[self.offset:next_offset]
-        req_size = struct.calcsize(self.fmt)
-
-        if size > req_size:
-            subbuffer = blob[self.offset:(self.offset + req_size)]
-
-        try:
-            val = struct.unpack(self.fmt, subbuffer)
-
-            try:
-                if len(val) == 1:
-                    val = val[0]
-            except:
-                pass
-
-            return val
-        except Exception as e:
-            print(str(e))
-            print("\tint {}, len {}".format(self.name, size))
-            return None
+        return self.struct.unpack_from(blob, self.offset)
 
 
 # global constant with the metadata we want to extract
 RECONYX_INFOS = [
-    Info("Makernote Version", 0x0000, "H"),
-    Info("Firmware Version", 0x0002, "H"),
-    Info("Trigger Mode", 0x000c, "2s"),
-    Info("Sequence", 0x000e, "2H"),
-    Info("Event Number", 0x0012, "2H"),
-    Info("Date/Time Original", 0x0016, "6H"),
-    Info("Moon Phase", 0x0024, "H"),
-    Info("Ambient Temperature Fahrenheit", 0x0026, "h"),
-    Info("Ambient Temperature", 0x0028, "h"),
-    Info("Serial Number", 0x002a, "30s"),
-    Info("Contrast", 0x0048, "H"),
-    Info("Brightness", 0x004a, "H"),
-    Info("Sharpness", 0x004c, "H"),
-    Info("Saturation", 0x004e, "H"),
-    Info("Infrared Illuminator", 0x0050, "H"),
-    Info("Motion Sensitivity", 0x0052, "H"),
-    Info("Battery Voltage", 0x0054, "H"),
-    Info("User Label", 0x0056, "22s"),
+    Info("Makernote Version", 0x0000, "H", ["version"]),
+    Info("Firmware Version", 0x0002, "H", ["firmware_version"]),
+    Info("Trigger Mode", 0x000c, "2s", ["trigger_mode"]),
+    Info("Sequence", 0x000e, "2H", ["sequence_idx", "sequence_max"]),
+    Info("Event Number", 0x0012, "2H", ["event1", "event2"]),
+    Info("Date/Time Original", 0x0016, "6H",
+         ["second", "minute", "hour", "month", "day", "year"]),
+    Info("Moon Phase", 0x0024, "H", ["moon_phase"]),
+    Info("Ambient Temperature Fahrenheit", 0x0026, "h",
+         ["ambient_temp_fahrenheit"]),
+    Info("Ambient Temperature", 0x0028, "h", ["ambient_temp"]),
+    Info("Serial Number", 0x002a, "30s", ["serial_no"]),
+    Info("Contrast", 0x0048, "H", ["contrast"]),
+    Info("Brightness", 0x004a, "H", ["brightness"]),
+    Info("Sharpness", 0x004c, "H", ["sharpness"]),
+    Info("Saturation", 0x004e, "H", ["saturation"]),
+    Info("Infrared Illuminator", 0x0050, "H", ["infrared_illuminator"]),
+    Info("Motion Sensitivity", 0x0052, "H", ["motion_sensitivity"]),
+    Info("Battery Voltage", 0x0054, "H", ["battery_voltage"]),
+    Info("User Label", 0x0056, "22s", ["user_label"]),
 ]
 
 RECONYX_MAKERNOTE_VERSION = 61697
 
+# NumPy equivalents of the integer struct codes used in the MakerNote
+_DTYPE_CODES = {"H": "<u2", "h": "<i2"}
+
+
+def _compile_struct(infos):
+    """Build a single little-endian struct covering all fields."""
+    fmt = "<"
+    pos = 0
+    for info in infos:
+        if info.offset < pos:
+            raise ValueError("Overlapping MakerNote field '{}'"
+                             .format(info.name))
+
+        if info.offset > pos:
+            fmt += "{}x".format(info.offset - pos)
+
+        fmt += info.fmt
+        pos = info.offset + info.struct.size
+
+    return struct.Struct(fmt)
+
+
+def _compile_dtype(infos, itemsize):
+    """Build a NumPy structured dtype with the same layout as the struct."""
+    names, formats, offsets = [], [], []
+    for info in infos:
+        # byte strings stay one field, integer tuples get a field per value
+        if info.fmt.endswith("s"):
+            names.append(info.fields[0])
+            formats.append("S{}".format(info.struct.size))
+            offsets.append(info.offset)
+            continue
+
+        code = info.fmt[-1]
+        for j, field in enumerate(info.fields):
+            names.append(field)
+            formats.append(_DTYPE_CODES[code])
+            offsets.append(info.offset + j * struct.calcsize(code))
+
+    return np.dtype({"names": names, "formats": formats,
+                     "offsets": offsets, "itemsize": itemsize})
+
+
+# the layout is compiled once, decoding a MakerNote is then a single call
+RECONYX_STRUCT = _compile_struct(RECONYX_INFOS)
+RECONYX_MAKERNOTE_SIZE = RECONYX_STRUCT.size
+RECONYX_DTYPE = _compile_dtype(RECONYX_INFOS, RECONYX_MAKERNOTE_SIZE)
+
+MakerNote = namedtuple("MakerNote",
+                       [field for info in RECONYX_INFOS
+                        for field in info.fields])
+
+
+def _decode(makernote) -> MakerNote:
+    """Decode the raw MakerNote bytes into a MakerNote tuple."""
+    if not isinstance(makernote, bytes):
+        makernote = bytes(makernote)
+
+    if len(makernote) >= RECONYX_MAKERNOTE_SIZE:
+        return MakerNote._make(RECONYX_STRUCT.unpack_from(makernote))
+
+    # truncated MakerNote, decode what is there and leave the rest empty
+    exif_log.debug("Short MakerNote with {} bytes".format(len(makernote)))
+    return MakerNote._make(value for info in RECONYX_INFOS
+                           for value in info.read(makernote))
+
+
+def _decode_serial(serial_no: bytes) -> str:
+    """The serial number is UTF-16 encoded, we just drop the zero bytes."""
+    return serial_no.replace(b"\x00", b"").decode("latin-1")
+
+
+def decode_makernote_batch(makernotes) -> Dict[str, np.ndarray]:
+    """Decode many raw MakerNotes into columnar arrays in one call.
+
+    :param makernotes: Sequence[bytes]
+        Raw MakerNote blobs as read from the image files.
+    :return: Dict[str, numpy.ndarray]
+        One array per MakerNote field (see `MakerNote`), with the serial
+        number decoded to str, plus a 'datetime' (datetime64) column and
+        a boolean 'valid' column. Rows with a truncated MakerNote or the
+        wrong Makernote version are zero-filled and marked as not valid.
+    """
+    size = RECONYX_MAKERNOTE_SIZE
+    buffer = b"".join(bytes(note[:size]).ljust(size, b"\x00")
+                      for note in makernotes)
+    records = np.frombuffer(buffer, dtype=RECONYX_DTYPE)
+
+    columns = {name: np.ascontiguousarray(records[name])
+               for name in RECONYX_DTYPE.names}
+
+    columns["valid"] = \
+        np.array([len(note) >= size for note in makernotes], dtype=bool) & \
+        (columns["version"] == RECONYX_MAKERNOTE_VERSION)
+
+    # only a handful of distinct cameras, decode each serial number once
+    serials, serial_idx = np.unique(columns["serial_no"], return_inverse=True)
+    serials = np.array([_decode_serial(raw) for raw in serials], dtype=object)
+    columns["serial_no"] = serials[serial_idx]
+
+    # assemble the timestamp, invalid rows get the epoch
+    valid = columns["valid"]
+    date = {name: np.where(valid, columns[name], 0).astype(np.int64)
+            for name in ("year", "month", "day", "hour", "minute", "second")}
+    months = np.where(valid, (date["year"] - 1970) * 12 + date["month"] - 1, 0)
+    columns["datetime"] = \
+        months.astype("datetime64[M]").astype("datetime64[s]") + \
+        np.where(valid, date["day"] - 1, 0).astype("timedelta64[D]") + \
+        date["hour"].astype("timedelta64[h]") + \
+        date["minute"].astype("timedelta64[m]") + \
+        date["second"].astype("timedelta64[s]")
 
-def _unpack(makernote):
-    global RECONYX_INFOS
+    return columns
 
-    makernote_bin = array.array('B', makernote)
 
-    res = {}
-    for info in RECONYX_INFOS:
-        res[info.name] = info.read(makernote_bin.tobytes())
+# JPEG markers and TIFF tags needed to locate the MakerNote
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP1 = 0xe1
+JPEG_SOS = 0xda
+EXIF_HEADER = b'Exif\x00\x00'
+TAG_EXIF_IFD_POINTER = 0x8769
+TAG_MAKERNOTE = 0x927c
 
-    return res
+# IFD entries are (tag, type, count, value/offset) in either byte order
+IFD_ENTRY_STRUCTS = {'<': struct.Struct('<HHII'), '>': struct.Struct('>HHII')}
 
 
-def _read_im_exif(file_path):
+class TruncatedExifError(ValueError):
+    """The file ends inside its EXIF data, e.g. a partial copy."""
+
+
+def _find_ifd_entry(f, tiff_start, byte_order, ifd_offset, tag):
+    """Return (count, value/offset field) of `tag` in the IFD at ifd_offset."""
+    f.seek(tiff_start + ifd_offset)
+    raw = f.read(2)
+    if len(raw) != 2:
+        raise TruncatedExifError("Truncated IFD at offset {}".format(
+            ifd_offset))
+    num_entries, = struct.unpack(byte_order + 'H', raw)
+
+    entries = f.read(12 * num_entries)
+    if len(entries) != 12 * num_entries:
+        raise TruncatedExifError("Truncated IFD at offset {}".format(
+            ifd_offset))
+
+    entry_struct = IFD_ENTRY_STRUCTS[byte_order]
+    for pos in range(0, len(entries), 12):
+        entry_tag, _, count, value = entry_struct.unpack_from(entries, pos)
+        if entry_tag == tag:
+            return count, value
+
+    raise ValueError("Tag 0x{:04x} not found in IFD".format(tag))
+
+
+def _read_makernote_fast(file_path):
+    """Read the raw MakerNote bytes by walking the JPEG APP1/TIFF structure.
+
+    Only the segment headers, the two IFDs on the way and the MakerNote
+    itself are read from disk. Raises ValueError if the file does not
+    have the expected layout, so the caller can fall back to exifread,
+    and TruncatedExifError if the file ends inside the EXIF data.
+    """
     with open(file_path, 'rb') as f:
-        tags = exifread.process_file(f, stop_tag='EXIF MakerNote')
+        if f.read(2) != JPEG_SOI:
+            raise ValueError("Not a JPEG file")
+
+        # skip through the segments until we find the EXIF APP1 segment
+        while True:
+            marker = f.read(4)
+            if len(marker) != 4 or marker[0] != 0xff or marker[1] == JPEG_SOS:
+                raise ValueError("No EXIF APP1 segment found")
+
+            seg_len, = struct.unpack('>H', marker[2:])
+            seg_start = f.tell()
+            if marker[1] == JPEG_APP1 and f.read(6) == EXIF_HEADER:
+                break
+
+            # the segment length includes the two length bytes
+            f.seek(seg_start + seg_len - 2)
+
+        tiff_start = f.tell()
+        tiff_header = f.read(8)
+        if len(tiff_header) != 8:
+            raise TruncatedExifError("Truncated TIFF header")
+        if tiff_header[:2] == b'II':
+            byte_order = '<'
+        elif tiff_header[:2] == b'MM':
+            byte_order = '>'
+        else:
+            raise ValueError("Invalid TIFF byte order")
+
+        magic, ifd0_offset = struct.unpack(byte_order + 'HI', tiff_header[2:])
+        if magic != 42:
+            raise ValueError("Invalid TIFF header")
+
+        _, exif_offset = _find_ifd_entry(f, tiff_start, byte_order,
+                                         ifd0_offset, TAG_EXIF_IFD_POINTER)
+        count, value = _find_ifd_entry(f, tiff_start, byte_order,
+                                       exif_offset, TAG_MAKERNOTE)
+
+        # values of at most 4 bytes are stored inline in the entry
+        if count <= 4:
+            raise ValueError("MakerNote too short")
 
+        f.seek(tiff_start + value)
+        makernote = f.read(count)
+        if len(makernote) != count:
+            raise TruncatedExifError("Truncated MakerNote")
+
+    return makernote
+
+
+def _read_makernote_exifread(file_path):
+    # exifread fails with these on truncated files, e.g. partial copies
     try:
-        makernote_dict = _unpack(tags['EXIF MakerNote'].values)
+        with open(file_path, 'rb') as f:
+            tags = exifread.process_file(f, stop_tag='EXIF MakerNote')
+    except (IndexError, struct.error) as e:
+        raise ValueError("Corrupt EXIF data: {}".format(e)) from e
+
+    try:
+        return tags['EXIF MakerNote'].values
     except KeyError as e:
         raise KeyError("File has no EXIF MakerNote tag") from e
 
-    # we only consider images with the right Makernote version
+
+def _read_makernote(file_path):
+    """Read the raw MakerNote, using exifread only if the fast path fails."""
     try:
-        if makernote_dict['Makernote Version'] != RECONYX_MAKERNOTE_VERSION:
-            raise ValueError("Found Makernote Version {} instead of {}".format(
-                makernote_dict['Makernote Version'],
-                RECONYX_MAKERNOTE_VERSION))
-    except KeyError as e:
-        raise KeyError("File has no Makernote Version attribute.") from e
+        return _read_makernote_fast(file_path)
+    except TruncatedExifError:
+        # exifread reads zeros past the end of the file, don't let it
+        # return a zero-padded MakerNote
+        raise
+    except ValueError as err:
+        exif_log.debug("Fast MakerNote read failed for '{}' ({}), "
+                       "falling back to exifread".format(file_path, err))
+
+    return _read_makernote_exifread(file_path)
+
+
+def _read_im_exif(file_path) -> MakerNote:
+    makernote = _decode(_read_makernote(file_path))
+
+    # we only consider images with the right Makernote version
+    if makernote.version != RECONYX_MAKERNOTE_VERSION:
+        raise ValueError("Found Makernote Version {} instead of {}".format(
+            makernote.version, RECONYX_MAKERNOTE_VERSION))
+
+    # fields beyond the end of a truncated MakerNote are None
+    if None in makernote:
+        raise ValueError("Truncated MakerNote")
 
-    return makernote_dict
+    return makernote
 
 
 def make_exif_dict(image_path, file_name):
     """Create a dictionary with metadata extracted from the image file."""
     meta = _read_im_exif(image_path)
 
-    s, m, h, M, D, Y = meta["Date/Time Original"]
     exif_dict = {
         "filename": file_name,
         "path": image_path,
-        "datetime": datetime.datetime(Y, M, D, h, m, s),
-        "event1": meta["Event Number"][0],
-        "event2": meta["Event Number"][1],
-        "sequence_idx": meta["Sequence"][0],
-        "sequence_max": meta["Sequence"][1],
-        "ambient_temp": meta["Ambient Temperature"],
-        "hour": h,
-        "brightness": meta["Brightness"],
-        "sharpness": meta["Sharpness"],
-        "saturation": meta["Saturation"],
-        "contrast": meta["Contrast"],
-        "serial_no": "".join([chr(c) for c in meta["Serial Number"] if c != 0])
+        "datetime": datetime.datetime(meta.year, meta.month, meta.day,
+                                      meta.hour, meta.minute, meta.second),
+        "event1": meta.event1,
+        "event2": meta.event2,
+        "sequence_idx": meta.sequence_idx,
+        "sequence_max": meta.sequence_max,
+        "ambient_temp": meta.ambient_temp,
+        "hour": meta.hour,
+        "brightness": meta.brightness,
+        "sharpness": meta.sharpness,
+        "saturation": meta.saturation,
+        "contrast": meta.contrast,
+        "serial_no": _decode_serial(meta.serial_no)
     }
 
     return exif_dict
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import logging
+
+decode_log = logging.getLogger("image_decoder")
+
+# optional decoders, used if installed
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import turbojpeg
+    _turbojpeg = turbojpeg.TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    turbojpeg = None
+    _turbojpeg = None
+
+# the decoder used unless another one is chosen, the pixels of the fast
+# decoders differ slightly from it (see scripts/benchmark_decoders.py)
+DEFAULT_DECODER = 'full'
+
+# JPEG can be decoded at 1/1, 1/2, 1/4 and 1/8 scale in the DCT domain
+JPEG_SCALE_DENOMINATORS = [8, 4, 2, 1]
+
+
+def _reduction(image_size: Tuple[int, int], target_size: Tuple[int, int]) -> int:
+    """Largest JPEG scale denominator that keeps the image >= target_size.
+
+    :param image_size: (width, height) of the stored image.
+    :param target_size: (height, width) as used by Keras.
+    """
+    width, height = image_size
+    target_height, target_width = target_size
+    for denominator in JPEG_SCALE_DENOMINATORS:
+        if width // denominator >= target_width and \
+                height // denominator >= target_height:
+            return denominator
+
+    return 1
+
+
+def _resize_pil(img: Image.Image, target_size) -> np.ndarray:
+    """Convert to RGB and resize like `keras.preprocessing.image.load_img`."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    width_height = (target_size[1], target_size[0])
+    if img.size != width_height:
+        img = img.resize(width_height, Image.NEAREST)
+
+    return np.asarray(img, dtype=np.uint8)
+
+
+def decode_full(path: str, target_size) -> np.ndarray:
+    """Decode at full resolution, then resize (the `load_img` reference)."""
+    with Image.open(path) as img:
+        return _resize_pil(img, target_size)
+
+
+def decode_pil_draft(path: str, target_size) -> np.ndarray:
+    """Let libjpeg decode at the smallest scale that covers target_size."""
+    with Image.open(path) as img:
+        img.draft('RGB', (target_size[1], target_size[0]))
+        return _resize_pil(img, target_size)
+
+
+def decode_opencv(path: str, target_size) -> np.ndarray:
+    """Reduced resolution read with OpenCV (IMREAD_REDUCED_COLOR_*)."""
+    # only the header is parsed to get the size
+    with Image.open(path) as img:
+        denominator = _reduction(img.size, target_size)
+
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+             4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+    img = cv2.imread(path, flags[denominator])
+    if img is None:
+        raise OSError("OpenCV could not read '{}'".format(path))
+
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    if img.shape[:2] != tuple(target_size):
+        img = cv2.resize(img, (target_size[1], target_size[0]),
+                         interpolation=cv2.INTER_NEAREST)
+
+    return img
+
+
+def decode_turbojpeg(path: str, target_size) -> np.ndarray:
+    """Scaled decoding with libjpeg-turbo through PyTurboJPEG."""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    width, height, _, _ = _turbojpeg.decode_header(data)
+    denominator = _reduction((width, height), target_size)
+    img = _turbojpeg.decode(data, scaling_factor=(1, denominator),
+                            pixel_format=turbojpeg.TJPF_RGB)
+
+    if img.shape[:2] != tuple(target_size):
+        img = _resize_pil(Image.fromarray(img), target_size)
+
+    return img
+
+
+def available_decoders() -> Dict[str, Callable[[str, Tuple[int, int]],
+                                               np.ndarray]]:
+    """The usable decoders by name, fastest first."""
+    decoders = OrderedDict()
+    if _turbojpeg is not None:
+        decoders['turbojpeg'] = decode_turbojpeg
+    if cv2 is not None:
+        decoders['opencv'] = decode_opencv
+    decoders['pil_draft'] = decode_pil_draft
+    decoders['full'] = decode_full
+
+    return decoders
+
+
+def get_decoder(name: str = None) -> Callable[[str, Tuple[int, int]],
+                                              np.ndarray]:
+    """Return the decoder with the given name, by default 'full'.
+
+    Decoders are called as `decoder(path, target_size)` and return an
+    uint8 RGB array of shape target_size + (3,). 'full' decodes like
+    `keras.preprocessing.image.load_img`, which the model was trained
+    with. All others use reduced resolution decoding, which is faster
+    but changes the pixels slightly, and fall back to a full decode
+    for images smaller than twice the target size.
+    """
+    decoders = available_decoders()
+    name = name or DEFAULT_DECODER
+    decode_log.debug("Using '{}' image decoder".format(name))
+
+    try:
+        return decoders[name]
+    except KeyError:
+        raise ValueError("Image decoder '{}' not available, choose from {}"
+                         .format(name, decoder_names())) from None
+
+
+def decoder_names() -> List[str]:
+    return list(available_decoders())
+
@@ -0,0 +1,239 @@
+import os
+import time
+import queue
+import multiprocessing
+from collections import OrderedDict
+from typing import Callable, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .backends import create_backend
+from .tensor_cache import TensorCache
+
+import logging
+
+pool_log = logging.getLogger("inference_pool")
+
+# seconds to wait for results before checking the workers are alive
+RESULT_POLL_SECS = 1.0
+# seconds to wait for worker processes to exit on close
+SHUTDOWN_SECS = 10.0
+
+# a task holds whole events with about this many batches of images
+TASK_BATCHES = 4
+
+
+def _inference_worker(model_path, backend, threads, batch_size, decoder,
+                      decode_workers, prefetch, cache, tasks, results, job):
+    """Inference process: classify tasks until a None task is received.
+
+    Tasks are (job_id, positions, paths, temperatures, hours), answered
+    with (job_id, positions, predictions or error, seconds of the first
+    batch of the process or None). Tasks of a cancelled job (job_id !=
+    job.value) are skipped. The first result after startup is
+    (None, model load timings, error or None), once the model is loaded.
+    The images are decoded like in the main process (see
+    `classifier.decoded_batches`).
+    """
+    # imported here, the classifier module imports this one
+    from .classifier import DataFrameSequence, decoded_batches
+
+    try:
+        model = create_backend(backend, model_path, threads, 1)
+    except Exception as err:
+        results.put((None, None, err))
+        return
+    results.put((None, model.timings, None))
+
+    first_batch = True
+    for task in iter(tasks.get, None):
+        job_id, positions, paths, temperatures, hours = task
+        if job_id != job.value:
+            continue
+
+        data = pd.DataFrame(OrderedDict([("path", paths),
+                                         ("ambient_temp", temperatures),
+                                         ("hour", hours)]))
+        batches = decoded_batches(DataFrameSequence(data, batch_size),
+                                  decode_workers, prefetch, decoder, cache)
+        first_secs = None
+        try:
+            preds = []
+            for inputs in batches:
+                start = time.perf_counter()
+                preds.append(model.predict(inputs))
+                if first_batch:
+                    first_secs = time.perf_counter() - start
+                    first_batch = False
+            results.put((job_id, positions, np.concatenate(preds),
+                         first_secs))
+        except Exception as err:
+            results.put((job_id, positions, err, first_secs))
+        finally:
+            batches.close()
+
+
+def shard_by_group(groups: np.ndarray, task_size: int) -> List[np.ndarray]:
+    """Split the row positions into tasks of whole groups.
+
+    Groups are packed into tasks of at least `task_size` rows, in the
+    order they first appear in, a group is never split between tasks.
+    """
+    codes, _ = pd.factorize(groups, sort=False)
+    order = np.argsort(codes, kind="mergesort")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+
+    tasks = []
+    task_start = 0
+    for group_start in starts[1:]:
+        if group_start - task_start >= task_size:
+            tasks.append(order[task_start:group_start])
+            task_start = group_start
+    if task_start < len(order):
+        tasks.append(order[task_start:])
+
+    return tasks
+
+
+class InferencePool:
+    """Worker processes with one model each, classifying whole events.
+
+    Every process loads the model once and uses `threads` intra-op
+    threads, by default the CPU cores divided by the number of
+    processes, so the processes together use all cores without
+    oversubscribing them. Each process decodes its images with
+    `decode_workers` threads, `prefetch` batches ahead, using the tensor
+    `cache` if given.
+
+    `startup_times` holds the seconds of the model loading steps (of the
+    slowest process) and of the first batch.
+    """
+
+    def __init__(self, processes: int, model_path: str, batch_size: int,
+                 backend: str = None, decoder: Callable = None,
+                 threads: int = None, decode_workers: int = 1,
+                 prefetch: int = 0, cache: TensorCache = None):
+        self.batch_size = batch_size
+        threads = threads or max(1, (os.cpu_count() or 1) // processes)
+        self.startup_times = OrderedDict()
+
+        # spawn, forking a process with an initialized TensorFlow is unsafe
+        context = multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.job = context.Value('i', 0)
+        self.workers = [context.Process(
+            target=_inference_worker, daemon=True,
+            args=(model_path, backend, threads, batch_size, decoder,
+                  decode_workers, prefetch, cache, self.tasks, self.results,
+                  self.job))
+            for _ in range(processes)]
+
+        for worker in self.workers:
+            worker.start()
+
+        try:
+            for _ in self.workers:
+                _, timings, err = self._next_result()
+                if err is not None:
+                    raise err
+
+                # the processes load the model in parallel
+                for step, secs in timings.items():
+                    self.startup_times[step] = max(
+                        secs, self.startup_times.get(step, 0.0))
+        except Exception:
+            self.close()
+            raise
+
+        pool_log.info("Started {} inference processes with {} threads each"
+                      .format(processes, threads))
+
+    def _next_result(self):
+        while True:
+            try:
+                return self.results.get(timeout=RESULT_POLL_SECS)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("Inference process died")
+
+    def _cancel(self):
+        """Skip the queued tasks of the current job."""
+        with self.job.get_lock():
+            self.job.value += 1
+
+    def predict(self, data: pd.DataFrame, groups: Sequence = None,
+                progress: Callable[[int], bool] = None) -> np.ndarray:
+        """Class probabilities of all rows, in the order of the rows.
+
+        :param data: pandas.DataFrame
+            Rows with 'path', 'ambient_temp' and 'hour'.
+        :param groups: Sequence
+            The event of every row, the rows of an event are classified
+            by the same process. By default, rows are split arbitrarily.
+        :param progress: Callable[[int], bool]
+            Called with the percentage of classified rows, the
+            classification is interrupted if it returns False.
+        """
+        if groups is None:
+            groups = np.arange(len(data))
+
+        task_size = self.batch_size * TASK_BATCHES
+        shards = shard_by_group(np.asarray(groups), task_size)
+
+        job_id = self.job.value
+        paths = data['path'].values
+        temperatures = data['ambient_temp'].values
+        hours = data['hour'].values
+        for positions in shards:
+            self.tasks.put((job_id, positions, list(paths[positions]),
+                            temperatures[positions], hours[positions]))
+
+        preds = None
+        done = 0
+        try:
+            while done < len(data):
+                if progress and not progress(done * 100 / len(data)):
+                    raise InterruptedError("Classification interrupted.")
+
+                result_job, positions, result, first_secs = \
+                    self._next_result()
+                if first_secs is not None and \
+                        "first batch" not in self.startup_times:
+                    self.startup_times["first batch"] = first_secs
+
+                # results of an earlier, interrupted job
+                if result_job != job_id:
+                    continue
+
+                if isinstance(result, Exception):
+                    raise result
+
+                if preds is None:
+                    preds = np.empty((len(data), result.shape[1]),
+                                     dtype=result.dtype)
+                preds[positions] = result
+                done += len(positions)
+        except BaseException:
+            self._cancel()
+            raise
+
+        if preds is None:
+            return np.empty((0, 0), dtype=np.float32)
+
+        return preds
+
+    def close(self):
+        self._cancel()
+        for _ in self.workers:
+            self.tasks.put(None)
+        self.tasks.cancel_join_thread()
+
+        for worker in self.workers:
+            worker.join(SHUTDOWN_SECS)
+            if worker.is_alive():
+                pool_log.warning("Terminating inference process {}"
+                                 .format(worker.pid))
+                worker.terminate()
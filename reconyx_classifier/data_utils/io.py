@@ -1,46 +1,86 @@
 from typing import List
 
 import os
+import array
+import queue
+import hashlib
+import datetime
 import pathlib
 import shutil
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 import pandas as pd
 
 from .exif_utils import make_exif_dict
+from .metadata_cache import MetadataCache, QUERY_CHUNK, file_identity
 
 import logging
 
 log_in = logging.getLogger("reader")
 log_out = logging.getLogger("writer")
 
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+# bytes hashed at the start and at the end of a file for its fingerprint
+FINGERPRINT_BYTES = 64 * 1024
+
+# newly read files are written to the metadata cache in batches of this
+CACHE_UPDATE_BATCH = 1000
+
 
 def _check_duplicates(data: pd.DataFrame):
+    """Mark events that contain duplicate images in a 'duplicates' column.
+
+    An event has duplicates if a sequence_idx occurs more than once in
+    it. If the image just occurred twice, the event is marked 1 (it can
+    be deduplicated), if the duplicates had different labels it is
+    marked 2 (it should be removed from the set), else 0.
+    """
     # group into distinct events (usually 3 images per event)
-    event_groups = data.groupby('event_key_simple')
-
-    duplicate_col = np.zeros(data.shape[0], dtype=np.uint8)
-
-    # for all events, check if there are duplicate images
-    # (i.e. duplicate sequnce_idx at the same time point)
-    for group in event_groups:
-        sequence_group = group[1].groupby(['sequence_idx'])
-        group_index = data.event_key_simple == group[0]
-        duplicate_ids = any(sequence_group['sequence_idx'].count() > 1)
-
-        # for duplicate ids:
-        # if the image just occurred twice         -> deduplicate
-        # if the duplicates had different labels   -> remove from set
-        if duplicate_ids:
-            # different labels
-            if group[1]['label'].unique().size > 1:
-                duplicate_col[group_index] = 2
-            else:
-                duplicate_col[group_index] = 1
-        else:
-            duplicate_col[group_index] = 0
+    _, event_codes = np.unique(data.event_id.values, return_inverse=True)
+    num_events = event_codes.max() + 1
+
+    # duplicate ids: same sequence_idx at the same event
+    seq_idx = data.sequence_idx.values.astype(np.int64)
+    _, seq_codes = np.unique(event_codes * (seq_idx.max() + 1) + seq_idx,
+                             return_inverse=True)
+    duplicate_ids = np.bincount(seq_codes)[seq_codes] > 1
+    event_duplicates = np.bincount(event_codes, weights=duplicate_ids,
+                                   minlength=num_events) > 0
+
+    # number of different labels per event
+    label_codes, _ = pd.factorize(data.label.values)
+    label_pairs = np.unique(event_codes * (label_codes.max() + 1) +
+                            label_codes)
+    event_labels = np.bincount(label_pairs // (label_codes.max() + 1),
+                               minlength=num_events)
+
+    duplicate_col = np.zeros(num_events, dtype=np.uint8)
+    duplicate_col[event_duplicates] = 1
+    duplicate_col[event_duplicates & (event_labels > 1)] = 2
 
-    data['duplicates'] = duplicate_col
+    data['duplicates'] = duplicate_col[event_codes]
+
+
+def _new_event_mask(timeoffsets: np.ndarray, serials: np.ndarray,
+                    window_secs) -> np.ndarray:
+    """Rows that start a new extended event.
+
+    A row continues the event of the previous row if it was taken by
+    the same camera within `window_secs` after it.
+    """
+    window = np.timedelta64(int(window_secs * 1e9), "ns")
+    new_event = ~((timeoffsets >= np.timedelta64(0, "s")) &
+                  (timeoffsets < window))
+    new_event[1:] |= serials[1:] != serials[:-1]
+    new_event[:1] = True
+
+    return new_event
 
 
 def _extend_event_keys(data: pd.DataFrame, window_secs=10):
@@ -52,45 +92,313 @@ def _extend_event_keys(data: pd.DataFrame, window_secs=10):
     :param window_secs: The time frame to merge subsequent events [in seconds].
     :return: A data frame with extended event keys added.
     """
-    simple_event_keys = data.event_key_simple.values
-    event_keys = [simple_event_keys[0]]
+    new_event = _new_event_mask(data.timeoffset.values,
+                                data.serial_no.values, window_secs)
+
+    # every row gets the simple key of the first row of its merged event
+    event_starts = np.flatnonzero(new_event)
+    data["event_key"] = \
+        data.event_key_simple.values[event_starts][np.cumsum(new_event) - 1]
+
+
+def _camera_time_order(data: pd.DataFrame) -> np.ndarray:
+    """Positions of the rows sorted by camera, then by time.
+
+    Rows with the same timestamp stay in event order. Unlike the
+    sortkey order (which compares days and event numbers as strings),
+    subsequent images of a camera are neighbours in this order.
+    """
+    serial_codes, _ = pd.factorize(data.serial_no.values)
+    times = data.datetime.values.astype("datetime64[ns]").astype(np.int64)
+
+    return np.lexsort((data.event_id.values, times, serial_codes))
+
+
+def extended_event_ids(data: pd.DataFrame, window_secs=10) -> np.ndarray:
+    """Ids of the events after merging subsequent events of a camera.
+
+    Like the 'event_key' of `read_training_metadata`, for any data frame
+    with event keys, e.g. from `read_dir_metadata`. The rows are merged
+    in the order of their camera and time, the ids are returned in the
+    order of the rows.
+
+    :param data: pandas.DataFrame
+        The data frame, with 'event_id', 'datetime' and 'serial_no'.
+    :param window_secs:
+        The time frame to merge subsequent events [in seconds].
+    """
+    order = _camera_time_order(data)
+    times = data.datetime.values[order].astype("datetime64[ns]")
+
+    timeoffsets = np.empty(len(order), dtype="timedelta64[ns]")
+    timeoffsets[:1] = np.timedelta64("NaT")
+    timeoffsets[1:] = np.diff(times)
+
+    new_event = _new_event_mask(timeoffsets, data.serial_no.values[order],
+                                window_secs)
+
+    # every row gets the event_id of the first row of its merged event
+    event_starts = order[new_event]
+    event_ids = np.empty(len(order), dtype=np.int64)
+    event_ids[order] = \
+        data.event_id.values[event_starts][np.cumsum(new_event) - 1]
+
+    return event_ids
+
+
+def content_fingerprint(file_path: str, row: dict) -> int:
+    """Signed 64-bit fingerprint of the image file content.
+
+    Hashes the file size, the first and last `FINGERPRINT_BYTES` of the
+    file and the serial, sequence and event fields of the MakerNote, so
+    copies of an image get the same fingerprint wherever they are stored.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+
+    digest.update("{}|{}|{}|{}|{}|{}".format(
+        size, row["serial_no"], row["sequence_idx"], row["sequence_max"],
+        row["event1"], row["event2"]).encode())
 
-    for i in range(1, data.shape[0]):
-        last_key = event_keys[i - 1]
-        current_key = simple_event_keys[i]
+    return int.from_bytes(digest.digest(), 'little', signed=True)
 
-        if (data.timeoffset.values[i] >= np.timedelta64(0, "s")) and \
-                (data.timeoffset.values[i] < np.timedelta64(window_secs,
-                                                            "s")) and \
-                (data.serial_no.values[i] == data.serial_no.values[i - 1]):
-            current_key = last_key
 
-        event_keys.append(current_key)
+def add_fingerprints(data: pd.DataFrame, workers=1):
+    """Add the 'fingerprint' of `content_fingerprint` to the rows of a
+    frame of `read_dir_metadata`.
 
-    data["event_key"] = event_keys
+    The scan does not compute them, as this reads another 128 KB of
+    every image: they are only needed to find copies of images and to
+    look up stored predictions.
 
+    :param workers: int
+        Number of threads reading the image files.
+    """
+    fields = ["serial_no", "sequence_idx", "sequence_max", "event1",
+              "event2"]
+    rows = (dict(zip(fields, values))
+            for values in zip(*[data[field].values for field in fields]))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        fingerprints = list(executor.map(content_fingerprint,
+                                         data["path"].values, rows))
+
+    data["fingerprint"] = np.array(fingerprints, dtype=np.int64)
+
+
+def _read_file_metadata(dir_path, filename):
+    """Read the metadata row of one file, or the error that prevented it."""
+    file_path = os.path.join(dir_path, filename)
+
+    # skip jpg file with IO issue or without right EXIF tags
+    try:
+        return make_exif_dict(file_path, filename), None
+    except (IOError, KeyError, ValueError) as err:
+        return None, err
+
+
+def _cached_entries(cache, filenames, unchanged):
+    """Yield (filename, cached (row, error) or None) for all files.
+
+    The cached entries are read from the cache a chunk of files at a time.
+    """
+    for start in range(0, len(filenames), QUERY_CHUNK):
+        chunk = filenames[start:start + QUERY_CHUNK]
+        cached = {}
+        if cache is not None:
+            cached = cache.rows([filename for filename, hit in
+                                 zip(chunk, unchanged[start:]) if hit])
+
+        for filename in chunk:
+            yield filename, cached.get(filename)
+
+
+def _iter_file_metadata(dir_path, files, workers=1):
+    """Yield (filename, row, error) for all files, in the order given.
+
+    :param files: Iterable of (filename, cached (row, error) or None),
+        files with a cached entry are not read again.
+
+    With more than one worker, the files are read by a thread pool that
+    runs a bounded number of files ahead of the consumer. Files not yet
+    started are cancelled when the generator is closed early.
+    """
+    read_file = partial(_read_file_metadata, dir_path)
+
+    if workers <= 1:
+        for filename, cached in files:
+            if cached is not None:
+                yield (filename,) + cached
+            else:
+                yield (filename,) + read_file(filename)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for filename, cached in files:
+                if cached is not None:
+                    future = Future()
+                    future.set_result(cached)
+                else:
+                    future = executor.submit(read_file, filename)
+
+                pending.append((filename, future))
+                if len(pending) >= 4 * workers:
+                    filename, future = pending.popleft()
+                    yield (filename,) + future.result()
+
+            while pending:
+                filename, future = pending.popleft()
+                yield (filename,) + future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _lexicographic_ranks(strings: List[str]) -> np.ndarray:
+    """Rank of each string in lexicographic order."""
+    ranks = np.empty(len(strings), dtype=np.int64)
+    ranks[sorted(range(len(strings)), key=strings.__getitem__)] = \
+        np.arange(len(strings))
+
+    return ranks
+
+
+# lexicographic rank of "<day of year>_", e.g. day 10 sorts before day 9
+DAY_OF_YEAR_RANKS = _lexicographic_ranks(["{}_".format(day)
+                                          for day in range(367)])
+
+# powers of ten that fit into an int64
+POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+
+
+def _num_digits(values: np.ndarray) -> np.ndarray:
+    """Number of decimal digits of non-negative integers."""
+    return np.maximum(np.searchsorted(POWERS_OF_TEN, values, side="right"), 1)
+
+
+def _concat_digit_keys(first: np.ndarray, second: np.ndarray) \
+        -> List[np.ndarray]:
+    """Integer keys that sort like the string str(first) + str(second).
+
+    Digit strings compare like their values right-padded with zeros to a
+    common length, with ties broken by length (a prefix sorts first). The
+    padded 24 digit values are split into two keys of 12 digits, the
+    length is packed into the lower bits of the second key.
+    `first` may have up to 5 digits, `second` needs 7 to 19 digits.
+    """
+    first_len = _num_digits(first)
+    total_len = first_len + _num_digits(second)
+    shift = 24 - total_len
 
-def read_dir_metadata(dir_path: str, sort_vals=True, progress_callback=None):
-    def add_event_keys(data):
-        """Add some unique keys to the rows.
+    high = first * POWERS_OF_TEN[12 - first_len] + \
+        second // POWERS_OF_TEN[12 - shift]
+    low = (second % POWERS_OF_TEN[12 - shift]) * POWERS_OF_TEN[shift]
 
-        The key is serial+year+day+event2(+datetime), which can be used
-        for sorting and grouping of trigger events.
-        """
-        data["event_key_simple"] = data.serial_no.astype(str) + "_" + \
-                                   data.datetime.dt.year.astype(str) + "_" + \
-                                   data.datetime.dt.dayofyear.astype(str) + \
-                                   "_" + data.event2.astype(str)
+    return [high, (low << 5) | total_len]
 
-        data["sortkey"] = data.event_key_simple.astype(str) + \
-                          data.datetime.values.astype(np.int64).astype(str)
 
+def _event_columns(data: pd.DataFrame):
+    """Integer (serial, year, day of year, event2) columns of the rows."""
+    # serial numbers as codes, ordered like the "<serial>_" strings
+    serials = sorted(pd.unique(data.serial_no.values),
+                     key=lambda serial: str(serial) + "_")
+    serial_codes = pd.Categorical(data.serial_no.values,
+                                  categories=serials).codes.astype(np.int64)
+
+    dates = data.datetime.dt
+    return serial_codes, dates.year.values.astype(np.int64), \
+        dates.dayofyear.values.astype(np.int64), \
+        data.event2.values.astype(np.int64)
+
+
+def _dense_ranks(keys: List[np.ndarray]):
+    """Dense rank of the rows, sorted by the keys (most significant first).
+
+    :return: (ranks, order), order is the stable lexsort of the rows
+    """
+    order = np.lexsort(keys[::-1])
+
+    new_value = np.zeros(len(order), dtype=bool)
+    for key in keys:
+        new_value[1:] |= np.diff(key[order]) != 0
+
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.cumsum(new_value)
+
+    return ranks, order
+
+
+def _add_event_keys(data):
+    """Add some unique integer keys to the rows.
+
+    'event_id' identifies the trigger event (serial+year+day+event2) and
+    can be used for grouping, 'sortkey' is the rank of the row when
+    sorted by serial+year+day+event2+datetime. Rows are ranked like the
+    strings of `event_key_strings` + timestamp used to be, so sorting by
+    the sortkey gives the same order as before (checked against the
+    string sort in tests/test_io.py). Both keys are only comparable
+    within the same data frame.
+
+    'event_key_simple' (the `event_key_strings`) is deprecated and only
+    kept for the notebooks, use 'event_id' instead. Its strings are
+    built once per event and shared by the rows of the event.
+
+    :return: numpy.ndarray
+        The positions of the rows in sortkey order.
+    """
+    serial, year, day, event2 = _event_columns(data)
+    timestamps = data.datetime.values.astype("datetime64[ns]")\
+        .astype(np.int64)
+
+    # pack the small columns into single int64 keys, the years (< 2^15),
+    # days (< 2^9) and event numbers (< 2^16) each get their own bits
+    event_key = (serial << 40) | (year << 25) | (day << 16) | event2
+    prefix_key = (serial << 24) | (year << 9) | DAY_OF_YEAR_RANKS[day]
+
+    first_rows, event_ids = np.unique(event_key, return_index=True,
+                                      return_inverse=True)[1:]
+    data["event_id"] = event_ids
+    data["sortkey"], order = _dense_ranks(
+        [prefix_key] + _concat_digit_keys(event2, timestamps))
+    data["event_key_simple"] = \
+        event_key_strings(data.iloc[first_rows]).values[event_ids]
+
+    return order
+
+
+def event_key_strings(data: pd.DataFrame) -> pd.Series:
+    """The human-readable event keys "<serial>_<year>_<day>_<event2>".
+
+    Only derive these when needed, for grouping use 'event_id'.
+    """
+    return data.serial_no.astype(str) + "_" + \
+        data.datetime.dt.year.astype(str) + "_" + \
+        data.datetime.dt.dayofyear.astype(str) + "_" + \
+        data.event2.astype(str)
+
+
+def _scan_dir(dir_path: str, progress_callback=None, workers=1,
+              use_cache=False, sort_files=False):
+    """Yield the metadata rows of the readable Reconyx images in a directory.
+
+    See `read_dir_metadata` for the parameters. With `sort_files`, the
+    files are read in the order of their names instead of listing order.
+    """
     log_in.info("Scanning directory '{}'".format(dir_path))
-    data = []
 
     # candidate image files, read to list so we know max files
-    jpg_files = [fname for fname in os.listdir(dir_path)
-                 if fname.lower().endswith((".jpg", ".jpeg"))]
+    jpg_entries = [entry for entry in os.scandir(dir_path)
+                   if entry.name.lower().endswith((".jpg", ".jpeg"))]
+    if sort_files:
+        jpg_entries.sort(key=lambda entry: entry.name)
+    jpg_files = [entry.name for entry in jpg_entries]
 
     # report progress every 2% of files scanned
     max_files = len(jpg_files)
@@ -98,46 +406,316 @@ def read_dir_metadata(dir_path: str, sort_vals=True, progress_callback=None):
 
     log_in.info("Found {} .jpg files".format(max_files))
 
-    # for filename in os.listdir(dir_path):
-    #     if filename.lower().endswith((".jpg", ".jpeg")):
-    for i, filename in enumerate(jpg_files):
-        file_path = os.path.join(dir_path, filename)
-        file_name = os.path.basename(file_path)
-
-        # skip jpg file with IO issue or without right EXIF tags
-        try:
-            row = make_exif_dict(file_path, filename)
-        except (IOError, KeyError, ValueError) as err:
-            log_in.warning("Skipping file '{}' - {} : {}".format(
-                file_name, type(err).__name__, str(err)
-            ))
-
-            continue
+    cache = MetadataCache.open(dir_path) if use_cache else None
+    unchanged = np.zeros(max_files, dtype=bool)
+    if cache is not None:
+        def identities():
+            # entries keep their stat result, release them once used
+            for pos, filename in enumerate(jpg_files):
+                entry, jpg_entries[pos] = jpg_entries[pos], None
+                try:
+                    yield filename, file_identity(entry.stat())
+                except OSError:
+                    yield filename, None
+
+        unchanged = cache.unchanged(identities(), max_files)
+        log_in.info("Found {} unchanged files in metadata cache".format(
+            np.count_nonzero(unchanged)))
+    del jpg_entries
+
+    # new entries are written to the cache in batches during the scan
+    new_entries = []
+    file_rows = _iter_file_metadata(
+        dir_path, _cached_entries(cache, jpg_files, unchanged), workers)
+    try:
+        for i, (filename, row, err) in enumerate(file_rows):
+            if cache is not None and not unchanged[i]:
+                new_entries.append((filename, row, err))
+                if len(new_entries) >= CACHE_UPDATE_BATCH:
+                    cache.update(new_entries)
+                    new_entries = []
+
+            if err is not None:
+                log_in.warning("Skipping file '{}' - {} : {}".format(
+                    filename, type(err).__name__, str(err)
+                ))
+
+                continue
+
+            yield row
+
+            # report progress to the caller (if desired)
+            # the caller could also signal us to abort processing
+            if progress_callback and (i % prog_step) == 0:
+                continue_signal = progress_callback(i / float(max_files) * 100)
+                if not continue_signal:
+                    raise InterruptedError("Directory scan interrupted.")
+    finally:
+        file_rows.close()
+
+        # also keep what was read before an interrupt
+        if cache is not None:
+            cache.update(new_entries)
+            cache.close()
+
+
+class _MetadataColumns:
+    """Typed column buffers for the metadata rows of a directory scan.
+
+    Rows are not kept as dicts, but appended to compact arrays, which
+    also set the dtypes of the frame: the EXIF numbers are (u)int8/16
+    (see `NUMERIC_COLUMNS`), 'datetime' is datetime64[ns] from int64
+    seconds and 'serial_no' is categorical. Path prefixes are stored
+    once, only 'filename' and 'path' are object columns.
+    """
 
-        data.append(row)
+    # array typecodes of the numeric columns, in `make_exif_dict` order
+    NUMERIC_COLUMNS = [("event1", "H"), ("event2", "H"),
+                       ("sequence_idx", "H"), ("sequence_max", "H"),
+                       ("ambient_temp", "h"), ("hour", "B"),
+                       ("brightness", "H"), ("sharpness", "H"),
+                       ("saturation", "H"), ("contrast", "H")]
+
+    def __init__(self):
+        self.filenames = []
+        self.path_prefixes = {}
+        self.path_codes = array.array("H")
+        self.serials = {}
+        self.serial_codes = array.array("i")
+        self.timestamps = array.array("q")
+        self.numbers = {name: array.array(code)
+                        for name, code in self.NUMERIC_COLUMNS}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def append(self, row: dict):
+        filename = row["filename"]
+        self.filenames.append(filename)
+
+        prefix = row["path"][:len(row["path"]) - len(filename)]
+        self.path_codes.append(
+            self.path_prefixes.setdefault(prefix, len(self.path_prefixes)))
+        self.serial_codes.append(
+            self.serials.setdefault(row["serial_no"], len(self.serials)))
+
+        self.timestamps.append((row["datetime"] - EPOCH) // ONE_SECOND)
+        for name, column in self.numbers.items():
+            column.append(row[name])
+
+    def to_frame(self) -> pd.DataFrame:
+        """Build the data frame, with the columns of `make_exif_dict`."""
+        prefixes = list(self.path_prefixes)
+        paths = [prefixes[code] + filename for code, filename
+                 in zip(self.path_codes, self.filenames)]
+
+        columns = [("filename", self.filenames), ("path", paths),
+                   ("datetime", np.frombuffer(self.timestamps, np.int64)
+                    .astype("datetime64[s]").astype("datetime64[ns]"))]
+        columns += [(name, np.frombuffer(self.numbers[name], code))
+                    for name, code in self.NUMERIC_COLUMNS]
+        columns.append(("serial_no", pd.Categorical.from_codes(
+            np.frombuffer(self.serial_codes, np.int32),
+            list(self.serials))))
+
+        return pd.DataFrame(OrderedDict(columns))
+
+
+def read_dir_metadata(dir_path: str, sort_vals=True, progress_callback=None,
+                      workers=1, use_cache=False):
+    """Read the metadata of all Reconyx images in a directory.
 
-        # report progress to the caller (if desired)
-        # the caller could also signal us to abort processing
-        if progress_callback and (i % prog_step) == 0:
-            continue_signal = progress_callback(i / float(max_files) * 100)
-            if not continue_signal:
-                raise InterruptedError("Directory scan interrupted.")
+    :param dir_path: string
+        The directory to scan for .jpg files.
+    :param sort_vals: bool
+        Whether to sort the rows by their event sortkey.
+    :param progress_callback:
+        Called with the progress in [0,100]%, returns False to abort.
+    :param workers: int
+        Number of threads reading the image files. Reading in parallel
+        helps on network storage, the result does not depend on it.
+    :param use_cache: bool
+        Whether to keep a sidecar metadata cache file in the directory,
+        so that rescans only read new or changed files (see
+        MetadataCache). Off by default, as it writes to the image
+        directory, which may be read-only or shared.
+    """
+    columns = _MetadataColumns()
+    for row in _scan_dir(dir_path, progress_callback, workers, use_cache):
+        columns.append(row)
 
-    if len(data) == 0:
+    if len(columns) == 0:
         raise FileNotFoundError("No Reconxy image files found in directory")
 
-    data = pd.DataFrame(data)
-    add_event_keys(data)
+    data = columns.to_frame()
+    order = _add_event_keys(data)
 
     if sort_vals:
         log_in.info("Sorting data rows.")
-        data = data.sort_values(by=["sortkey"])
+        data = data.iloc[order]
+
+    return data
+
+
+def _rows_frame(rows, positions) -> pd.DataFrame:
+    """Data frame of scanned rows with event keys, typed like the one of
+    `read_dir_metadata`, indexed by the scan positions of the rows."""
+    columns = _MetadataColumns()
+    for row in rows:
+        columns.append(row)
+
+    data = columns.to_frame()
+    data.index = positions
+    _add_event_keys(data)
 
     return data
 
 
+def _split_complete_events(rows, positions, event_window=None):
+    """Split scanned rows into a frame of complete events and the rest.
+
+    An event is complete once all `sequence_max` images of it were read.
+    Incomplete events are held back, so an event never spans two chunks.
+    With an `event_window`, this holds for the merged events of
+    `extended_event_ids`: the last merged event of each camera could
+    still continue and is held back, as well as merged events that
+    contain an incomplete event.
+
+    :return: (DataFrame or None, held back rows, their scan positions)
+    """
+    data = _rows_frame(rows, positions)
+
+    event_sizes = data.groupby("event_id")["event_id"].transform("size")
+    complete = (event_sizes >= data.sequence_max).values
+
+    if event_window is not None:
+        merged_ids = extended_event_ids(data, event_window)
+
+        # the merged events of the latest image of each camera
+        order = _camera_time_order(data)
+        serials = data.serial_no.values[order]
+        last = np.r_[serials[1:] != serials[:-1], True]
+        last_ids = merged_ids[order[last]]
+        open_ids = np.union1d(merged_ids[~complete], last_ids)
+        complete = ~np.isin(merged_ids, open_ids)
+
+    if not complete.any():
+        return None, rows, positions
+
+    held = np.flatnonzero(~complete)
+    data = data[complete].sort_values(by=["sortkey"])
+
+    return data, [rows[i] for i in held], [positions[i] for i in held]
+
+
+def _iter_background(iterable, max_queued):
+    """Run an iterator in a background thread, at most `max_queued` ahead.
+
+    Exceptions of the iterator are re-raised in the consuming thread.
+    The background thread stops when the consumer stops iterating.
+    """
+    items = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    finished = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+
+            put((finished, None))
+        except Exception as err:
+            put((finished, err))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, err = items.get()
+            if err is not None:
+                raise err
+            if item is finished:
+                return
+
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def iter_dir_metadata(dir_path: str, chunk_size=256, progress_callback=None,
+                      workers=1, use_cache=False, prefetch=0,
+                      event_window=None):
+    """Read the metadata of a directory in chunks of complete events.
+
+    The chunks can be classified while the scan continues. Each chunk is
+    a DataFrame like the one of `read_dir_metadata`, with the same column
+    types, sorted by sortkey, and only holds complete events: events that
+    are still missing images are held back until they are complete or the
+    scan is finished. 'event_id', 'sortkey' and the categories of
+    'serial_no' are only comparable within a chunk.
+
+    :param chunk_size: int
+        Minimum number of new images before a chunk is emitted.
+    :param prefetch: int
+        If > 0, scan in a background thread that may run this many
+        chunks ahead of the consumer.
+    :param event_window:
+        If set, chunks hold complete merged events of `extended_event_ids`
+        with this window [in seconds] instead of complete single events.
+
+    The other parameters are the same as for `read_dir_metadata`.
+    """
+    def chunks():
+        rows, positions = [], []
+        next_split = chunk_size
+        scanned = 0
+
+        # files are read by name, so the images of an event arrive together
+        for row in _scan_dir(dir_path, progress_callback, workers,
+                             use_cache, sort_files=True):
+            rows.append(row)
+            positions.append(scanned)
+            scanned += 1
+
+            if len(rows) >= next_split:
+                data, rows, positions = _split_complete_events(
+                    rows, positions, event_window)
+                next_split = len(rows) + chunk_size
+                if data is not None:
+                    yield data
+
+        if scanned == 0:
+            raise FileNotFoundError("No Reconxy image files found in "
+                                    "directory")
+
+        # the scan is finished, remaining incomplete events are emitted too
+        if rows:
+            yield _rows_frame(rows, positions).sort_values(by=["sortkey"])
+
+    if prefetch > 0:
+        return _iter_background(chunks(), prefetch)
+
+    return chunks()
+
+
 def read_training_metadata(dir_path: str, class_dir_names, extend_events=True,
-                           relative_paths = False):
+                           relative_paths = False, workers=1):
     """Read training/validation data from directory 'dir_path'.
 
     The directory should contain some subdirectories corresponding to
@@ -158,6 +736,8 @@ def read_training_metadata(dir_path: str, class_dir_names, extend_events=True,
         Path to the root directory with the training/validation data
     :param extend_events: bool
         Whether to merge Reconyx events based on successive timestamps.
+    :param workers: int
+        Number of threads reading the image files of each directory.
     """
 
     found_dirs = 0
@@ -176,7 +756,7 @@ def read_training_metadata(dir_path: str, class_dir_names, extend_events=True,
         for label in class_dir_names:
             if label in dir_name:
                 print("Reading %s" % file_path)
-                set_data = read_dir_metadata(file_path)
+                set_data = read_dir_metadata(file_path, workers=workers)
                 set_data['label'] = label
                 set_data['set'] = 'none'
 
@@ -191,6 +771,9 @@ def read_training_metadata(dir_path: str, class_dir_names, extend_events=True,
         raise IOError("Not all class directories found: {}"
                       .format(class_dir_names))
 
+    # the keys of the directories are not comparable, recompute them
+    _add_event_keys(data)
+
     _check_duplicates(data)
 
     # sort by the sortkey we constructed and break ties by filename
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import datetime
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import logging
+
+cache_log = logging.getLogger("metadata_cache")
+
+# sidecar file stored in every scanned directory
+CACHE_FILE_NAME = ".reconyx_metadata.sqlite"
+
+# bump whenever the rows produced by `make_exif_dict` change,
+# caches written with another version are discarded
+CACHE_VERSION = 3
+
+# metadata columns in the order `make_exif_dict` creates them
+# (filename and path are not stored, they follow from the directory)
+EXIF_COLUMNS = ["datetime", "event1", "event2", "sequence_idx",
+                "sequence_max", "ambient_temp", "hour", "brightness",
+                "sharpness", "saturation", "contrast", "serial_no"]
+
+# SQLite limits the number of parameters of a statement
+QUERY_CHUNK = 500
+
+# errors that only depend on the file content and can be cached,
+# IO errors might be transient (e.g. network storage) and are retried
+CACHED_ERRORS = {"KeyError": KeyError, "ValueError": ValueError}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def file_identity(stat_result: os.stat_result) -> Tuple[int, int, int]:
+    """The (size, mtime, inode) tuple a cache entry is valid for."""
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+class MetadataCache:
+    """Sidecar SQLite index of the image metadata in a directory.
+
+    Camera trap directories are append-only, so on a rescan only the
+    new or changed files have to be read again. The invalidation rules:
+
+    - an entry is only used if size, mtime and inode of the file match,
+      otherwise the file is read again and the entry replaced,
+    - entries of files that were removed from the directory are deleted,
+    - caches written with a different CACHE_VERSION or that cannot be
+      read are discarded completely,
+    - files that could not be read due to an IO error are not cached.
+
+    The entries are compared and read in SQLite, so no per-file Python
+    objects are kept for the whole directory: `unchanged` marks the
+    files with a valid entry, `rows` reads the entries of a few files
+    at a time and `update` is called with batches of new entries.
+    """
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        self.cache_path = os.path.join(dir_path, CACHE_FILE_NAME)
+        self.connection = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            connection = sqlite3.connect(self.cache_path)
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+        except sqlite3.OperationalError:
+            # e.g. locked by another scan, the cache is not used this time
+            raise
+        except sqlite3.DatabaseError as err:
+            # only a corrupt file is discarded
+            cache_log.warning("Discarding unreadable metadata cache "
+                              "'{}': {}".format(self.cache_path, err))
+            os.remove(self.cache_path)
+            connection = sqlite3.connect(self.cache_path)
+            version = 0
+
+        if version != CACHE_VERSION:
+            connection.execute("DROP TABLE IF EXISTS files")
+            connection.execute(
+                "CREATE TABLE files (filename TEXT PRIMARY KEY, "
+                "size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+                "error_type TEXT, error TEXT, {})".format(
+                    ", ".join(EXIF_COLUMNS)))
+            connection.execute("PRAGMA user_version = {}".format(CACHE_VERSION))
+            connection.commit()
+
+        return connection
+
+    @classmethod
+    def open(cls, dir_path: str) -> Optional['MetadataCache']:
+        """Open the cache of a directory, or None if that is not possible.
+
+        The scan then continues without cache, e.g. for read-only media.
+        """
+        try:
+            return cls(dir_path)
+        except (OSError, sqlite3.Error) as err:
+            cache_log.warning("Metadata cache disabled for '{}': {}".format(
+                dir_path, err))
+            return None
+
+    def unchanged(self, identities: Iterable[Tuple[str, Optional[Tuple]]],
+                  num_files: int) -> np.ndarray:
+        """Mark the files whose entry is valid, they need not be read.
+
+        :param identities: Iterable[Tuple[str, Optional[Tuple]]]
+            (filename, `file_identity`) of all files of the directory,
+            the identity is None if it could not be determined. Entries
+            of files not listed are removed from the cache.
+        :param num_files: The number of files.
+        :returns: Boolean mask of the unchanged files, in listed order.
+        """
+        # the identities are only kept in a temporary table, which
+        # `update` also takes them from
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS scan (pos INTEGER, "
+            "filename TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "inode INTEGER)")
+        self.connection.execute("DELETE FROM scan")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO scan VALUES (?, ?, ?, ?, ?)",
+            ((pos, filename) + tuple(identity)
+             for pos, (filename, identity) in enumerate(identities)
+             if identity is not None))
+
+        self.connection.execute(
+            "DELETE FROM files WHERE filename NOT IN "
+            "(SELECT filename FROM scan)")
+        self.connection.commit()
+
+        unchanged = np.zeros(num_files, dtype=bool)
+        positions = [pos for pos, in self.connection.execute(
+            "SELECT scan.pos FROM scan JOIN files USING (filename) "
+            "WHERE scan.size = files.size AND "
+            "scan.mtime_ns = files.mtime_ns AND scan.inode = files.inode")]
+        unchanged[positions] = True
+
+        return unchanged
+
+    def rows(self, filenames: List[str]) \
+            -> Dict[str, Tuple[Optional[dict], Optional[Exception]]]:
+        """The cached (row, error) of the files, for a few files at a time
+        (at most QUERY_CHUNK), which `unchanged` found valid."""
+        cached = {}
+        query = "SELECT filename, error_type, error, {} FROM files " \
+                "WHERE filename IN ({})".format(", ".join(EXIF_COLUMNS),
+                                               ", ".join(["?"] * len(filenames)))
+        for entry in self.connection.execute(query, filenames):
+            filename = entry[0]
+            error_type, error = entry[1:3]
+            if error_type is not None:
+                cached[filename] = (None, CACHED_ERRORS[error_type](error))
+                continue
+
+            row = {"filename": filename,
+                   "path": os.path.join(self.dir_path, filename)}
+            row.update(zip(EXIF_COLUMNS, entry[3:]))
+            row["datetime"] = EPOCH + datetime.timedelta(seconds=row["datetime"])
+            cached[filename] = (row, None)
+
+        return cached
+
+    def update(self, entries: List[Tuple[str, Optional[dict],
+                                         Optional[Exception]]]):
+        """Store freshly read (filename, row, error) entries, of files
+        passed to `unchanged`."""
+        values = []
+        for filename, row, err in entries:
+            if err is not None:
+                if type(err).__name__ not in CACHED_ERRORS:
+                    continue
+
+                # the message, without the quotes str() adds for KeyErrors
+                message = str(err.args[0]) if err.args else str(err)
+                values.append((type(err).__name__, message) +
+                              (None,) * len(EXIF_COLUMNS) + (filename,))
+                continue
+
+            row_values = [row[column] for column in EXIF_COLUMNS]
+            row_values[0] = int((row["datetime"] - EPOCH).total_seconds())
+            values.append((None, None) + tuple(row_values) + (filename,))
+
+        try:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files SELECT filename, size, "
+                "mtime_ns, inode, {} FROM scan WHERE filename = ?".format(
+                    ", ".join(["?"] * (2 + len(EXIF_COLUMNS)))), values)
+            self.connection.commit()
+        except sqlite3.Error as err:
+            cache_log.warning("Could not update metadata cache '{}': {}"
+                              .format(self.cache_path, err))
+
+    def close(self):
+        self.connection.close()
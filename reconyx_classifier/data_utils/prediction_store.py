@@ -0,0 +1,236 @@
+import os
+import time
+import hashlib
+import sqlite3
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .metadata_cache import file_identity
+
+import logging
+
+store_log = logging.getLogger("prediction_store")
+
+# bump whenever the layout of the store changes, older stores are discarded
+STORE_VERSION = 1
+
+# SQLite limits the number of parameters of a statement
+QUERY_CHUNK = 500
+
+
+def file_hash(path: str) -> str:
+    """blake2b hash of the file content."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class PredictionStore:
+    """SQLite store of the softmax output of classified images.
+
+    Predictions are keyed by the image `io.content_fingerprint`, the
+    model and the preprocessing, so re-classifying a directory, e.g.
+    after a crash, only runs the model on images it did not see yet.
+    The store is only used if a file is given (`--prediction_store`).
+
+    - the model is identified by the hash of its file, which is computed
+      once per file version (size, mtime and inode) and remembered,
+    - the preprocessing by `preprocessing.PREPROCESSING_VERSION` and the
+      decoder, as different decoders give slightly different inputs,
+    - entries of retired models are only removed by `prune`, see
+      scripts/prune_predictions.py.
+    """
+
+    def __init__(self, store_path: str, model_path: str, preprocessing: str):
+        self.store_path = store_path
+        os.makedirs(os.path.dirname(os.path.abspath(store_path)),
+                    exist_ok=True)
+        self.connection = _connect(store_path)
+        self.model = self._model_hash(model_path)
+        self.preprocessing = preprocessing
+
+    @classmethod
+    def open(cls, store_path: str, model_path: str,
+             preprocessing: str) -> Optional['PredictionStore']:
+        """Open the store, or None if that is not possible.
+
+        The classification then continues without stored predictions.
+        """
+        try:
+            return cls(store_path, model_path, preprocessing)
+        except (OSError, sqlite3.Error) as err:
+            store_log.warning("Prediction store '{}' disabled: {}".format(
+                store_path, err))
+            return None
+
+    def _model_hash(self, model_path: str) -> str:
+        identity = file_identity(os.stat(model_path))
+        path = os.path.abspath(model_path)
+        entry = self.connection.execute(
+            "SELECT size, mtime_ns, inode, hash FROM models WHERE path = ?",
+            (path,)).fetchone()
+        if entry is not None and tuple(entry[:3]) == identity:
+            model = entry[3]
+        else:
+            model = file_hash(model_path)
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?, ?)",
+            (path,) + identity + (model, int(time.time())))
+        self.connection.commit()
+        return model
+
+    def lookup(self, fingerprints: np.ndarray, num_classes: int) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """The stored predictions of the images.
+
+        :returns: (boolean mask of the images found, (N, num_classes)
+            float32 predictions, NaN for the images not found)
+        """
+        found = np.zeros(len(fingerprints), dtype=bool)
+        preds = np.full((len(fingerprints), num_classes), np.nan,
+                        dtype=np.float32)
+        positions = {}
+        for pos, fingerprint in enumerate(fingerprints.tolist()):
+            positions.setdefault(fingerprint, []).append(pos)
+
+        keys = list(positions)
+        for start in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[start:start + QUERY_CHUNK]
+            query = "SELECT fingerprint, probs FROM predictions WHERE " \
+                    "model = ? AND preprocessing = ? AND fingerprint IN " \
+                    "({})".format(", ".join(["?"] * len(chunk)))
+            for fingerprint, probs in self.connection.execute(
+                    query, [self.model, self.preprocessing] + chunk):
+                probs = np.frombuffer(probs, dtype=np.float32)
+                if len(probs) != num_classes:
+                    continue
+
+                rows = positions[fingerprint]
+                preds[rows] = probs
+                found[rows] = True
+
+        return found, preds
+
+    def store(self, fingerprints: np.ndarray, preds: np.ndarray):
+        """Store the predictions of the images in one transaction.
+
+        Rows with NaN predictions (images that were not classified)
+        are skipped.
+        """
+        preds = np.ascontiguousarray(preds, dtype=np.float32)
+        valid = ~np.isnan(preds).any(axis=1)
+        values = [(fingerprint, self.model, self.preprocessing, probs.tobytes())
+                  for fingerprint, probs in zip(fingerprints[valid].tolist(),
+                                                preds[valid])]
+
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                    values)
+        except sqlite3.Error as err:
+            store_log.warning("Could not update prediction store '{}': {}"
+                              .format(self.store_path, err))
+
+    def close(self):
+        self.connection.close()
+
+
+def _connect(store_path: str) -> sqlite3.Connection:
+    # the classifier may be used from another thread than the one that
+    # created it (e.g. by the service worker), but only by one at a time
+    try:
+        connection = sqlite3.connect(store_path, check_same_thread=False)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        # e.g. locked by another process, the caller decides what to do
+        raise
+    except sqlite3.DatabaseError as err:
+        # only a corrupt file is discarded
+        store_log.warning("Discarding unreadable prediction store "
+                          "'{}': {}".format(store_path, err))
+        os.remove(store_path)
+        connection = sqlite3.connect(store_path, check_same_thread=False)
+        version = 0
+
+    if version != STORE_VERSION:
+        connection.execute("DROP TABLE IF EXISTS predictions")
+        connection.execute("DROP TABLE IF EXISTS models")
+        connection.execute(
+            "CREATE TABLE predictions (fingerprint INTEGER, model TEXT, "
+            "preprocessing TEXT, probs BLOB, "
+            "PRIMARY KEY (fingerprint, model, preprocessing)) WITHOUT ROWID")
+        connection.execute(
+            "CREATE TABLE models (path TEXT PRIMARY KEY, size INTEGER, "
+            "mtime_ns INTEGER, inode INTEGER, hash TEXT, last_used INTEGER)")
+        connection.execute("PRAGMA user_version = {}".format(STORE_VERSION))
+        connection.commit()
+
+    return connection
+
+
+def stored_models(store_path: str) \
+        -> List[Tuple[str, int, List[str], int]]:
+    """(model hash, number of predictions, model paths, last used) of all
+    models in the store, most recently used first."""
+    connection = _connect(store_path)
+    try:
+        paths = {}
+        for path, model, last_used in connection.execute(
+                "SELECT path, hash, last_used FROM models"):
+            entry = paths.setdefault(model, ([], 0))
+            paths[model] = (entry[0] + [path], max(entry[1], last_used))
+
+        counts = dict(connection.execute(
+            "SELECT model, COUNT(*) FROM predictions GROUP BY model"))
+        models = [(model, counts.get(model, 0)) +
+                  paths.get(model, ([], 0))
+                  for model in set(counts) | set(paths)]
+    finally:
+        connection.close()
+
+    return sorted(models, key=lambda entry: -entry[3])
+
+
+def prune(store_path: str, models: List[str] = None,
+          keep: List[str] = None) -> int:
+    """Delete the predictions of retired models.
+
+    :param models: List[str]
+        Hashes of the models to delete (see `stored_models`).
+    :param keep: List[str]
+        Alternatively, hashes of the models to keep, all others are
+        deleted. An empty list is refused, it would delete everything.
+    :returns: The number of deleted predictions.
+    """
+    if keep is not None and not keep:
+        raise ValueError("No models to keep, refusing to delete the "
+                         "predictions of all models")
+
+    connection = _connect(store_path)
+    try:
+        stored = [model for model, in connection.execute(
+            "SELECT DISTINCT model FROM predictions")]
+        stored += [model for model, in connection.execute(
+            "SELECT DISTINCT hash FROM models")]
+        if keep is not None:
+            models = [model for model in set(stored) if model not in keep]
+
+        deleted = 0
+        with connection:
+            for model in models or []:
+                deleted += connection.execute(
+                    "DELETE FROM predictions WHERE model = ?",
+                    (model,)).rowcount
+                connection.execute("DELETE FROM models WHERE hash = ?",
+                                   (model,))
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+
+    return deleted
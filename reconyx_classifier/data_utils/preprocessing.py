@@ -0,0 +1,85 @@
+from typing import Callable, List, Sequence
+
+import numpy as np
+
+from .image_decoder import get_decoder
+
+# images are decoded at 319x319 and the 10 pixel border is cropped,
+# which leaves the 299x299 input of the Inception-ResNet-v2 network
+INPUT_SIZE = (299, 299)
+CROP = 10
+DECODE_SIZE = (INPUT_SIZE[0] + 2 * CROP, INPUT_SIZE[1] + 2 * CROP)
+
+# bump whenever the network input changes, stored predictions of
+# other versions are not used (see `prediction_store.PredictionStore`)
+PREPROCESSING_VERSION = 1
+
+
+class BatchBuffer:
+    """Preallocated network input for batches of images.
+
+    The images are cropped straight from the decoded uint8 arrays into a
+    float32 (batch_size, 299, 299, 3) buffer and scaled to [-1, 1] in
+    place, like `inception_resnet_v2.preprocess_input`. The buffer is
+    reused for every batch, so the inputs returned by `fill` are only
+    valid until the next call.
+
+    The arrays can also be passed in, e.g. to fill shared memory.
+    """
+
+    def __init__(self, batch_size: int,
+                 decoder: Callable[[str, Sequence[int]], np.ndarray] = None,
+                 images: np.ndarray = None, meta: np.ndarray = None):
+        if images is None:
+            images = np.empty((batch_size,) + INPUT_SIZE + (3,),
+                              dtype=np.float32)
+        if meta is None:
+            meta = np.empty((batch_size, 2), dtype=np.float32)
+
+        self.images = images
+        self.meta = meta
+        self.decoder = decoder or get_decoder()
+
+    def fill(self, paths: Sequence[str], temperatures: Sequence[float],
+             hours: Sequence[float], start: int = 0,
+             cache: 'TensorCache' = None) -> List[np.ndarray]:
+        """Decode the images into the buffer, starting at row `start`.
+
+        :param cache: tensor_cache.TensorCache
+            If given, cached images are not decoded again and the newly
+            decoded images are added to the cache.
+        :returns: [images, meta]
+            The network input for the rows [start, start + len(paths)).
+        """
+        stop = start + len(paths)
+        if stop > len(self.images):
+            raise ValueError("Batch of {} images does not fit into buffer "
+                             "of size {}".format(stop, len(self.images)))
+
+        meta = self.meta[start:stop]
+        meta[:, 0] = temperatures
+        meta[:, 1] = hours
+
+        cached = cache.get_many(paths) if cache is not None else {}
+        decoded = []
+        for i, path in enumerate(paths, start):
+            if path in cached:
+                self.images[i], self.meta[i] = cached[path]
+                continue
+
+            crop = self.decoder(path, DECODE_SIZE)[CROP:-CROP, CROP:-CROP]
+            self.images[i] = crop
+            decoded.append((path, crop, tuple(self.meta[i])))
+
+        if cache is not None and decoded:
+            cache.put_many(decoded)
+
+        images = self.images[start:stop]
+        np.divide(images, 127.5, out=images)
+        np.subtract(images, 1.0, out=images)
+
+        return [images, meta]
+
+    def inputs(self, size: int) -> List[np.ndarray]:
+        """The network input for the first `size` rows of the buffer."""
+        return [self.images[:size], self.meta[:size]]
@@ -0,0 +1,144 @@
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from .backends import onnx_model_path, onnx_input_names, copy_onnx_inputs
+from .preprocessing import BatchBuffer
+from .classifier import prediction_matrix
+
+import logging
+
+quant_log = logging.getLogger("quantization")
+
+# optional, needed to quantize only
+try:
+    import onnxruntime
+    from onnxruntime import quantization
+except ImportError:
+    onnxruntime = None
+    quantization = None
+
+
+def quantized_model_path(model_path: str, mode: str) -> str:
+    """Path of the quantized ONNX model, next to the float model."""
+    return os.path.splitext(onnx_model_path(model_path))[0] + \
+        "_{}.onnx".format(mode)
+
+
+def calibration_sample(data: pd.DataFrame, size: int,
+                       seed: int = 0) -> pd.DataFrame:
+    """Random images for the calibration, the same number per label.
+
+    :param data: pandas.DataFrame
+        Training data as read by `io.read_training_metadata`.
+    """
+    per_label = max(1, size // data.label.nunique())
+    # not groupby().apply(), newer pandas drop the 'label' column there
+    return pd.concat([rows.sample(min(len(rows), per_label),
+                                  random_state=seed)
+                      for _, rows in data.groupby('label')])
+
+
+def _calibration_batches(onnx_path: str, data: pd.DataFrame,
+                         batch_size: int) -> Iterator[dict]:
+    """ONNX Runtime input feeds of the calibration images."""
+    session = onnxruntime.InferenceSession(
+        onnx_path, providers=["CPUExecutionProvider"])
+    input_names = onnx_input_names(session, onnx_path)
+
+    for pos in range(0, len(data), batch_size):
+        rows = data[pos:pos + batch_size]
+        # fresh buffers, the quantizer keeps the feeds around
+        inputs = BatchBuffer(len(rows)).fill(rows['path'].values,
+                                             rows['ambient_temp'].values,
+                                             rows['hour'].values)
+        yield dict(zip(input_names, inputs))
+
+
+def quantize_model(model_path: str, mode: str = "static",
+                   calibration_data: Optional[pd.DataFrame] = None,
+                   batch_size: int = 8, output_path: str = None) -> str:
+    """Quantize the ONNX model converted from a Keras model to int8.
+
+    :param model_path: str
+        The Keras model, converted with `backends.convert_to_onnx`.
+    :param mode: str
+        'static' quantizes weights and activations to int8, using
+        `calibration_data` to estimate the activation ranges.
+        'dynamic' quantizes the weights only, activations are quantized
+        at runtime (no calibration data needed).
+    :param calibration_data: pandas.DataFrame
+        Images to calibrate with, e.g. from `calibration_sample`.
+    :returns: The path of the quantized model, which can be loaded with
+        the 'onnx' inference backend.
+    """
+    if quantization is None:
+        raise ValueError("Quantization needs the onnxruntime package")
+
+    float_path = onnx_model_path(model_path)
+    if not os.path.exists(float_path):
+        raise FileNotFoundError(
+            "No ONNX model '{}', convert the model with "
+            "scripts/convert_model.py first".format(float_path))
+
+    output_path = output_path or quantized_model_path(model_path, mode)
+    if mode == "dynamic":
+        quantization.quantize_dynamic(float_path, output_path,
+                                      weight_type=quantization.QuantType.QInt8)
+    elif mode == "static":
+        if calibration_data is None or len(calibration_data) == 0:
+            raise ValueError("Static quantization needs calibration data")
+
+        class CalibrationReader(quantization.CalibrationDataReader):
+            def __init__(self):
+                self.batches = _calibration_batches(float_path,
+                                                    calibration_data,
+                                                    batch_size)
+
+            def get_next(self):
+                return next(self.batches, None)
+
+        quant_log.info("Calibrating with {} images".format(
+            len(calibration_data)))
+        quantization.quantize_static(
+            float_path, output_path, CalibrationReader(),
+            quant_format=quantization.QuantFormat.QDQ,
+            activation_type=quantization.QuantType.QUInt8,
+            weight_type=quantization.QuantType.QInt8,
+            per_channel=True)
+    else:
+        raise ValueError("Unknown quantization mode '{}'".format(mode))
+
+    # the quantized model keeps the inputs of the converted one
+    copy_onnx_inputs(float_path, output_path)
+    return output_path
+
+
+def accuracy_report(data: pd.DataFrame, class_labels) -> dict:
+    """Per-class and event-level accuracy of a classified data frame.
+
+    :param data: pandas.DataFrame
+        Classified with `ImageClassifier.classify_data` and
+        classify_events=True, with the correct label name in 'true_label'.
+        Image accuracies use the prediction of each image, the event
+        accuracy the event labels in 'label'.
+    """
+    truth = data.true_label.map(class_labels.index).values
+    image_labels = prediction_matrix(data, class_labels).argmax(axis=1)
+    correct = image_labels == truth
+
+    report = {"image_accuracy": float(correct.mean())}
+    for idx, name in enumerate(class_labels):
+        of_class = truth == idx
+        report["accuracy_" + name] = \
+            float(correct[of_class].mean()) if of_class.any() else None
+
+    # every event counts once, with the label classify_data gave it
+    events = data.groupby('event_id').first()
+    event_truth = events.true_label.map(class_labels.index).values
+    report["event_accuracy"] = float(np.mean(events.label.values ==
+                                             event_truth))
+
+    return report
@@ -0,0 +1,405 @@
+import os
+import json
+import time
+import queue
+import threading
+import itertools
+import socketserver
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Optional
+
+from .io import read_dir_metadata, classification_to_dir
+from .metadata_cache import file_identity
+from .prediction_store import file_hash
+
+import logging
+
+service_log = logging.getLogger("service")
+
+# the service only listens on the loopback interface, and only answers
+# requests addressed to it (not e.g. to a rebound DNS name)
+HOST = "127.0.0.1"
+HOST_NAMES = (HOST, "localhost")
+DEFAULT_PORT = 8765
+
+# seconds to wait for a reply when looking for a running service
+PROBE_TIMEOUT = 0.5
+
+# share of the job progress reported for the directory scan
+SCAN_SHARE = 10.0
+
+# finished jobs kept for status requests, older ones are forgotten
+MAX_FINISHED_JOBS = 100
+
+# classifier settings that change the results, a job has to ask for
+# the ones the service was started with
+MODEL_SETTINGS = ("backend", "decoder", "early_exit", "empty_threshold")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = \
+    "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class SettingsMismatch(ValueError):
+    """A job asks for another model or settings than the service has."""
+
+
+class Job:
+    """A directory to classify, with its state and progress."""
+
+    def __init__(self, job_id: int, directory: str, event_window=None,
+                 copy_output=False, workers=1, use_cache=False):
+        self.id = job_id
+        self.directory = directory
+        self.event_window = event_window
+        self.copy_output = copy_output
+        self.workers = workers
+        self.use_cache = use_cache
+
+        self.state = QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.cancelled = threading.Event()
+        self.times = OrderedDict([("submitted", time.time())])
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "directory": self.directory,
+                "event_window": self.event_window,
+                "copy_output": self.copy_output, "workers": self.workers,
+                "use_cache": self.use_cache, "state": self.state,
+                "progress": self.progress, "error": self.error,
+                "result": self.result, "times": self.times}
+
+
+class ClassificationService:
+    """Classifies the directories of submitted jobs with one classifier.
+
+    The model is loaded once, the jobs are run one after another by a
+    worker thread. Running jobs are cancelled through the progress
+    callbacks of the scan and the classification.
+
+    :param model_path: str
+        The model file the classifier was loaded from.
+    :param settings: dict
+        The `MODEL_SETTINGS` the classifier was created with, jobs
+        asking for others are rejected.
+    :param max_finished_jobs: int
+        Number of finished jobs whose state can still be requested, the
+        oldest ones are removed when new jobs are submitted.
+    """
+
+    def __init__(self, classifier, class_labels, model_path: str,
+                 settings: dict, max_finished_jobs: int = MAX_FINISHED_JOBS):
+        self.classifier = classifier
+        self.class_labels = class_labels
+        self.model_path = os.path.abspath(model_path)
+        self.model_identity = file_identity(os.stat(model_path))
+        self.model_hash = None
+        self.settings = {key: settings.get(key) for key in MODEL_SETTINGS}
+        self.jobs = OrderedDict()
+        self.max_finished_jobs = max_finished_jobs
+        self.queue = queue.Queue()
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def check_model(self, model_path: str, settings: dict):
+        """Raise `SettingsMismatch` unless the job would be classified
+        with the same model file and settings as the service uses."""
+        for key in MODEL_SETTINGS:
+            if settings.get(key) != self.settings[key]:
+                raise SettingsMismatch(
+                    "The service runs with {} {!r}, not {!r}".format(
+                        key, self.settings[key], settings.get(key)))
+
+        try:
+            if file_identity(os.stat(self.model_path)) != \
+                    self.model_identity:
+                raise SettingsMismatch("The model '{}' changed since the "
+                                       "service was started"
+                                       .format(self.model_path))
+
+            identity = file_identity(os.stat(model_path))
+        except FileNotFoundError as err:
+            raise SettingsMismatch(
+                "No model file '{}'".format(err.filename)) from None
+
+        if identity != self.model_identity:
+            # e.g. a copy of the model, compare the content
+            if self.model_hash is None:
+                self.model_hash = file_hash(self.model_path)
+            if file_hash(model_path) != self.model_hash:
+                raise SettingsMismatch("The service runs the model '{}'"
+                                       .format(self.model_path))
+
+    def submit(self, directory: str, model_path: str, settings: dict,
+               event_window=None, copy_output=False, workers=1,
+               use_cache=False) -> Job:
+        if not os.path.isdir(directory):
+            raise ValueError("No directory '{}'".format(directory))
+        self.check_model(model_path, settings)
+
+        with self.lock:
+            job = Job(next(self.job_ids), os.path.abspath(directory),
+                      event_window, copy_output, int(workers),
+                      bool(use_cache))
+            self.jobs[job.id] = job
+            self._remove_finished()
+        self.queue.put(job)
+        service_log.info("Job {}: queued '{}'".format(job.id, job.directory))
+        return job
+
+    def _remove_finished(self):
+        """Forget the oldest finished jobs beyond `max_finished_jobs`."""
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) -
+                                    self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def job_list(self) -> list:
+        """The known jobs, in the order they were submitted."""
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: int) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is not None and job.state in (QUEUED, RUNNING):
+            job.cancelled.set()
+            if job.state == QUEUED:
+                job.state = CANCELLED
+        return job
+
+    def stop(self):
+        """Cancel the running and queued jobs and stop the worker."""
+        for job in self.job_list():
+            self.cancel(job.id)
+        self.queue.put(None)
+        self.worker.join()
+
+    def _run(self):
+        for job in iter(self.queue.get, None):
+            if job.cancelled.is_set():
+                continue
+
+            job.state = RUNNING
+            job.times["started"] = time.time()
+            try:
+                job.result = self._classify(job)
+                job.state = DONE
+                job.progress = 100.0
+            except InterruptedError:
+                job.state = CANCELLED
+            except Exception as err:
+                service_log.exception("Job {} failed".format(job.id))
+                job.state = FAILED
+                job.error = "{}: {}".format(type(err).__name__, err)
+            job.times["finished"] = time.time()
+            service_log.info("Job {}: {}".format(job.id, job.state))
+
+    def _classify(self, job: Job) -> dict:
+        def scan_progress(percent):
+            job.progress = percent * SCAN_SHARE / 100
+            return not job.cancelled.is_set()
+
+        def classify_progress(percent):
+            job.progress = SCAN_SHARE + percent * (100 - SCAN_SHARE) / 100
+            return not job.cancelled.is_set()
+
+        classified_path = None
+        if job.copy_output:
+            classified_path = job.directory.rstrip('/\\') + '_classified'
+            os.mkdir(classified_path)
+
+        data = read_dir_metadata(job.directory,
+                                 progress_callback=scan_progress,
+                                 workers=job.workers,
+                                 use_cache=job.use_cache)
+        self.classifier.classify_data(data, progress=classify_progress,
+                                      event_window=job.event_window)
+        if classified_path:
+            classification_to_dir(classified_path, data, self.class_labels)
+
+        counts = data.label.value_counts()
+        return {"images": len(data), "output": classified_path,
+                "labels": {label: int(counts.get(idx, 0))
+                           for idx, label in enumerate(self.class_labels)}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """JSON API of the service:
+
+    GET /status, GET /jobs, POST /jobs {"directory", "model",
+    "settings", "event_window", "copy_output", "workers", "use_cache"},
+    GET /jobs/<id>, DELETE /jobs/<id> (cancel).
+
+    Requests must be addressed to localhost and jobs submitted as JSON,
+    so web pages can not submit jobs (cross-origin requests with a JSON
+    content type need a preflight request, which is not answered).
+    """
+
+    service = None
+
+    def _reply(self, code: int, body):
+        content = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _job_id(self) -> Optional[int]:
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+    def _local_host(self) -> bool:
+        """Whether the Host header names this server, else reply 403."""
+        host, _, port = self.headers.get("Host", "").partition(":")
+        if host in HOST_NAMES and \
+                port in ("", str(self.server.server_address[1])):
+            return True
+
+        self._reply(403, {"error": "Forbidden host"})
+        return False
+
+    def do_GET(self):
+        if not self._local_host():
+            return
+
+        if self.path == "/status":
+            self._reply(200, {"service": "reconyx_classifier",
+                              "pid": os.getpid(),
+                              "queued": self.service.queue.qsize()})
+        elif self.path == "/jobs":
+            self._reply(200, [job.to_dict()
+                              for job in self.service.job_list()])
+        else:
+            job = self.service.jobs.get(self._job_id())
+            if job is None:
+                self._reply(404, {"error": "No such job"})
+            else:
+                self._reply(200, job.to_dict())
+
+    def do_POST(self):
+        if not self._local_host():
+            return
+
+        if self.path != "/jobs":
+            self._reply(404, {"error": "Unknown path"})
+            return
+
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.split(";")[0].strip() != "application/json":
+            self._reply(415, {"error": "Expected application/json"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode())
+            job = self.service.submit(request["directory"], request["model"],
+                                      request.get("settings") or {},
+                                      request.get("event_window"),
+                                      bool(request.get("copy_output")),
+                                      request.get("workers", 1),
+                                      request.get("use_cache", False))
+        except SettingsMismatch as err:
+            self._reply(409, {"error": str(err)})
+            return
+        except (ValueError, KeyError, TypeError) as err:
+            self._reply(400, {"error": str(err)})
+            return
+
+        self._reply(201, job.to_dict())
+
+    def do_DELETE(self):
+        if not self._local_host():
+            return
+
+        job = self.service.cancel(self._job_id())
+        if job is None:
+            self._reply(404, {"error": "No such job"})
+        else:
+            self._reply(200, job.to_dict())
+
+    def log_message(self, fmt, *args):
+        service_log.debug(fmt % args)
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(service: ClassificationService,
+                port: int = DEFAULT_PORT) -> HTTPServer:
+    """The HTTP server of the service on localhost (port 0: any free
+    port, see `server_address`), which still has to be started."""
+    handler = type("Handler", (_Handler,), {"service": service})
+    return _Server((HOST, port), handler)
+
+
+def serve(service: ClassificationService, port: int = DEFAULT_PORT):
+    """Answer requests on localhost until interrupted."""
+    server = make_server(service, port)
+    service_log.info("Listening on http://{}:{}".format(HOST, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def _request(port: int, method: str, path: str, body=None,
+             timeout: float = None):
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(
+        "http://{}:{}{}".format(HOST, port, path), data=data, method=method,
+        headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode())
+    except urllib.error.HTTPError as err:
+        error = json.loads(err.read().decode())["error"]
+        if err.code == 409:
+            raise SettingsMismatch(error) from None
+        raise ValueError(error) from None
+
+
+def service_running(port: int = DEFAULT_PORT) -> bool:
+    """Whether a classification service answers on the port."""
+    try:
+        status = _request(port, "GET", "/status", timeout=PROBE_TIMEOUT)
+    except (OSError, ValueError):
+        return False
+
+    return status.get("service") == "reconyx_classifier"
+
+
+def submit_job(directory: str, model_path: str, settings: dict,
+               port: int = DEFAULT_PORT, **options) -> dict:
+    """Submit a directory to the running service, returns the job.
+
+    Raises `SettingsMismatch` if the service runs another model or
+    other `MODEL_SETTINGS`.
+    """
+    return _request(port, "POST", "/jobs",
+                    dict(options, directory=os.path.abspath(directory),
+                         model=os.path.abspath(model_path),
+                         settings=settings))
+
+
+def job_status(job_id: int, port: int = DEFAULT_PORT) -> dict:
+    return _request(port, "GET", "/jobs/{}".format(job_id))
+
+
+def cancel_job(job_id: int, port: int = DEFAULT_PORT) -> dict:
+    return _request(port, "DELETE", "/jobs/{}".format(job_id))
@@ -0,0 +1,211 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .metadata_cache import file_identity
+from .preprocessing import INPUT_SIZE
+
+import logging
+
+cache_log = logging.getLogger("tensor_cache")
+
+CROP_SHAPE = INPUT_SIZE + (3,)
+CROP_BYTES = int(np.prod(CROP_SHAPE))
+
+# crops per memory-mapped chunk file (~69 MB)
+CHUNK_SLOTS = 256
+
+INDEX_FILE_NAME = "index.sqlite"
+
+# bump whenever the stored crops change, older caches are discarded
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+
+class TensorCache:
+    """On-disk cache of the preprocessed network input of images.
+
+    Stores the 299x299 uint8 crop and the (temperature, hour) meta vector
+    of every classified image, so that re-classifying a season with a new
+    model does not have to decode the JPEGs again. The crops are stored
+    in fixed-size slots of memory-mapped chunk files, a SQLite index maps
+    the image paths to their slots.
+
+    - an entry is only used if size, mtime and inode of the image match
+      and it was created with the same decoder,
+    - the cache holds at most `max_bytes` of crops, when it is full the
+      least recently used entries are evicted and their slots reused.
+
+    The cache can be shared by threads and (through pickling, which
+    reopens it) by decoder processes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, decoder_name: str):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.decoder_name = decoder_name
+        self.capacity = max(1, max_bytes // CROP_BYTES)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.connection = self._connect()
+
+    def __reduce__(self):
+        return self.__class__, (self.cache_dir, self.max_bytes,
+                                self.decoder_name)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            os.path.join(self.cache_dir, INDEX_FILE_NAME),
+            timeout=60, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+
+        # decoder processes open the cache at the same time
+        connection.execute("BEGIN IMMEDIATE")
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            connection.execute("DROP TABLE IF EXISTS entries")
+            connection.execute(
+                "CREATE TABLE entries (path TEXT PRIMARY KEY, "
+                "size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+                "decoder TEXT, slot INTEGER UNIQUE, temperature REAL, "
+                "hour REAL, last_used REAL)")
+            connection.execute(
+                "CREATE INDEX entries_last_used ON entries (last_used)")
+            connection.execute("PRAGMA user_version = {}".format(
+                CACHE_VERSION))
+
+        # the size cap may have been lowered since the last run
+        connection.execute("DELETE FROM entries WHERE slot >= ?",
+                           (self.capacity,))
+        connection.commit()
+
+        return connection
+
+    def _chunk(self, chunk_idx: int) -> np.memmap:
+        """The memory map of a chunk file, created on first use."""
+        if chunk_idx not in self.chunks:
+            path = os.path.join(self.cache_dir,
+                                "crops_{:05d}.u8".format(chunk_idx))
+            mode = 'r+' if os.path.exists(path) else 'w+'
+            self.chunks[chunk_idx] = np.memmap(
+                path, dtype=np.uint8, mode=mode,
+                shape=(CHUNK_SLOTS,) + CROP_SHAPE)
+
+        return self.chunks[chunk_idx]
+
+    def _crop(self, slot: int) -> np.ndarray:
+        return self._chunk(slot // CHUNK_SLOTS)[slot % CHUNK_SLOTS]
+
+    def get_many(self, paths: List[str]) \
+            -> Dict[str, Tuple[np.ndarray, Tuple[float, float]]]:
+        """Return (crop, (temperature, hour)) of all cached images."""
+        identities = {}
+        for path in paths:
+            try:
+                identities[path] = file_identity(os.stat(path))
+            except OSError:
+                pass
+
+        found = {}
+        with self.lock:
+            # writers reuse slots of evicted entries, copying the crops in
+            # a write transaction keeps them from overwriting a slot
+            # between the lookup and the copy. This also serializes the
+            # reads of all processes sharing the cache, which limits the
+            # throughput of many decoder processes on a warm cache (each
+            # holds the lock while copying ~270 KB per cached image).
+            try:
+                self.connection.execute("BEGIN IMMEDIATE")
+                query = "SELECT size, mtime_ns, inode, decoder, slot, " \
+                        "temperature, hour FROM entries WHERE path = ?"
+                for path, identity in identities.items():
+                    entry = self.connection.execute(query,
+                                                    (path,)).fetchone()
+                    if entry is None or tuple(entry[:3]) != identity or \
+                            entry[3] != self.decoder_name:
+                        continue
+
+                    found[path] = (np.array(self._crop(entry[4])),
+                                   (entry[5], entry[6]))
+
+                now = time.time()
+                self.connection.executemany(
+                    "UPDATE entries SET last_used = ? WHERE path = ?",
+                    [(now, path) for path in found])
+                self.connection.commit()
+            except (OSError, sqlite3.Error) as err:
+                self.connection.rollback()
+                cache_log.warning("Could not read tensor cache '{}': {}"
+                                  .format(self.cache_dir, err))
+                return {}
+
+        return found
+
+    def _allocate(self, path: str, count: int) -> Tuple[int, int]:
+        """Slot for a new entry (its old slot, a free one or the LRU one).
+
+        :returns: The slot and the number of entries after adding it.
+        """
+        entry = self.connection.execute(
+            "SELECT slot FROM entries WHERE path = ?", (path,)).fetchone()
+        if entry is not None:
+            return entry[0], count
+
+        if count >= self.capacity:
+            oldest = self.connection.execute(
+                "SELECT path, slot FROM entries ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            self.connection.execute("DELETE FROM entries WHERE path = ?",
+                                    (oldest[0],))
+            return oldest[1], count
+
+        used = self.connection.execute(
+            "SELECT MAX(slot) FROM entries").fetchone()[0]
+        if used is None or used + 1 < self.capacity:
+            return (0 if used is None else used + 1), count + 1
+
+        # slots were freed below the highest one, find a gap
+        used = {row[0] for row in
+                self.connection.execute("SELECT slot FROM entries")}
+        return next(slot for slot in range(self.capacity)
+                    if slot not in used), count + 1
+
+    def put_many(self, entries: List[Tuple[str, np.ndarray,
+                                           Tuple[float, float]]]):
+        """Store (path, uint8 crop, (temperature, hour)) entries."""
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN IMMEDIATE")
+                count = self.connection.execute(
+                    "SELECT COUNT(*) FROM entries").fetchone()[0]
+
+                now = time.time()
+                for path, crop, (temperature, hour) in entries:
+                    identity = file_identity(os.stat(path))
+                    slot, count = self._allocate(path, count)
+                    self._crop(slot)[...] = crop
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO entries VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (path,) + identity + (self.decoder_name, slot,
+                                              float(temperature), float(hour),
+                                              now))
+
+                self.connection.commit()
+            except (OSError, sqlite3.Error) as err:
+                self.connection.rollback()
+                cache_log.warning("Could not update tensor cache '{}': {}"
+                                  .format(self.cache_dir, err))
+
+    def close(self):
+        for chunk in self.chunks.values():
+            chunk.flush()
+        self.connection.close()
@@ -17,12 +17,41 @@ gui_log = logging.getLogger("gui_model")
 
 class ClassificationOptions:
     def __init__(self, output_dir, classification_suffix,
-                 model_path, batch_size, labels):
+                 model_path, batch_size, labels, scan_workers=1,
+                 use_metadata_cache=False, event_window=None,
+                 decode_workers=2, prefetch=2, decoder=None,
+                 tensor_cache_dir=None, backend=None,
+                 inference_processes=0, early_exit=None,
+                 empty_threshold=None, prediction_store=None,
+                 dedup=False):
         self.output_dir = output_dir
         self.classification_suffix = classification_suffix
         self.model_path = model_path
         self.batch_size = batch_size
         self.labels = labels
+        self.scan_workers = scan_workers
+        self.use_metadata_cache = use_metadata_cache
+        # merge successive events within this many seconds (None: don't)
+        self.event_window = event_window
+        # threads decoding images, batches decoded ahead of the model
+        self.decode_workers = decode_workers
+        self.prefetch = prefetch
+        # name of the image decoder (None: 'full')
+        self.decoder = decoder
+        # directory caching preprocessed images (None: no cache)
+        self.tensor_cache_dir = tensor_cache_dir
+        # inference backend, 'keras' or 'onnx' (None: 'onnx' if converted)
+        self.backend = backend
+        # processes running the model on whole events (0: in this process)
+        self.inference_processes = inference_processes
+        # skip the rest of an event after an animal with this confidence
+        self.early_exit = early_exit
+        # motion score below which frames are empty (None: no filter)
+        self.empty_threshold = empty_threshold
+        # SQLite file keeping the predictions (None: classify every time)
+        self.prediction_store = prediction_store
+        # classify copies of an image only once
+        self.dedup = dedup
 
 
 class TreeNode:
@@ -62,7 +91,8 @@ class ImageDataItem(QObject):
     def __eq__(self, other):
         return self.data_path == other.data_path
 
-    def read_data(self, progress_callback: Callable[[int], bool]) -> bool:
+    def read_data(self, progress_callback: Callable[[int], bool],
+                  workers: int = 1, use_cache: bool = False) -> bool:
         """Read the images in the directory specified by this data.
 
         :param progress_callback:
@@ -83,7 +113,8 @@ class ImageDataItem(QObject):
         try:
             self.metadata = read_dir_metadata(
                 self.data_path,
-                progress_callback=progress_callback)
+                progress_callback=progress_callback,
+                workers=workers, use_cache=use_cache)
             self.state = ProcessState.READ
         except FileNotFoundError as err:
             self.state = ProcessState.FAILED
@@ -316,7 +347,12 @@ class ImageDataListModel(QAbstractItemModel):
             classification_suffix="labeled",
             model_path="model/cheetah_model.hdf5",
             batch_size=16,
-            labels=['unknown', 'cheetah', 'leopard']
+            labels=['unknown', 'cheetah', 'leopard'],
+            scan_workers=1,
+            use_metadata_cache=False,
+            event_window=None,
+            decode_workers=2,
+            prefetch=2
         )
 
         # internal data store
@@ -403,7 +439,7 @@ class ImageDataListModel(QAbstractItemModel):
                 if item.state == ProcessState.READ:
                     return "{} images found in {} events".format(
                        len(item.metadata),
-                       item.metadata['event_key_simple'].nunique()
+                       item.metadata['event_id'].nunique()
                     )
 
                 if item.state == ProcessState.CLASS_IN_PROG:
@@ -413,7 +449,7 @@ class ImageDataListModel(QAbstractItemModel):
                     return "{} images found in {} events\n" \
                            "{}".format(
                             len(item.metadata),
-                            item.metadata['event_key_simple'].nunique(),
+                            item.metadata['event_id'].nunique(),
                             '\t'.join(
                                 ["{}: {}".format(label, item.class_freq(idx))
                                       for idx, label
@@ -5,6 +5,7 @@ import sys
 from enum import Enum
 
 from data_utils.classifier import ImageClassifier
+from data_utils.auto_tune import load_settings
 from data_utils.io import classification_to_dir, get_unique_dir
 
 import logging
@@ -40,13 +41,44 @@ class ReadWorker(QObject):
         # from data_utils.classifier import ImageClassifier
         # classifier object
         thread_log.info("Initializing ImageClassifier")
+
+        # reuse the settings tuned with `cheetah_classifier.py --auto_tune`
+        batch_size = self.options.batch_size
+        threads = {}
+        settings = load_settings(self.options.model_path,
+                                 self.options.backend)
+        if settings is not None:
+            thread_log.info("Using tuned batch size {} and threads {}/{}"
+                            .format(settings.batch_size,
+                                    settings.intra_op_threads,
+                                    settings.inter_op_threads))
+            batch_size = settings.batch_size
+            # the inference pool picks the threads of its processes
+            if not self.options.inference_processes:
+                threads = dict(intra_op_threads=settings.intra_op_threads,
+                               inter_op_threads=settings.inter_op_threads)
+
         try:
-            self.classifier = ImageClassifier(self.options.model_path,
-                                              self.options.batch_size,
-                                              self.options.labels)
+            self.classifier = ImageClassifier(
+                self.options.model_path, batch_size,
+                self.options.labels,
+                decode_workers=self.options.decode_workers,
+                prefetch=self.options.prefetch,
+                decoder=self.options.decoder,
+                tensor_cache_dir=self.options.tensor_cache_dir,
+                backend=self.options.backend,
+                inference_processes=self.options.inference_processes,
+                early_exit=self.options.early_exit,
+                empty_threshold=self.options.empty_threshold,
+                prediction_store=self.options.prediction_store,
+                dedup=self.options.dedup,
+                **threads)
         except OSError as err:
             thread_log.error("OS error: {}".format(err))
             sys.exit(1)
+        except ValueError as err:
+            thread_log.error(err)
+            sys.exit(1)
 
         self.notified.emit("Classifier initialized")
 
@@ -61,7 +93,9 @@ class ReadWorker(QObject):
 
         try:
             self.changed.emit()
-            if item.read_data(self.report_scan_progress):
+            if item.read_data(self.report_scan_progress,
+                              workers=self.options.scan_workers,
+                              use_cache=self.options.use_metadata_cache):
                 self.notified.emit("Images successfully scanned.")
                 self.finished.emit()
         except (FileNotFoundError, InterruptedError) as err:
@@ -96,7 +130,8 @@ class ReadWorker(QObject):
                 item.state = ProcessState.CLASS_IN_PROG
                 self.changed.emit()
                 self.classifier.classify_data(item.metadata,
-                                progress=self.report_classification_progress)
+                                progress=self.report_classification_progress,
+                                event_window=self.options.event_window)
                 classification_to_dir(final_path, item.metadata, labels)
                 item.state = ProcessState.CLASSIFIED
                 item.compute_class_freqs()
@@ -0,0 +1,108 @@
+"""Compare the inference backends of the classifier.
+
+Usage: python scripts/benchmark_backends.py <model.hdf5> [<image directory>]
+                                            [--batch_size N] [--batches N]
+
+Runs the same batches through every backend that can load the model and
+reports images/sec and the deviation of the softmax outputs from the
+Keras backend. The batches are built from the images in the directory,
+or from random input if no directory is given.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import backends  # noqa: E402
+from data_utils.preprocessing import BatchBuffer, INPUT_SIZE  # noqa: E402
+
+# the softmax outputs of all backends must agree this closely
+PARITY_TOLERANCE = 1e-3
+
+
+def make_batches(directory, batch_size, num_batches):
+    """Network inputs of the images in the directory, or random ones."""
+    if directory is None:
+        rng = np.random.RandomState(0)
+        return [[rng.uniform(-1, 1, (batch_size,) + INPUT_SIZE + (3,))
+                 .astype(np.float32),
+                 rng.uniform(0, 30, (batch_size, 2)).astype(np.float32)]
+                for _ in range(num_batches)]
+
+    paths = sorted(os.path.join(directory, fname)
+                   for fname in os.listdir(directory)
+                   if fname.lower().endswith((".jpg", ".jpeg")))
+    paths = paths[:batch_size * num_batches]
+
+    batches = []
+    for pos in range(0, len(paths), batch_size):
+        batch_paths = paths[pos:pos + batch_size]
+        buffer = BatchBuffer(len(batch_paths))
+        # metadata is not part of the comparison, use a fixed temp and hour
+        batches.append(buffer.fill(batch_paths, [20.0] * len(batch_paths),
+                                   [12.0] * len(batch_paths)))
+
+    return batches
+
+
+def run(backend, batches):
+    """Predictions and images/sec of the backend, after one warm-up batch."""
+    backend.predict(batches[0])
+
+    start = time.perf_counter()
+    preds = np.concatenate([backend.predict(batch) for batch in batches])
+    return preds, len(preds) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference backend benchmark")
+    parser.add_argument('model', help="Keras model file (.hdf5).")
+    parser.add_argument('directory', nargs='?', default=None,
+                        help="Directory with Reconyx images.")
+    parser.add_argument('--batch_size', type=int, default=16, metavar='N')
+    parser.add_argument('--batches', type=int, default=8, metavar='N',
+                        help="Number of timed batches.")
+    args = parser.parse_args()
+
+    batches = make_batches(args.directory, args.batch_size, args.batches)
+    if not batches:
+        print("No .jpg files found in '{}'".format(args.directory))
+        return
+
+    reference = None
+    failed = False
+    for name in backends.BACKENDS:
+        try:
+            backend = backends.create_backend(name, args.model)
+        except (OSError, ValueError) as err:
+            print("{:8s} not available: {}".format(name, err))
+            continue
+
+        preds, rate = run(backend, batches)
+        backend.close()
+
+        line = "{:8s} {:8.1f} images/sec".format(name, rate)
+        if reference is None:
+            reference = preds
+        else:
+            max_diff = np.abs(preds - reference).max()
+            agreement = np.mean(preds.argmax(axis=1) ==
+                                reference.argmax(axis=1))
+            parity = max_diff <= PARITY_TOLERANCE
+            failed |= not parity
+            line += "  max softmax diff {:.2e} ({})  class agreement " \
+                    "{:6.1%}".format(max_diff, "ok" if parity else "FAILED",
+                                     agreement)
+
+        print(line)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Compare the image decoders used for classification.
+
+Usage: python scripts/benchmark_decoders.py <image directory>
+                                            [--model MODEL] [--limit N]
+
+Reports the decode time per image of every available decoder and how
+far its output is from the full resolution reference decode ('full',
+which equals `keras.preprocessing.image.load_img`). With --model, the
+images are also classified with every decoder and the agreement of the
+predicted classes with the reference is reported.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import image_decoder  # noqa: E402
+
+TARGET_SIZE = (299 + 20, 299 + 20)
+
+
+def time_decoder(decoder, paths):
+    """Return the decoded images and the decode time per image."""
+    start = time.perf_counter()
+    images = [decoder(path, TARGET_SIZE) for path in paths]
+    return images, (time.perf_counter() - start) / len(paths)
+
+
+def predict(model, images):
+    """Class predictions of the model for decoded uint8 images."""
+    from keras.applications.inception_resnet_v2 import preprocess_input
+
+    x = np.stack(images).astype(np.float32)[:, 10:-10, 10:-10, :]
+    # metadata is not part of the comparison, use a fixed temp and hour
+    meta = np.tile(np.array([[20.0, 12.0]], dtype=np.float32), (len(x), 1))
+    return model.predict([preprocess_input(x), meta], batch_size=16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image decoder benchmark")
+    parser.add_argument('directory', help="Directory with Reconyx images.")
+    parser.add_argument('--model', help="Keras model for the parity check.")
+    parser.add_argument('--limit', type=int, default=200, metavar='N',
+                        help="Maximum number of images to decode.")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.directory, fname)
+                   for fname in os.listdir(args.directory)
+                   if fname.lower().endswith((".jpg", ".jpeg")))[:args.limit]
+
+    if not paths:
+        print("No .jpg files found in '{}'".format(args.directory))
+        return
+
+    model = None
+    if args.model:
+        import keras.models
+        model = keras.models.load_model(args.model)
+
+    decoders = image_decoder.available_decoders()
+    reference, _ = time_decoder(decoders['full'], paths)
+    reference_preds = predict(model, reference) if model else None
+
+    print("{} images, decoders: {}".format(len(paths), ", ".join(decoders)))
+    for name, decoder in decoders.items():
+        images, per_image = time_decoder(decoder, paths)
+        diff = np.mean([np.abs(img.astype(np.int16) - ref).mean()
+                        for img, ref in zip(images, reference)])
+
+        line = "{:10s} {:8.2f} ms/image  mean abs pixel diff {:6.2f}".format(
+            name, per_image * 1e3, diff)
+
+        if model:
+            preds = predict(model, images)
+            agreement = np.mean(preds.argmax(axis=1) ==
+                                reference_preds.argmax(axis=1))
+            max_diff = np.abs(preds - reference_preds).max()
+            line += "  class agreement {:6.1%}  max prob diff {:.3f}".format(
+                agreement, max_diff)
+
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
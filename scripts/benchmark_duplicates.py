@@ -0,0 +1,100 @@
+"""Benchmark the duplicate detection of the training data reader.
+
+Usage: python scripts/benchmark_duplicates.py [--rows N] [--check_rows N]
+
+Runs `_check_duplicates` on a synthetic frame with N rows (3 images per
+event, some duplicated events with equal or different labels) and checks
+it against the previous per-event implementation on a smaller frame.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils.io import _check_duplicates  # noqa: E402
+
+
+def check_duplicates_reference(data: pd.DataFrame):
+    """The previous O(events x rows) implementation."""
+    event_groups = data.groupby('event_id')
+
+    duplicate_col = np.zeros(data.shape[0], dtype=np.uint8)
+
+    for group in event_groups:
+        sequence_group = group[1].groupby(['sequence_idx'])
+        group_index = data.event_id == group[0]
+        duplicate_ids = any(sequence_group['sequence_idx'].count() > 1)
+
+        if duplicate_ids:
+            if group[1]['label'].unique().size > 1:
+                duplicate_col[group_index] = 2
+            else:
+                duplicate_col[group_index] = 1
+        else:
+            duplicate_col[group_index] = 0
+
+    data['duplicates'] = duplicate_col
+
+
+def make_frame(num_rows, seed=0):
+    """Synthetic frame of 3-image events, 5% of them copied again."""
+    rng = np.random.RandomState(seed)
+    num_events = num_rows // 3
+
+    event_id = np.repeat(np.arange(num_events), 3)
+    sequence_idx = np.tile([1, 2, 3], num_events)
+    label = rng.choice(['cheetah', 'leopard', 'unknown'], num_events)
+    label = np.repeat(label, 3)
+
+    # copy some events, half of the copies get another label
+    copied = rng.rand(num_events) < 0.05
+    copy_rows = np.repeat(copied, 3)
+    copy_label = label[copy_rows].copy()
+    relabel = np.repeat(rng.rand(copied.sum()) < 0.5, 3)
+    copy_label[relabel] = 'unknown'
+
+    data = pd.DataFrame({
+        'event_id': np.concatenate([event_id, event_id[copy_rows]]),
+        'sequence_idx': np.concatenate([sequence_idx,
+                                        sequence_idx[copy_rows]]),
+        'label': np.concatenate([label, copy_label]),
+    })
+
+    return data.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Duplicate check benchmark")
+    parser.add_argument('--rows', type=int, default=1000000, metavar='N',
+                        help="Rows of the benchmark frame.")
+    parser.add_argument('--check_rows', type=int, default=30000, metavar='N',
+                        help="Rows of the frame compared to the reference.")
+    args = parser.parse_args()
+
+    data = make_frame(args.check_rows)
+    expected = data.copy()
+
+    start = time.perf_counter()
+    check_duplicates_reference(expected)
+    reference_time = time.perf_counter() - start
+
+    _check_duplicates(data)
+    same = (data['duplicates'].values == expected['duplicates'].values).all()
+    print("{} rows: reference {:.2f}s, results identical: {}".format(
+        len(data), reference_time, same))
+
+    data = make_frame(args.rows)
+    start = time.perf_counter()
+    _check_duplicates(data)
+    print("{} rows: {:.2f}s".format(len(data), time.perf_counter() - start))
+    print(data['duplicates'].value_counts().sort_index().to_string())
+
+
+if __name__ == '__main__':
+    main()
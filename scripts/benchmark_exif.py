@@ -0,0 +1,98 @@
+"""Compare the MakerNote fast path against the exifread path.
+
+Usage: python scripts/benchmark_exif.py <image directory> [--repeat N]
+
+Reports files/sec for both readers, checks that both decode to identical
+MakerNotes for every file and reports the MakerNote decoding cost.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import exif_utils  # noqa: E402
+
+
+def time_reader(read_fn, paths, repeat):
+    """Return files/sec of `read_fn` over `paths`, best of `repeat` runs."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            try:
+                read_fn(path)
+            except (IOError, KeyError, ValueError):
+                pass
+        best = min(best, time.perf_counter() - start)
+
+    return len(paths) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXIF reader benchmark")
+    parser.add_argument('directory', help="Directory with Reconyx images.")
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help="Number of timed runs, the best one counts.")
+    args = parser.parse_args()
+
+    paths = [os.path.join(args.directory, fname)
+             for fname in os.listdir(args.directory)
+             if fname.lower().endswith((".jpg", ".jpeg"))]
+
+    if not paths:
+        print("No .jpg files found in '{}'".format(args.directory))
+        return
+
+    # check that both paths produce the same metadata
+    mismatches = 0
+    for path in paths:
+        try:
+            fast = exif_utils._decode(exif_utils._read_makernote(path))
+            slow = exif_utils._decode(
+                exif_utils._read_makernote_exifread(path))
+        except (IOError, KeyError, ValueError):
+            continue
+
+        if fast != slow:
+            mismatches += 1
+            print("Mismatch for '{}'".format(path))
+
+    fast_rate = time_reader(exif_utils._read_makernote, paths, args.repeat)
+    slow_rate = time_reader(exif_utils._read_makernote_exifread, paths,
+                            args.repeat)
+
+    print("{} files, {} mismatches".format(len(paths), mismatches))
+    print("fast path: {:10.1f} files/sec".format(fast_rate))
+    print("exifread:  {:10.1f} files/sec".format(slow_rate))
+    print("speedup:   {:10.1f}x".format(fast_rate / slow_rate))
+
+    # decoding cost of the MakerNote itself, per blob and batched
+    makernotes = []
+    for path in paths:
+        try:
+            makernotes.append(exif_utils._read_makernote(path))
+        except (IOError, KeyError, ValueError):
+            pass
+
+    if makernotes:
+        repeat = max(1, 100000 // len(makernotes))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for makernote in makernotes:
+                exif_utils._decode(makernote)
+        single = (time.perf_counter() - start) / (repeat * len(makernotes))
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            exif_utils.decode_makernote_batch(makernotes)
+        batch = (time.perf_counter() - start) / (repeat * len(makernotes))
+
+        print("decode:    {:10.2f} us/image".format(single * 1e6))
+        print("batched:   {:10.2f} us/image".format(batch * 1e6))
+
+
+if __name__ == '__main__':
+    main()
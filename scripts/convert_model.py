@@ -0,0 +1,37 @@
+"""Convert the Keras classification model for the other inference backends.
+
+Usage: python scripts/convert_model.py <model.hdf5> [--output MODEL.onnx]
+
+Writes the ONNX model next to the Keras model by default, where the
+'onnx' backend of the classifier looks for it, and a .onnx.json file
+recording the Keras model it was converted from. The ONNX model is only
+used while that file is unchanged, so convert again after replacing
+the Keras model. Needs the onnx and keras2onnx packages, with the
+pinned environment.yml (TensorFlow 1.10, Keras 2.2.2, numpy 1.14.5)
+install keras2onnx==1.5.0 onnx==1.5.0 onnxruntime==1.1.0, newer
+releases need a newer numpy. tests/test_backends.py checks that the
+converted model gives the predictions of the Keras model.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import backends  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model converter")
+    parser.add_argument('model', help="Keras model file (.hdf5).")
+    parser.add_argument('--output', default=None,
+                        help="Path of the ONNX model.")
+    args = parser.parse_args()
+
+    onnx_path = backends.convert_to_onnx(args.model, args.output)
+    print("Wrote '{}'".format(onnx_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""List or prune the stored predictions of retired models.
+
+Usage: python scripts/prune_predictions.py --store PREDICTIONS.sqlite
+           [--keep MODEL [MODEL ...]] [--model HASH [HASH ...]]
+
+Without options, the models in the prediction store are listed with the
+number of stored predictions. With --keep, the predictions of all models
+but the given model files are deleted, with --model those of the models
+with the given hashes (as listed). For a Keras model, --keep also keeps
+the models the other backends load instead (e.g. the converted ONNX
+model next to it). A --keep model file that does not exist is an error,
+so a mistyped path does not delete the predictions of every model.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import backends, prediction_store  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction store pruning")
+    parser.add_argument('--store', required=True,
+                        help="The prediction store file.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--keep', nargs='+', metavar='MODEL',
+                       help="Keep the predictions of these model files "
+                            "only.")
+    group.add_argument('--model', nargs='+', metavar='HASH',
+                       help="Delete the predictions of these models.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.store):
+        print("No prediction store '{}'".format(args.store))
+        return
+
+    if args.keep is None and args.model is None:
+        for model, count, paths, last_used in \
+                prediction_store.stored_models(args.store):
+            print("{}  {:8d} predictions  last used {}  {}".format(
+                model, count,
+                time.strftime("%Y-%m-%d", time.localtime(last_used)),
+                ", ".join(paths)))
+        return
+
+    keep = None
+    if args.keep is not None:
+        # the predictions are stored for the file the backend loads
+        keep = []
+        for path in args.keep:
+            if not os.path.isfile(path):
+                parser.error("model file '{}' does not exist".format(path))
+            paths = {backends.model_file(name, path)
+                     for name in backends.BACKENDS}
+            keep += [prediction_store.file_hash(model_path)
+                     for model_path in sorted(paths)
+                     if os.path.isfile(model_path)]
+
+    deleted = prediction_store.prune(args.store, args.model, keep)
+    print("Deleted {} predictions".format(deleted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Quantize the classification model to int8 and compare it to the float model.
+
+Usage: python scripts/quantize_model.py <model.hdf5> <training directory>
+           [--mode static|dynamic] [--calibration N] [--eval_limit N]
+           [--report REPORT.json]
+
+The training directory has one subdirectory per class, as read by
+`read_training_metadata`. A calibration sample of it is used to
+quantize the ONNX model (see scripts/convert_model.py), then the float
+and the quantized model classify the images and the report compares
+per-class and event-level accuracy, images/sec and model size.
+Classify with the quantized model with
+`--backend onnx --model <model>_static.onnx`.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils.io import read_training_metadata  # noqa: E402
+from data_utils.backends import onnx_model_path  # noqa: E402
+from data_utils.classifier import ImageClassifier  # noqa: E402
+from data_utils import quantization  # noqa: E402
+
+DEFAULT_LABELS = ['unknown', 'cheetah', 'leopard']
+
+
+def evaluate(model_path, data, labels, batch_size):
+    """Accuracies and images/sec of a model on the labeled data."""
+    classifier = ImageClassifier(model_path, batch_size, labels,
+                                 decode_workers=2, prefetch=2,
+                                 backend='onnx')
+
+    data = data.drop(columns=['label'])
+    start = time.perf_counter()
+    data = classifier.classify_data(data, classify_events=True)
+    elapsed = time.perf_counter() - start
+
+    report = quantization.accuracy_report(data, labels)
+    report["images_per_sec"] = len(data) / elapsed
+    report["model_size_mb"] = os.path.getsize(model_path) / 1024 ** 2
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model quantization")
+    parser.add_argument('model', help="Keras model file (.hdf5).")
+    parser.add_argument('directory', help="Directory with one "
+                                          "subdirectory of images per class.")
+    parser.add_argument('--labels', nargs='+', default=DEFAULT_LABELS,
+                        help="Class labels in model output order, also "
+                             "used to find the class directories.")
+    parser.add_argument('--mode', default='static',
+                        choices=['static', 'dynamic'],
+                        help="int8 weights and activations (static) or "
+                             "int8 weights only (dynamic).")
+    parser.add_argument('--calibration', type=int, default=300, metavar='N',
+                        help="Number of calibration images.")
+    parser.add_argument('--eval_limit', type=int, default=None, metavar='N',
+                        help="Evaluate on at most N events.")
+    parser.add_argument('--batch_size', type=int, default=16, metavar='N')
+    parser.add_argument('--workers', type=int, default=4, metavar='N',
+                        help="Number of threads reading image metadata.")
+    parser.add_argument('--report', default=None,
+                        help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    data = read_training_metadata(args.directory, args.labels,
+                                  workers=args.workers)
+    # classify_data replaces 'label' with the predicted label
+    data['true_label'] = data['label']
+
+    calibration = quantization.calibration_sample(data, args.calibration)
+    quantized_path = quantization.quantize_model(args.model, args.mode,
+                                                 calibration)
+    print("Wrote '{}'".format(quantized_path))
+
+    if args.eval_limit:
+        events = data.event_id.drop_duplicates().sample(
+            min(args.eval_limit, data.event_id.nunique()), random_state=0)
+        data = data[data.event_id.isin(events)]
+
+    reports = {
+        "float": evaluate(onnx_model_path(args.model), data, args.labels,
+                          args.batch_size),
+        args.mode: evaluate(quantized_path, data, args.labels,
+                            args.batch_size),
+    }
+
+    keys = list(reports["float"])
+    print("{:20s}".format("") + "".join("{:>12s}".format(name)
+                                        for name in reports))
+    for key in keys:
+        print("{:20s}".format(key) + "".join(
+            "{:12s}".format("") if report[key] is None
+            else "{:12.3f}".format(report[key])
+            for report in reports.values()))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Validate the empty frame filter against labeled image directories.
+
+Usage: python scripts/validate_empty_filter.py <training directory>
+           [--recall R [R ...]] [--labels L [L ...]] [--workers N]
+
+The training directory has one subdirectory per class, as read by
+`read_training_metadata`. The motion scores of all frames are computed,
+then for every recall target the threshold that keeps that fraction of
+the animal frames (all classes but 'unknown') is reported, with the
+fraction of 'unknown' frames it removes before the main model. Pass the
+threshold to `cheetah_classifier.py --empty_threshold`.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils.io import read_training_metadata  # noqa: E402
+from data_utils.empty_filter import (  # noqa: E402
+    motion_scores, recall_threshold)
+
+DEFAULT_LABELS = ['unknown', 'cheetah', 'leopard']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Empty frame filter "
+                                                 "validation")
+    parser.add_argument('directory', help="Directory with one "
+                                          "subdirectory of images per class.")
+    parser.add_argument('--labels', nargs='+', default=DEFAULT_LABELS,
+                        help="Class labels, also used to find the class "
+                             "directories.")
+    parser.add_argument('--recall', nargs='+', type=float,
+                        default=[0.95, 0.98, 0.99, 0.995, 1.0],
+                        help="Target recalls of the animal frames.")
+    parser.add_argument('--workers', type=int, default=4, metavar='N',
+                        help="Number of threads reading the images.")
+    args = parser.parse_args()
+
+    if 'unknown' not in args.labels:
+        parser.error("The labels need an 'unknown' class")
+
+    data = read_training_metadata(args.directory, args.labels,
+                                  workers=args.workers)
+
+    start = time.perf_counter()
+    scores = motion_scores(data, args.workers)
+    elapsed = time.perf_counter() - start
+    print("Scored {} images at {:.1f} images/sec".format(
+        len(data), len(data) / elapsed))
+
+    is_animal = (data.label != 'unknown').values
+    print("{:>8s} {:>10s} {:>10s} {:>14s} {:>12s}".format(
+        "target", "threshold", "recall", "empty removed", "model load"))
+    for target in args.recall:
+        threshold = recall_threshold(scores, is_animal, target)
+        empty = scores < threshold
+        print("{:8.3f} {:10.4f} {:10.2%} {:14.2%} {:12.2%}".format(
+            target, threshold, 1 - empty[is_animal].mean(),
+            empty[~is_animal].mean() if (~is_animal).any() else 0.0,
+            1 - empty.mean()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import io
+import struct
+import datetime
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Reconyx HyperFire MakerNote layout, see data_utils.exif_utils
+MAKERNOTE_VERSION = 61697
+MAKERNOTE_LENGTH = 108
+
+
+def _makernote(serial, time, sequence_idx, sequence_max, event, temp):
+    note = bytearray(MAKERNOTE_LENGTH)
+    struct.pack_into('<H', note, 0x00, MAKERNOTE_VERSION)
+    struct.pack_into('<2H', note, 0x0e, sequence_idx, sequence_max)
+    struct.pack_into('<2H', note, 0x12, 0, event)
+    struct.pack_into('<6H', note, 0x16, time.second, time.minute, time.hour,
+                     time.month, time.day, time.year)
+    struct.pack_into('<h', note, 0x26, temp * 9 // 5 + 32)
+    struct.pack_into('<h', note, 0x28, temp)
+    encoded = serial.encode('utf-16-le')[:30]
+    note[0x2a:0x2a + len(encoded)] = encoded
+    # contrast, brightness, sharpness, saturation
+    struct.pack_into('<4H', note, 0x48, 50, 60, 70, 80)
+    return bytes(note)
+
+
+def _exif_segment(makernote):
+    """APP1 segment with IFD0 -> Exif IFD -> MakerNote."""
+    exif_offset = 8 + 2 + 12 + 4
+    makernote_offset = exif_offset + 2 + 12 + 4
+    tiff = b'II' + struct.pack('<HI', 42, 8)
+    tiff += struct.pack('<H', 1) + \
+        struct.pack('<HHII', 0x8769, 4, 1, exif_offset) + struct.pack('<I', 0)
+    tiff += struct.pack('<H', 1) + \
+        struct.pack('<HHII', 0x927c, 7, len(makernote), makernote_offset) + \
+        struct.pack('<I', 0)
+    payload = b'Exif\x00\x00' + tiff + makernote
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def write_reconyx_jpeg(path, serial, time, event, sequence_idx=1,
+                       sequence_max=1, temp=20, seed=0, size=(64, 48)):
+    """Write a small JPEG with the metadata of a Reconyx camera image."""
+    pixels = np.random.RandomState(seed).randint(
+        0, 255, (size[1], size[0], 3)).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG')
+    data = buffer.getvalue()
+    with open(path, 'wb') as f:
+        f.write(data[:2] + _exif_segment(_makernote(
+            serial, time, sequence_idx, sequence_max, event, temp)) +
+            data[2:])
+    return path
+
+
+@pytest.fixture
+def reconyx_dir(tmp_path):
+    """Create a directory of Reconyx images, by default two cameras
+    with `events` events of three images each, and return its path.
+
+    The events of a camera start `event_gaps` apart, a list of one gap
+    per event after the first, or one gap for all of them.
+    """
+    def make(events=4, cameras=("CAM1", "CAM2"), per_event=3,
+             start=datetime.datetime(2018, 1, 9, 23, 50, 0),
+             event_gaps=datetime.timedelta(minutes=3)):
+        if not isinstance(event_gaps, list):
+            event_gaps = [event_gaps] * (events - 1)
+        directory = tmp_path / "images"
+        directory.mkdir()
+        seed = 0
+        for camera in cameras:
+            time = start
+            for event in range(1, events + 1):
+                if event > 1:
+                    time += event_gaps[event - 2]
+                for idx in range(1, per_event + 1):
+                    write_reconyx_jpeg(
+                        str(directory / "{}_{:04d}_{}.JPG".format(
+                            camera, event, idx)),
+                        camera, time + datetime.timedelta(seconds=idx),
+                        event, idx, per_event, temp=10 + event, seed=seed)
+                    seed += 1
+        return str(directory)
+
+    return make
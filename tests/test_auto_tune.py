@@ -0,0 +1,85 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import auto_tune  # noqa: E402
+from data_utils.auto_tune import TuningSettings  # noqa: E402
+
+THREADS = [(4, 1), (4, 2), (2, 2)]
+
+# images/sec by batch size, 16 is not 5% faster than 8
+RATES = {1: 10.0, 4: 30.0, 8: 40.0, 16: 41.0, 32: 60.0, 64: 70.0}
+# speedup of the thread configurations
+SPEEDUPS = {(4, 1): 1.0, (4, 2): 1.2, (2, 2): 0.9}
+
+
+class FakeBackend:
+    loads = []
+
+    def __init__(self, name, model_path, intra_op_threads, inter_op_threads):
+        self.loads.append((name, model_path))
+        self.threads = (intra_op_threads, inter_op_threads)
+        self.closed = False
+
+    def set_threads(self, intra_op_threads, inter_op_threads):
+        self.threads = (intra_op_threads, inter_op_threads)
+
+    def close(self):
+        self.closed = True
+
+
+def _calibrate(monkeypatch, **calibrate_args):
+    FakeBackend.loads = []
+    measured = []
+
+    def measure(model, batch_size):
+        measured.append((batch_size,) + model.threads)
+        return RATES[batch_size] * SPEEDUPS[model.threads]
+
+    monkeypatch.setattr(auto_tune, "create_backend", FakeBackend)
+    monkeypatch.setattr(auto_tune, "_measure", measure)
+    settings = auto_tune.calibrate("model.hdf5", "onnx", threads=THREADS,
+                                   **calibrate_args)
+    return settings, measured
+
+
+def test_calibrate_loads_the_selected_backend_once(monkeypatch):
+    settings, measured = _calibrate(monkeypatch)
+
+    assert FakeBackend.loads == [("onnx", "model.hdf5")]
+    # the batch sizes stop at the first one that is not faster, only
+    # the selected one is run with the other thread configurations
+    assert measured == [(1, 4, 1), (4, 4, 1), (8, 4, 1), (16, 4, 1),
+                        (8, 4, 2), (8, 2, 2)]
+    assert settings == TuningSettings(8, 4, 2, 40.0 * 1.2)
+
+
+def test_calibrate_stops_at_the_memory_limit(monkeypatch):
+    usage = iter([1000, 1010, 1200])
+    monkeypatch.setattr(auto_tune, "memory_usage", lambda: next(usage))
+    # batch size 4 used 200 bytes on top of the model, 8 would need 400
+    settings, measured = _calibrate(monkeypatch, memory_limit=1250)
+
+    assert measured == [(1, 4, 1), (4, 4, 1), (4, 4, 2), (4, 2, 2)]
+    assert settings == TuningSettings(4, 4, 2, 30.0 * 1.2)
+
+
+def test_settings_are_stored_per_backend(tmp_path):
+    model_path = str(tmp_path / "model.hdf5")
+    for path in [model_path, str(tmp_path / "model.onnx")]:
+        with open(path, 'wb') as f:
+            f.write(b"model")
+    tuning_file = str(tmp_path / "tuning.json")
+    keras_settings = TuningSettings(8, 4, 1, 40.0)
+    onnx_settings = TuningSettings(16, 2, 2, 50.0)
+
+    auto_tune.save_settings(model_path, keras_settings, "keras", tuning_file)
+    assert auto_tune.load_settings(model_path, "onnx", tuning_file) is None
+
+    auto_tune.save_settings(model_path, onnx_settings, "onnx", tuning_file)
+    assert auto_tune.load_settings(model_path, "keras",
+                                   tuning_file) == keras_settings
+    assert auto_tune.load_settings(model_path, "onnx",
+                                   tuning_file) == onnx_settings
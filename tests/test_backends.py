@@ -0,0 +1,119 @@
+import os
+import sys
+import shutil
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import backends  # noqa: E402
+
+# softmax outputs of the backends may differ by float32 rounding only
+TOLERANCE = 1e-5
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("keras")
+
+
+def _inputs(batch_size=4):
+    rng = np.random.RandomState(0)
+    images = rng.uniform(-1, 1, (batch_size, 32, 32, 3)).astype(np.float32)
+    meta = rng.uniform(0, 1, (batch_size, 2)).astype(np.float32)
+    return [images, meta]
+
+
+@pytest.fixture(scope='module')
+def keras_model(tmpdir_factory):
+    """A small (image, meta) model like the classification model, saved
+    as HDF5, and its Keras predictions."""
+    import keras.backend as K
+    from keras import layers, models
+
+    image = layers.Input((32, 32, 3))
+    meta = layers.Input((2,))
+    x = layers.Conv2D(8, 3, activation='relu')(image)
+    x = layers.BatchNormalization()(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.5)(layers.concatenate([x, meta]))
+    output = layers.Dense(3, activation='softmax')(x)
+    model = models.Model([image, meta], output)
+    model.compile('sgd', 'categorical_crossentropy')
+    # non-trivial batch norm statistics, which the frozen graph must use
+    model.layers[2].set_weights([np.full(8, 1.5), np.full(8, 0.2),
+                                 np.full(8, 0.3), np.full(8, 2.0)])
+
+    model_path = str(tmpdir_factory.mktemp("model").join("model.hdf5"))
+    model.save(model_path)
+    K.clear_session()
+
+    reference = models.load_model(model_path).predict(_inputs())
+    K.clear_session()
+    return model_path, reference
+
+
+def test_keras_backend_matches_keras_predict(keras_model):
+    model_path, reference = keras_model
+
+    # the first load builds the frozen graph, the second loads it
+    for _ in range(2):
+        backend = backends.KerasBackend(model_path)
+        try:
+            preds = backend.predict(_inputs())
+        finally:
+            backend.close()
+        np.testing.assert_allclose(preds, reference, atol=TOLERANCE)
+    assert os.path.exists(backends.frozen_model_path(model_path))
+
+
+def test_onnx_backend_matches_keras_predict(keras_model):
+    pytest.importorskip("keras2onnx")
+    if not backends.HAS_ONNXRUNTIME:
+        pytest.skip("onnxruntime is not installed")
+    model_path, reference = keras_model
+
+    backends.convert_to_onnx(model_path)
+    assert backends.default_backend(model_path) == "onnx"
+    backend = backends.OnnxBackend(model_path)
+    preds = backend.predict(_inputs())
+    np.testing.assert_allclose(preds, reference, atol=TOLERANCE)
+
+
+def _cached_load(model_path):
+    """Load the Keras backend, returns whether the frozen graph was
+    cached and the predictions."""
+    backend = backends.KerasBackend(model_path)
+    try:
+        return "model load (cached)" in backend.timings, \
+            backend.predict(_inputs())
+    finally:
+        backend.close()
+
+
+def test_frozen_graph_follows_the_model_file(keras_model, tmp_path):
+    reference_path, reference = keras_model
+    model_path = str(tmp_path / "model.hdf5")
+    shutil.copy(reference_path, model_path)
+    assert not _cached_load(model_path)[0]
+
+    # touched, but the same content
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cached, preds = _cached_load(model_path)
+    assert cached
+    np.testing.assert_allclose(preds, reference, atol=TOLERANCE)
+
+    # replaced by another model
+    import keras.backend as K
+    from keras import models
+    model = models.load_model(model_path)
+    weights = model.get_weights()
+    model.set_weights([w * 0.5 for w in weights])
+    model.save(model_path)
+    expected = model.predict(_inputs())
+    K.clear_session()
+
+    cached, preds = _cached_load(model_path)
+    assert not cached
+    np.testing.assert_allclose(preds, expected, atol=TOLERANCE)
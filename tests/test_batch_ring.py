@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import io  # noqa: E402
+from data_utils.batch_ring import ring_batches  # noqa: E402
+from data_utils.classifier import DataFrameSequence, decoded_batches  # noqa: E402
+from data_utils.image_decoder import decode_full  # noqa: E402
+
+BROKEN_IMAGE = "CAM2_0003_2.JPG"
+
+
+def _broken_decoder(path, target_size):
+    """Decoder failing on one image, run in the decoder processes."""
+    if os.path.basename(path) == BROKEN_IMAGE:
+        raise ValueError("cannot decode {}".format(path))
+    return decode_full(path, target_size)
+
+
+def _exiting_decoder(path, target_size):
+    """Decoder ending its process, like a crash in a native decoder."""
+    os._exit(1)
+
+
+def _sequence(reconyx_dir, batch_size=5):
+    data = io.read_dir_metadata(reconyx_dir(events=4))
+    # 24 images, the last batch is a partial one
+    return DataFrameSequence(data, batch_size)
+
+
+@pytest.mark.parametrize("processes,prefetch", [(1, 1), (3, 2)])
+def test_ring_batches_match_decoded_batches(reconyx_dir, processes, prefetch):
+    data_seq = _sequence(reconyx_dir)
+
+    # the yielded inputs are only valid until the next batch, copy them
+    expected = [[x.copy() for x in inputs]
+                for inputs in decoded_batches(data_seq)]
+    batches = [[x.copy() for x in inputs]
+               for inputs in ring_batches(data_seq, processes, prefetch)]
+
+    assert len(batches) == len(expected) == len(data_seq)
+    for batch, (images, meta) in zip(batches, expected):
+        np.testing.assert_array_equal(batch[0], images)
+        np.testing.assert_array_equal(batch[1], meta)
+
+
+def test_ring_batches_raise_decoder_error(reconyx_dir):
+    data_seq = _sequence(reconyx_dir)
+
+    with pytest.raises(ValueError, match="cannot decode"):
+        for _ in ring_batches(data_seq, 2, 1, decoder=_broken_decoder):
+            pass
+
+
+def test_ring_batches_report_dead_decoder_process(reconyx_dir):
+    data_seq = _sequence(reconyx_dir)
+
+    with pytest.raises(RuntimeError, match="__main__"):
+        for _ in ring_batches(data_seq, 1, 1, decoder=_exiting_decoder):
+            pass
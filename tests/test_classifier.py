@@ -0,0 +1,243 @@
+import os
+import sys
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import classifier, io  # noqa: E402
+from data_utils.backends import InferenceBackend  # noqa: E402
+from data_utils.image_decoder import decode_full  # noqa: E402
+
+from conftest import write_reconyx_jpeg  # noqa: E402
+
+LABELS = ['unknown', 'cheetah', 'leopard']
+
+
+def _old_event_labels(preds, groups, unknown=0):
+    """The groupby/nanargmax rule `classify_data` used before
+    `max_labels`: the argmax of the concatenated predictions of the
+    event, modulo the number of classes."""
+    nan_argmax = lambda x: unknown if np.isnan(x).all() \
+        else np.nanargmax(x)
+    data = pd.DataFrame({"predict_probs": list(preds)})
+    group_label = lambda x: nan_argmax(np.concatenate(x.tolist())) \
+        % preds.shape[1]
+    return data['predict_probs'].groupby(np.asarray(groups))\
+        .transform(group_label).values.astype(np.int64)
+
+
+def test_max_labels_matches_old_event_rule_with_ties():
+    rng = np.random.RandomState(0)
+    # coarse probabilities, so rows and classes are often tied
+    preds = rng.randint(0, 4, (3000, 3)).astype(np.float32) / 4
+    preds[rng.rand(3000) < 0.1] = np.nan
+    preds[rng.rand(3000, 3) < 0.05] = np.nan
+    groups = rng.randint(0, 700, 3000)
+
+    np.testing.assert_array_equal(
+        classifier.max_labels(preds, groups, unknown=0),
+        _old_event_labels(preds, groups, unknown=0))
+
+
+def test_max_labels_ties_go_to_first_row_and_class():
+    preds = np.array([[0.1, 0.4, 0.4],
+                      [0.4, 0.2, 0.4],
+                      [np.nan, np.nan, np.nan],
+                      [0.5, 0.5, 0.0]], dtype=np.float32)
+
+    np.testing.assert_array_equal(
+        classifier.max_labels(preds, [7, 3, 7, 3], unknown=0), [1, 0, 1, 0])
+    np.testing.assert_array_equal(
+        classifier.max_labels(preds, unknown=2), [1, 0, 2, 0])
+    np.testing.assert_array_equal(
+        classifier.max_labels(preds[2:3], [1], unknown=2), [2])
+
+
+def test_prediction_matrix_from_probability_columns():
+    preds = np.random.RandomState(1).rand(5, 3).astype(np.float32)
+    data = pd.DataFrame({column: preds[:, idx] for idx, column in
+                         enumerate(classifier.probability_columns(LABELS))})
+
+    matrix = classifier.prediction_matrix(data, LABELS)
+    assert matrix.dtype == np.float32
+    np.testing.assert_array_equal(matrix, preds)
+
+
+def test_unique_images_first_occurrences():
+    data = pd.DataFrame({"fingerprint": [5, 7, 5, 9, 7, 5]})
+    positions = np.array([0, 1, 2, 3, 4, 5])
+
+    unique, copies = classifier._unique_images(data, positions)
+    np.testing.assert_array_equal(unique, [0, 1, 3])
+    np.testing.assert_array_equal(copies, [0, 1, 0, 2, 1, 0])
+    # every position maps to an image with its fingerprint
+    np.testing.assert_array_equal(
+        data.fingerprint.values[unique[copies]], data.fingerprint.values)
+
+
+def test_unique_images_of_a_subset():
+    data = pd.DataFrame({"fingerprint": [5, 7, 5, 9, 7, 5]})
+    positions = np.array([1, 2, 4, 5])
+
+    unique, copies = classifier._unique_images(data, positions)
+    np.testing.assert_array_equal(unique, [1, 2])
+    np.testing.assert_array_equal(copies, [0, 1, 0, 1])
+
+
+def test_unique_images_without_fingerprints():
+    positions = np.array([0, 2, 3])
+    unique, copies = classifier._unique_images(
+        pd.DataFrame({"path": ["a", "b", "c", "d"]}), positions)
+    np.testing.assert_array_equal(unique, positions)
+    np.testing.assert_array_equal(copies, [0, 1, 2])
+
+
+def _copied_batches(batches):
+    # the yielded inputs are only valid until the next batch
+    return [[x.copy() for x in inputs] for inputs in batches]
+
+
+def test_prefetched_batches_equal_sequential_batches(reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=4))
+    data_seq = classifier.DataFrameSequence(data, 5)
+    expected = _copied_batches(classifier.decoded_batches(data_seq))
+    assert [len(images) for images, _ in expected] == [5, 5, 5, 5, 4]
+
+    for workers, prefetch in [(1, 1), (4, 2), (8, 1)]:
+        batches = _copied_batches(classifier.decoded_batches(
+            data_seq, workers, prefetch))
+        assert len(batches) == len(expected)
+        for batch, (images, meta) in zip(batches, expected):
+            np.testing.assert_array_equal(batch[0], images)
+            np.testing.assert_array_equal(batch[1], meta)
+
+
+def test_prefetched_batches_stop_when_closed(reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=4))
+    decoded = []
+
+    def decoder(path, target_size):
+        decoded.append(path)
+        return decode_full(path, target_size)
+
+    batches = classifier.decoded_batches(
+        classifier.DataFrameSequence(data, 2), 1, 1, decoder)
+    next(batches)
+    batches.close()
+    # only the first batch and the prefetched one were started
+    assert len(decoded) <= 4
+
+
+class TemperatureBackend(InferenceBackend):
+    """Predicts 'cheetah' with the ambient temperature of the frame in
+    percent, the rest goes to 'unknown', and counts the classified
+    frames."""
+
+    def __init__(self):
+        super().__init__()
+        self.frames = 0
+
+    def predict(self, inputs):
+        cheetah = inputs[1][:, 0] / 100
+        self.frames += len(cheetah)
+        return np.stack([1 - cheetah, cheetah, np.zeros_like(cheetah)],
+                        axis=1).astype(np.float32)
+
+
+@pytest.fixture
+def fake_classifier(monkeypatch):
+    """ImageClassifier with the `TemperatureBackend`."""
+    monkeypatch.setattr(classifier, "create_backend",
+                        lambda *args: TemperatureBackend())
+
+    def make(**kwargs):
+        return classifier.ImageClassifier("model.hdf5", 4, LABELS, **kwargs)
+
+    return make
+
+
+def test_sequence_ranks():
+    ranks = classifier._sequence_ranks([5, 5, 3, 5, 3],
+                                       np.array([3, 1, 2, 2, 1]))
+    np.testing.assert_array_equal(ranks, [2, 0, 1, 1, 0])
+
+
+def test_early_exit_skips_frames_after_a_confident_one(fake_classifier,
+                                                       reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=3, cameras=("CAM1",)))
+    # confident in the first frame of event 1, the second of event 2,
+    # never in event 3
+    data["ambient_temp"] = np.array(
+        [95, 10, 99, 20, 90, 30, 40, 50, 60], np.int16)[
+            (data.event2.values - 1) * 3 + data.sequence_idx.values - 1]
+
+    expected = fake_classifier().classify_data(data.copy())
+    early = fake_classifier(early_exit=0.8)
+    result = early.classify_data(data.copy())
+
+    assert early.backend.frames == 6
+    assert early.inferences_saved == pytest.approx(1 / 3)
+    skipped = np.isnan(result.prob_cheetah.values)
+    np.testing.assert_array_equal(
+        skipped, ((result.event2 == 1) & (result.sequence_idx > 1)) |
+        ((result.event2 == 2) & (result.sequence_idx > 2)))
+    np.testing.assert_array_equal(
+        result.prob_cheetah.values[~skipped],
+        expected.prob_cheetah.values[~skipped])
+    # the events get the same labels as without the early exit
+    np.testing.assert_array_equal(result.label.values, expected.label.values)
+
+
+def test_empty_frames_are_not_classified(fake_classifier, tmp_path):
+    # event 1 shows the same scene three times, in event 2 the second
+    # frame differs from the others
+    time = datetime.datetime(2018, 1, 9, 23, 50, 0)
+    for event, seeds in [(1, [0, 0, 0]), (2, [1, 2, 1])]:
+        for idx, seed in enumerate(seeds, 1):
+            write_reconyx_jpeg(
+                str(tmp_path / "CAM1_{}_{}.JPG".format(event, idx)), "CAM1",
+                time + datetime.timedelta(minutes=event, seconds=idx),
+                event, idx, 3, temp=90, seed=seed, size=(160, 120))
+    data = io.read_dir_metadata(str(tmp_path))
+
+    filtered = fake_classifier(empty_threshold=0.05)
+    result = filtered.classify_data(data)
+
+    assert filtered.backend.frames == 1
+    classified = ~np.isnan(result.prob_cheetah.values)
+    np.testing.assert_array_equal(
+        classified, (result.event2 == 2) & (result.sequence_idx == 2))
+    # events without a classified frame are 'unknown'
+    np.testing.assert_array_equal(
+        result.label.values, np.where(result.event2 == 2, 1, 0))
+
+
+def test_event_window_labels_merged_events(fake_classifier, reconyx_dir):
+    # events 1 and 2 of each camera are a minute apart, 3 is much later
+    minute = datetime.timedelta(minutes=1)
+    data = io.read_dir_metadata(reconyx_dir(
+        events=3, event_gaps=[minute, 30 * minute]))
+    # a cheetah is only seen in event 2 of CAM1, more confidently than
+    # 'unknown' (0.8) in the other frames
+    data["ambient_temp"] = np.where(
+        (data.serial_no == "CAM1") & (data.event2 == 2), 90, 20)
+
+    result = fake_classifier().classify_data(data.copy(), event_window=120)
+    merged = (result.serial_no == "CAM1") & (result.event2 <= 2)
+    np.testing.assert_array_equal(result.label.values,
+                                  np.where(merged, 1, 0))
+    np.testing.assert_array_equal(result.extended_event_id.values,
+                                  io.extended_event_ids(data, 120))
+    assert result.extended_event_id.nunique() == 4
+
+    # without the window, only event 2 is labelled
+    result = fake_classifier().classify_data(data.copy())
+    assert "extended_event_id" not in result
+    np.testing.assert_array_equal(
+        result.label.values,
+        np.where((result.serial_no == "CAM1") & (result.event2 == 2), 1, 0))
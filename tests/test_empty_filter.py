@@ -0,0 +1,58 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import empty_filter  # noqa: E402
+
+
+def _write(path, pixels):
+    Image.fromarray(pixels.astype(np.uint8)).save(path, 'JPEG', quality=95)
+    return path
+
+
+def _frames(tmp_path):
+    """An event of a still scene with one frame with an 'animal' in it
+    and one overexposed frame, and a single-frame event."""
+    scene = np.random.RandomState(0).randint(60, 160, (240, 320, 3))
+    animal = scene.copy()
+    animal[80:160, 100:220] = 250
+    paths = [_write(str(tmp_path / "{}.JPG".format(name)), pixels)
+             for name, pixels in [("still_1", scene), ("animal", animal),
+                                  ("still_2", scene),
+                                  ("bright", scene + 40), ("single", scene)]]
+    return pd.DataFrame({"path": paths, "event_id": [1, 1, 1, 1, 2]})
+
+
+def test_motion_scores(tmp_path):
+    data = _frames(tmp_path)
+    scores = empty_filter.motion_scores(data, workers=2)
+
+    still_1, animal, still_2, bright, single = scores
+    # the animal covers an eighth of the (cropped) frame
+    assert animal > 0.1
+    assert max(still_1, still_2, bright) < 0.01
+    assert single == np.inf
+
+
+def test_empty_mask(tmp_path):
+    data = _frames(tmp_path)
+    mask = empty_filter.EmptyFrameFilter(0.05).empty_mask(data)
+    np.testing.assert_array_equal(mask, [True, False, True, True, False])
+
+
+def test_recall_threshold():
+    scores = np.array([0.0, 0.5, 0.1, 0.3, 0.2, 0.05])
+    is_animal = np.array([False, True, False, True, True, False])
+
+    # keep all animal frames, or two of the three
+    assert empty_filter.recall_threshold(scores, is_animal, 1.0) == 0.2
+    assert empty_filter.recall_threshold(scores, is_animal, 0.6) == 0.3
+    with pytest.raises(ValueError):
+        empty_filter.recall_threshold(scores, np.zeros(6, bool), 1.0)
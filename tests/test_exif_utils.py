@@ -0,0 +1,118 @@
+import os
+import sys
+import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import exif_utils  # noqa: E402
+
+from conftest import write_reconyx_jpeg, _makernote  # noqa: E402
+
+TIME = datetime.datetime(2018, 1, 9, 23, 50, 7)
+
+
+def _image(tmp_path, name="CAM1_0001_1.JPG", **kwargs):
+    args = dict(serial="H500ABC", time=TIME, event=42, sequence_idx=2,
+                sequence_max=3, temp=-4)
+    args.update(kwargs)
+    return write_reconyx_jpeg(str(tmp_path / name), **args)
+
+
+def test_fast_reader_matches_exifread(tmp_path):
+    path = _image(tmp_path)
+    assert exif_utils._read_makernote_fast(path) == \
+        bytes(exif_utils._read_makernote_exifread(path))
+
+
+def test_fast_reader_skips_other_segments(tmp_path):
+    path = _image(tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # a JFIF APP0 segment before the EXIF APP1 segment
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    with open(path, 'wb') as f:
+        f.write(data[:2] + app0 + data[2:])
+
+    assert exif_utils._read_makernote_fast(path) == \
+        bytes(exif_utils._read_makernote_exifread(path))
+
+
+def test_make_exif_dict(tmp_path):
+    path = _image(tmp_path)
+    exif = exif_utils.make_exif_dict(path, "CAM1_0001_1.JPG")
+
+    assert exif["filename"] == "CAM1_0001_1.JPG"
+    assert exif["path"] == path
+    assert exif["datetime"] == TIME
+    assert exif["hour"] == TIME.hour
+    assert (exif["event2"], exif["sequence_idx"], exif["sequence_max"]) == \
+        (42, 2, 3)
+    assert exif["ambient_temp"] == -4
+    assert exif["serial_no"] == "H500ABC"
+    assert (exif["contrast"], exif["brightness"], exif["sharpness"],
+            exif["saturation"]) == (50, 60, 70, 80)
+
+
+def test_truncated_file_is_a_value_error(tmp_path):
+    path = _image(tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # cut inside the MakerNote, e.g. a partial copy
+    with open(path, 'wb') as f:
+        f.write(data[:100])
+
+    with pytest.raises(ValueError, match="Truncated"):
+        exif_utils.make_exif_dict(path, "CAM1_0001_1.JPG")
+
+
+def test_image_without_exif_is_rejected(tmp_path):
+    path = str(tmp_path / "plain.JPG")
+    with open(_image(tmp_path), 'rb') as f:
+        data = f.read()
+    # drop the APP1 segment again
+    app1_length = int.from_bytes(data[4:6], 'big')
+    with open(path, 'wb') as f:
+        f.write(data[:2] + data[4 + app1_length:])
+
+    with pytest.raises(ValueError):
+        exif_utils._read_makernote_fast(path)
+    with pytest.raises((ValueError, KeyError)):
+        exif_utils.make_exif_dict(path, "plain.JPG")
+
+
+def test_batch_decode_matches_single_decode():
+    times = [TIME, datetime.datetime(2019, 12, 31, 0, 0, 59),
+             datetime.datetime(2016, 2, 29, 12, 5, 0)]
+    notes = [_makernote(serial, time, idx + 1, 3, 100 + idx, temp)
+             for idx, (serial, time, temp) in enumerate(
+                 zip(["H500A", "H500B", "H500A"], times, [-4, 0, 35]))]
+    columns = exif_utils.decode_makernote_batch(notes)
+
+    assert columns["valid"].all()
+    assert list(columns["serial_no"]) == ["H500A", "H500B", "H500A"]
+    assert list(columns["datetime"].astype(datetime.datetime)) == times
+    for row, note in enumerate(notes):
+        decoded = exif_utils._decode(note)
+        for field in decoded._fields:
+            value = getattr(decoded, field)
+            if field == "serial_no":
+                continue
+            if isinstance(value, bytes):
+                # numpy drops the trailing zero bytes of byte strings
+                value = value.rstrip(b"\x00")
+            assert columns[field][row] == value, field
+
+
+def test_batch_decode_marks_invalid_notes():
+    note = _makernote("H500A", TIME, 1, 1, 7, 20)
+    wrong_version = b"\x00\x00" + note[2:]
+    columns = exif_utils.decode_makernote_batch(
+        [note, note[:50], wrong_version])
+
+    assert list(columns["valid"]) == [True, False, False]
+    assert columns["event2"][0] == 7
+    assert columns["datetime"][0] == np.datetime64(TIME)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import image_decoder  # noqa: E402
+
+TARGET_SIZE = (299, 299)
+
+
+def _write_jpeg(path, width=1280, height=960):
+    """A smooth test image, like a camera frame at Reconyx resolution."""
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height,
+                       (x + y) * 127 // (width + height)], axis=-1)
+    Image.fromarray(pixels.astype(np.uint8)).save(path, quality=90)
+    return path
+
+
+def test_default_decoder_is_full():
+    assert image_decoder.get_decoder() is image_decoder.decode_full
+    assert image_decoder.get_decoder('full') is image_decoder.decode_full
+
+
+def test_fast_decoders_stay_close_to_full(tmp_path):
+    path = _write_jpeg(str(tmp_path / "frame.jpg"))
+    reference = image_decoder.decode_full(path, TARGET_SIZE).astype(int)
+
+    for name, decoder in image_decoder.available_decoders().items():
+        image = decoder(path, TARGET_SIZE)
+        assert image.shape == TARGET_SIZE + (3,), name
+        assert image.dtype == np.uint8, name
+        assert np.abs(image.astype(int) - reference).mean() < 1, name
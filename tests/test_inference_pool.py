@@ -0,0 +1,85 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import io  # noqa: E402
+from data_utils.backends import KerasBackend  # noqa: E402
+from data_utils.classifier import DataFrameSequence, decoded_batches  # noqa: E402
+from data_utils.inference_pool import InferencePool, shard_by_group  # noqa: E402
+
+
+def test_shards_keep_groups_together():
+    rng = np.random.RandomState(0)
+    groups = rng.randint(0, 40, 500)
+    shards = shard_by_group(groups, 30)
+
+    positions = np.concatenate(shards)
+    np.testing.assert_array_equal(np.sort(positions), np.arange(500))
+    for shard in shards[:-1]:
+        assert len(shard) >= 30
+    shard_of_group = {}
+    for idx, shard in enumerate(shards):
+        for group in set(groups[shard]):
+            assert shard_of_group.setdefault(group, idx) == idx
+
+    # groups are packed in the order they first appear in
+    _, first = np.unique(groups, return_index=True)
+    first_groups = groups[np.sort(first)]
+    shard_groups = [group for shard in shards
+                    for group in dict.fromkeys(groups[shard])]
+    assert shard_groups == list(first_groups)
+
+
+def test_single_rows_as_groups():
+    shards = shard_by_group(np.arange(10), 4)
+    assert [list(shard) for shard in shards] == \
+        [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+@pytest.fixture(scope='module')
+def pooling_model(tmpdir_factory):
+    """A model with the input of the classification model, which only
+    averages the image, so it runs quickly."""
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("keras")
+    import keras.backend as K
+    from keras import layers, models
+
+    image = layers.Input((299, 299, 3))
+    meta = layers.Input((2,))
+    x = layers.concatenate([layers.GlobalAveragePooling2D()(image), meta])
+    output = layers.Dense(3, activation='softmax')(x)
+    model_path = str(tmpdir_factory.mktemp("model").join("model.hdf5"))
+    models.Model([image, meta], output).save(model_path)
+    K.clear_session()
+    return model_path
+
+
+def test_pool_predictions_match_in_process_predictions(pooling_model,
+                                                       reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=4))
+
+    backend = KerasBackend(pooling_model)
+    try:
+        expected = np.concatenate([
+            backend.predict(inputs)
+            for inputs in decoded_batches(DataFrameSequence(data, 4))])
+    finally:
+        backend.close()
+
+    pool = InferencePool(2, pooling_model, 4, "keras", threads=1)
+    try:
+        preds = pool.predict(data, data.event_id.values)
+        # a second job on the same processes
+        subset = data[::2]
+        subset_preds = pool.predict(subset)
+    finally:
+        pool.close()
+
+    np.testing.assert_allclose(preds, expected, atol=1e-6)
+    np.testing.assert_allclose(subset_preds, expected[::2], atol=1e-6)
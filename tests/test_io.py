@@ -0,0 +1,271 @@
+import os
+import sys
+import shutil
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import io  # noqa: E402
+
+
+def _event_rows(serial, start, count, step_secs, first_event=1):
+    """One single-image event per `step_secs` seconds of a camera, as
+    rows of the scan."""
+    rows = []
+    for idx in range(count):
+        time = start + datetime.timedelta(seconds=idx * step_secs)
+        filename = "{}_{}_{}.jpg".format(serial, first_event, idx)
+        rows.append({"filename": filename, "path": "/images/" + filename,
+                     "datetime": time, "event1": 0,
+                     "event2": first_event + idx, "sequence_idx": 1,
+                     "sequence_max": 1, "ambient_temp": 20,
+                     "hour": time.hour, "brightness": 0, "sharpness": 0,
+                     "saturation": 0, "contrast": 0, "serial_no": serial})
+    return rows
+
+
+def _frame(rows):
+    return io._rows_frame(rows, list(range(len(rows))))
+
+
+def _old_string_keys(data):
+    """The string keys `_add_event_keys` used to build."""
+    event_key_simple = data.serial_no.astype(str) + "_" + \
+        data.datetime.dt.year.astype(str) + "_" + \
+        data.datetime.dt.dayofyear.astype(str) + "_" + \
+        data.event2.astype(str)
+    sortkey = event_key_simple + \
+        data.datetime.values.astype(np.int64).astype(str)
+    return event_key_simple, sortkey
+
+
+def _random_rows(count, seed=0):
+    rng = np.random.RandomState(seed)
+    # serials that are prefixes of each other, days of year and event
+    # numbers of 1 to 5 digits, timestamps of 17 to 19 digits (1971-2030)
+    serials = np.array(["A", "A1", "AB", "B", "H500", "H5001"])
+    seconds = np.concatenate([
+        rng.randint(31536000, 32000000, count // 4),
+        rng.randint(126230400, 130000000, count // 4),
+        rng.randint(1514764800, 1893456000, count - count // 2)])
+    times = pd.to_datetime(seconds, unit='s').astype('datetime64[ns]')
+    event2 = np.concatenate([rng.randint(0, 20, count // 2),
+                             rng.randint(0, 65536, count - count // 2)])
+    return pd.DataFrame({"serial_no": serials[rng.randint(0, 6, count)],
+                         "event2": rng.permutation(event2).astype(np.uint16),
+                         "datetime": rng.permutation(times)})
+
+
+def test_metadata_column_dtypes(reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=2))
+
+    expected = dict(io._MetadataColumns.NUMERIC_COLUMNS)
+    for name, code in expected.items():
+        assert data[name].dtype == np.dtype(code), name
+    assert data.datetime.dtype == np.dtype("datetime64[ns]")
+    assert data.event_id.dtype == np.int64
+    assert data.sortkey.dtype == np.int64
+
+    assert data.serial_no.dtype.name == "category"
+    assert sorted(data.serial_no.cat.categories) == ["CAM1", "CAM2"]
+    for name in ["filename", "path"]:
+        assert pd.api.types.is_string_dtype(data[name]), name
+
+
+def test_parallel_scan_equals_sequential_scan(reconyx_dir):
+    directory = reconyx_dir(events=4)
+    # files without Reconyx metadata are skipped by both
+    with open(os.path.join(directory, "CAM1_0001_1.JPG"), 'rb') as f:
+        data = f.read()
+    with open(os.path.join(directory, "partial.JPG"), 'wb') as f:
+        f.write(data[:100])
+    with open(os.path.join(directory, "notes.jpg"), 'wb') as f:
+        f.write(b"not an image")
+
+    expected = io.read_dir_metadata(directory, sort_vals=False)
+    assert len(expected) == 24
+    for workers in [2, 8]:
+        data = io.read_dir_metadata(directory, sort_vals=False,
+                                    workers=workers)
+        pd.testing.assert_frame_equal(data, expected)
+
+
+def test_parallel_scan_can_be_aborted(reconyx_dir):
+    directory = reconyx_dir(events=4)
+    progress = []
+
+    def abort_after_first(percent):
+        progress.append(percent)
+        return len(progress) < 2
+
+    with pytest.raises(InterruptedError):
+        io.read_dir_metadata(directory, progress_callback=abort_after_first,
+                             workers=4)
+    assert len(progress) == 2
+
+
+def test_sortkey_matches_old_string_order():
+    data = _random_rows(20000)
+    assert set(data.datetime.dt.dayofyear) >= {1, 9, 10, 99, 100, 366}
+    event_key_simple, sortkey = _old_string_keys(data)
+    assert set(sortkey.str.len() - event_key_simple.str.len()) == \
+        {17, 18, 19}
+
+    io._add_event_keys(data)
+
+    old_ranks = np.unique(sortkey.values, return_inverse=True)[1]
+    np.testing.assert_array_equal(data.sortkey.values, old_ranks)
+    # the same grouping as the old string keys
+    old_ids = np.unique(event_key_simple.values, return_inverse=True)[1]
+    assert len(set(zip(data.event_id, old_ids))) == \
+        data.event_id.nunique() == old_ids.max() + 1
+
+
+def test_event_key_simple_compatibility_column():
+    data = _random_rows(1000)
+    event_key_simple, _ = _old_string_keys(data)
+
+    io._add_event_keys(data)
+    assert list(data.event_key_simple) == list(event_key_simple)
+
+
+def _old_duplicates(data):
+    """The per-event rule `_check_duplicates` used before."""
+    duplicates = np.zeros(len(data), dtype=np.uint8)
+    for event_id, group in data.groupby("event_id"):
+        if (group.sequence_idx.value_counts() > 1).any():
+            rows = (data.event_id == event_id).values
+            duplicates[rows] = 2 if group.label.nunique() > 1 else 1
+    return duplicates
+
+
+def test_check_duplicates():
+    # event 10 is fine, 11 has a copy of an image, 12 a relabelled copy
+    data = pd.DataFrame({
+        "event_id": [10, 10, 10, 11, 11, 11, 11, 12, 12, 12],
+        "sequence_idx": [1, 2, 3, 1, 2, 3, 2, 1, 2, 1],
+        "label": ["cheetah"] * 7 + ["leopard", "leopard", "unknown"]})
+    io._check_duplicates(data)
+    assert list(data.duplicates) == [0] * 3 + [1] * 4 + [2] * 3
+
+
+def test_check_duplicates_matches_old_rule():
+    rng = np.random.RandomState(0)
+    data = pd.DataFrame({
+        "event_id": rng.randint(0, 300, 2000) * 7,
+        "sequence_idx": rng.randint(1, 6, 2000),
+        "label": rng.choice(["cheetah", "leopard", "unknown"], 2000,
+                            p=[0.9, 0.05, 0.05])})
+    expected = _old_duplicates(data)
+    io._check_duplicates(data)
+    np.testing.assert_array_equal(data.duplicates.values, expected)
+    assert set(expected) == {0, 1, 2}
+
+
+def test_extended_events_cross_event_and_day_boundaries():
+    # events 1..25 every 5 seconds, from day 9 into day 10 of the year
+    start = datetime.datetime(2018, 1, 9, 23, 59, 0)
+    data = _frame(_event_rows("CAM1", start, 25, 5))
+    assert data.datetime.dt.dayofyear.nunique() == 2
+
+    event_ids = io.extended_event_ids(data, window_secs=10)
+    assert len(np.unique(event_ids)) == 1
+
+
+def test_extended_events_split_by_gap_and_camera():
+    start = datetime.datetime(2018, 1, 9, 23, 59, 50)
+    rows = _event_rows("CAM1", start, 12, 5) + \
+        _event_rows("CAM1", start + datetime.timedelta(minutes=5), 3, 5,
+                    first_event=13) + \
+        _event_rows("CAM2", start, 12, 5)
+    data = _frame(rows)
+
+    event_ids = io.extended_event_ids(data, window_secs=10)
+    assert len(np.unique(event_ids)) == 3
+    assert len(np.unique(event_ids[:12])) == 1
+    assert len(np.unique(event_ids[12:15])) == 1
+    assert len(np.unique(event_ids[15:])) == 1
+
+
+def test_split_holds_back_the_latest_merged_event():
+    start = datetime.datetime(2018, 1, 9, 23, 59, 30)
+    rows = _event_rows("CAM1", start, 12, 5) + \
+        _event_rows("CAM1", start + datetime.timedelta(minutes=5), 3, 5,
+                    first_event=13)
+    positions = list(range(len(rows)))
+
+    data, held, _ = io._split_complete_events(rows, positions,
+                                              event_window=10)
+    assert sorted(data.event2) == list(range(1, 13))
+    assert sorted(row["event2"] for row in held) == [13, 14, 15]
+
+
+def _comparable(data):
+    """The frame without the keys that are only comparable within one
+    frame, in filename order."""
+    data = data.drop(columns=["event_id", "sortkey"])
+    data["serial_no"] = data.serial_no.astype(str)
+    return data.sort_values(by="filename").reset_index(drop=True)
+
+
+def _check_chunks(directory, event_window):
+    expected = io.read_dir_metadata(directory)
+    chunks = list(io.iter_dir_metadata(directory, chunk_size=4,
+                                       event_window=event_window))
+    assert len(chunks) > 1
+
+    for chunk in chunks:
+        assert (chunk.dtypes.astype(str) ==
+                expected.dtypes.astype(str)).all()
+        assert (chunk.sortkey.diff().dropna() > 0).all()
+
+    streamed = pd.concat([_comparable(chunk) for chunk in chunks])
+    streamed = streamed.sort_values(by="filename").reset_index(drop=True)
+    pd.testing.assert_frame_equal(streamed, _comparable(expected))
+
+    # every (merged) event is emitted in one chunk
+    if event_window is None:
+        events = expected.set_index("filename").event_id
+    else:
+        events = pd.Series(io.extended_event_ids(expected, event_window),
+                           index=expected.filename)
+    chunk_of_event = {}
+    for idx, chunk in enumerate(chunks):
+        for event in set(events[chunk.filename]):
+            assert chunk_of_event.setdefault(event, idx) == idx
+    return chunks
+
+
+def test_stream_chunks_equal_read_dir_metadata(reconyx_dir):
+    directory = reconyx_dir(events=5)
+    _check_chunks(directory, event_window=None)
+
+
+def test_stream_chunks_keep_merged_events_together(reconyx_dir):
+    # events 1-2 and 4-5 of each camera merge within the window
+    minute = datetime.timedelta(minutes=1)
+    directory = reconyx_dir(events=6,
+                            event_gaps=[minute, 30 * minute, 30 * minute,
+                                        minute, 30 * minute])
+    _check_chunks(directory, event_window=120)
+    merged = io.extended_event_ids(io.read_dir_metadata(directory), 120)
+    assert len(np.unique(merged)) == 8
+
+
+def test_fingerprints_match_copies_only(reconyx_dir):
+    directory = reconyx_dir(events=2)
+    shutil.copy(os.path.join(directory, "CAM1_0001_1.JPG"),
+                os.path.join(directory, "COPY_0001_1.JPG"))
+    data = io.read_dir_metadata(directory)
+    assert "fingerprint" not in data
+
+    io.add_fingerprints(data, workers=2)
+    fingerprints = data.set_index("filename").fingerprint
+    assert fingerprints.dtype == np.int64
+    assert fingerprints["CAM1_0001_1.JPG"] == fingerprints["COPY_0001_1.JPG"]
+    assert fingerprints.nunique() == len(data) - 1
@@ -0,0 +1,75 @@
+import os
+import sys
+import sqlite3
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import io  # noqa: E402
+from data_utils.metadata_cache import CACHE_FILE_NAME  # noqa: E402
+
+from conftest import write_reconyx_jpeg  # noqa: E402
+
+
+def _cached_files(directory):
+    connection = sqlite3.connect(os.path.join(directory, CACHE_FILE_NAME))
+    try:
+        return sorted(name for name, in connection.execute(
+            "SELECT filename FROM files"))
+    finally:
+        connection.close()
+
+
+def test_no_cache_file_by_default(reconyx_dir):
+    directory = reconyx_dir(events=2)
+    io.read_dir_metadata(directory)
+    assert not os.path.exists(os.path.join(directory, CACHE_FILE_NAME))
+
+
+def test_rescan_with_cache_equals_scan(reconyx_dir):
+    directory = reconyx_dir(events=2)
+    expected = io.read_dir_metadata(directory)
+
+    for _ in range(2):
+        data = io.read_dir_metadata(directory, use_cache=True)
+        assert data.equals(expected)
+    assert _cached_files(directory) == sorted(expected.filename)
+
+
+def test_modified_file_is_read_again(reconyx_dir):
+    directory = reconyx_dir(events=2)
+    io.read_dir_metadata(directory, use_cache=True)
+
+    path = os.path.join(directory, "CAM1_0001_1.JPG")
+    write_reconyx_jpeg(path, "CAM1", datetime.datetime(2018, 1, 9, 23, 50, 1),
+                       1, 1, 3, temp=-5)
+    # the identity changes even if size and mtime happen to match
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    data = io.read_dir_metadata(directory, use_cache=True)
+    assert data.set_index("filename").ambient_temp["CAM1_0001_1.JPG"] == -5
+
+
+def test_deleted_file_is_dropped(reconyx_dir):
+    directory = reconyx_dir(events=2)
+    io.read_dir_metadata(directory, use_cache=True)
+
+    os.remove(os.path.join(directory, "CAM2_0002_3.JPG"))
+    data = io.read_dir_metadata(directory, use_cache=True)
+    assert "CAM2_0002_3.JPG" not in set(data.filename)
+    assert "CAM2_0002_3.JPG" not in _cached_files(directory)
+    assert len(_cached_files(directory)) == len(data)
+
+
+def test_corrupt_cache_is_discarded(reconyx_dir):
+    directory = reconyx_dir(events=2)
+    expected = io.read_dir_metadata(directory, use_cache=True)
+
+    with open(os.path.join(directory, CACHE_FILE_NAME), 'wb') as f:
+        f.write(b"not a database" * 100)
+
+    data = io.read_dir_metadata(directory, use_cache=True)
+    assert data.equals(expected)
+    assert _cached_files(directory) == sorted(expected.filename)
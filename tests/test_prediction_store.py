@@ -0,0 +1,130 @@
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import prediction_store  # noqa: E402
+from data_utils.prediction_store import PredictionStore  # noqa: E402
+
+PRUNE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'scripts', 'prune_predictions.py')
+
+FINGERPRINTS = np.array([11, 12, 13], dtype=np.int64)
+PREDS = np.array([[0.7, 0.2, 0.1], [0.1, 0.8, 0.1], [0.3, 0.3, 0.4]],
+                 dtype=np.float32)
+
+
+def _write_model(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def _store(store_path, model_path, preprocessing="1:full"):
+    store = PredictionStore(store_path, model_path, preprocessing)
+    store.store(FINGERPRINTS, PREDS)
+    store.close()
+
+
+def _lookup(store_path, model_path, preprocessing="1:full"):
+    store = PredictionStore(store_path, model_path, preprocessing)
+    try:
+        return store.lookup(FINGERPRINTS, PREDS.shape[1])
+    finally:
+        store.close()
+
+
+def test_lookup_hits_for_the_same_model_and_decoder(tmp_path):
+    store_path = str(tmp_path / "predictions.sqlite")
+    model = _write_model(str(tmp_path / "model.hdf5"), b"model a")
+    _store(store_path, model)
+
+    found, preds = _lookup(store_path, model)
+    assert found.all()
+    np.testing.assert_array_equal(preds, PREDS)
+
+
+def test_lookup_misses_for_a_changed_model(tmp_path):
+    store_path = str(tmp_path / "predictions.sqlite")
+    model = _write_model(str(tmp_path / "model.hdf5"), b"model a")
+    _store(store_path, model)
+
+    # retrained in place, the stored file identity no longer matches
+    _write_model(model, b"model b, retrained")
+    found, preds = _lookup(store_path, model)
+    assert not found.any()
+    assert np.isnan(preds).all()
+
+
+def test_lookup_misses_for_another_decoder(tmp_path):
+    store_path = str(tmp_path / "predictions.sqlite")
+    model = _write_model(str(tmp_path / "model.hdf5"), b"model a")
+    _store(store_path, model, "1:full")
+
+    found, _ = _lookup(store_path, model, "1:pil_draft")
+    assert not found.any()
+    found, _ = _lookup(store_path, model, "2:full")
+    assert not found.any()
+
+
+def test_prune_refuses_to_keep_nothing(tmp_path):
+    store_path = str(tmp_path / "predictions.sqlite")
+    model = _write_model(str(tmp_path / "model.hdf5"), b"model a")
+    _store(store_path, model)
+
+    with pytest.raises(ValueError):
+        prediction_store.prune(store_path, keep=[])
+    assert _lookup(store_path, model)[0].all()
+
+
+def _prune(*args):
+    return subprocess.run([sys.executable, PRUNE_SCRIPT] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def _two_model_store(tmp_path):
+    store_path = str(tmp_path / "predictions.sqlite")
+    old = _write_model(str(tmp_path / "old.hdf5"), b"model a")
+    new = _write_model(str(tmp_path / "new.hdf5"), b"model b")
+    _store(store_path, old)
+    _store(store_path, new)
+    return store_path, old, new
+
+
+def test_prune_script_keep(tmp_path):
+    store_path, old, new = _two_model_store(tmp_path)
+
+    result = _prune("--store", store_path, "--keep", new)
+    assert result.returncode == 0, result.stderr
+    assert "Deleted 3 predictions" in result.stdout
+    assert _lookup(store_path, new)[0].all()
+    assert not _lookup(store_path, old)[0].any()
+
+
+def test_prune_script_keep_missing_model(tmp_path):
+    store_path, old, new = _two_model_store(tmp_path)
+
+    result = _prune("--store", store_path, "--keep",
+                    str(tmp_path / "mistyped.hdf5"))
+    assert result.returncode != 0
+    assert "does not exist" in result.stderr
+    assert _lookup(store_path, old)[0].all()
+    assert _lookup(store_path, new)[0].all()
+
+
+def test_prune_script_model(tmp_path):
+    store_path, old, new = _two_model_store(tmp_path)
+    old_hash = prediction_store.file_hash(old)
+
+    result = _prune("--store", store_path, "--model", old_hash)
+    assert result.returncode == 0, result.stderr
+    assert "Deleted 3 predictions" in result.stdout
+    models = [model for model, *_ in
+              prediction_store.stored_models(store_path)]
+    assert models == [prediction_store.file_hash(new)]
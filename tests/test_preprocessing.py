@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import io  # noqa: E402
+from data_utils.classifier import data_to_matrix  # noqa: E402
+from data_utils.image_decoder import decode_full  # noqa: E402
+from data_utils.preprocessing import BatchBuffer  # noqa: E402
+
+
+def _old_data_to_matrix(data_batch):
+    """The network input as `data_to_matrix` built it before
+    `BatchBuffer`: float32 images of 319x319, cropped to 299x299 and
+    scaled like `inception_resnet_v2.preprocess_input`."""
+    images = np.stack([decode_full(path, (319, 319)).astype(np.float32)
+                       for path in data_batch.path])[:, 10:-10, 10:-10, :]
+    images /= 127.5
+    images -= 1.
+    meta = np.stack((data_batch.ambient_temp.values.astype(np.float32),
+                     data_batch.hour.values.astype(np.float32)), axis=1)
+    return [images, meta]
+
+
+def test_data_to_matrix_matches_old_preprocessing(reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=1))
+
+    images, meta = data_to_matrix(data)
+    expected_images, expected_meta = _old_data_to_matrix(data)
+    assert images.dtype == meta.dtype == np.float32
+    np.testing.assert_array_equal(images, expected_images)
+    np.testing.assert_array_equal(meta, expected_meta)
+
+
+def test_buffer_reuse_and_partial_fills(reconyx_dir):
+    data = io.read_dir_metadata(reconyx_dir(events=2))
+    buffer = BatchBuffer(4)
+
+    def fill(rows, start=0):
+        return buffer.fill(rows.path.values, rows.ambient_temp.values,
+                           rows.hour.values, start)
+
+    fill(data[:4])
+    # a smaller batch, filled in two parts, overwrites the first rows
+    batch = data[4:7]
+    fill(batch[:1])
+    part = fill(batch[1:], start=1)
+    assert [len(x) for x in part] == [2, 2]
+
+    images, meta = buffer.inputs(len(batch))
+    expected_images, expected_meta = _old_data_to_matrix(batch)
+    np.testing.assert_array_equal(images, expected_images)
+    np.testing.assert_array_equal(meta, expected_meta)
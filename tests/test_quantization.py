@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import backends, quantization  # noqa: E402
+from data_utils.classifier import probability_columns  # noqa: E402
+
+LABELS = ['unknown', 'cheetah', 'leopard']
+
+SessionInput = namedtuple("SessionInput", ["name"])
+
+
+class FakeSession:
+    """The inputs of a converted model, in the order of the ONNX graph."""
+
+    def get_inputs(self):
+        return [SessionInput("input_2_01"), SessionInput("input_1_01")]
+
+
+def test_calibration_sample_per_label():
+    data = pd.DataFrame({"label": ["cheetah"] * 50 + ["leopard"] * 5 +
+                         ["unknown"] * 20,
+                         "path": ["{}.JPG".format(idx)
+                                  for idx in range(75)]})
+    sample = quantization.calibration_sample(data, 30)
+
+    assert sample.label.value_counts().to_dict() == \
+        {"cheetah": 10, "unknown": 10, "leopard": 5}
+    assert sample.path.is_unique
+    pd.testing.assert_frame_equal(
+        sample, quantization.calibration_sample(data, 30))
+
+
+def test_quantized_model_keeps_the_input_order(tmp_path):
+    model_path = str(tmp_path / "model.hdf5")
+    float_path = backends.onnx_model_path(model_path)
+    quantized_path = quantization.quantized_model_path(model_path, "static")
+    assert quantized_path == str(tmp_path / "model_static.onnx")
+
+    # not converted with `convert_to_onnx`, the graph order is used
+    assert backends.onnx_input_names(FakeSession(), float_path) == \
+        ["input_2_01", "input_1_01"]
+
+    with open(str(tmp_path / "model.onnx.json"), 'w') as f:
+        json.dump({"inputs": ["input_1_01", "input_2_01"]}, f)
+    backends.copy_onnx_inputs(float_path, quantized_path)
+    for path in [float_path, quantized_path]:
+        assert backends.onnx_input_names(FakeSession(), path) == \
+            ["input_1_01", "input_2_01"]
+
+
+def test_accuracy_report():
+    # two events of two images, image 1 and 3 are misclassified
+    preds = np.array([[0.1, 0.8, 0.1], [0.6, 0.3, 0.1],
+                      [0.1, 0.1, 0.8], [0.1, 0.8, 0.1]], dtype=np.float32)
+    data = pd.DataFrame({"event_id": [0, 0, 1, 1],
+                         "true_label": ["cheetah", "cheetah",
+                                        "leopard", "leopard"],
+                         "label": [1, 1, 1, 1]})
+    for idx, column in enumerate(probability_columns(LABELS)):
+        data[column] = preds[:, idx]
+
+    report = quantization.accuracy_report(data, LABELS)
+    assert report == {"image_accuracy": 0.5, "accuracy_unknown": None,
+                      "accuracy_cheetah": 0.5, "accuracy_leopard": 0.5,
+                      "event_accuracy": 0.5}
@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import threading
+import http.client
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils import service  # noqa: E402
+from data_utils.service import ClassificationService, SettingsMismatch  # noqa: E402
+
+LABELS = ['unknown', 'cheetah', 'leopard']
+
+# seconds to wait for a job to reach a state
+WAIT_SECS = 10.0
+
+
+class FakeClassifier:
+    """Labels every image 'cheetah', or waits until released if
+    `blocking`, like `ImageClassifier.classify_data` reporting progress."""
+
+    def __init__(self, blocking=False):
+        self.release = threading.Event()
+        if not blocking:
+            self.release.set()
+
+    def classify_data(self, data, progress=None, event_window=None):
+        while not self.release.wait(0.01):
+            if not progress(50.0):
+                raise InterruptedError("Classification interrupted.")
+        data["label"] = 1
+
+
+@pytest.fixture
+def running_service(tmp_path):
+    """A function starting the service with a fake classifier on a free
+    port, which returns the port and the service."""
+    model_path = str(tmp_path / "model.hdf5")
+    with open(model_path, 'wb') as f:
+        f.write(b"model")
+    servers = []
+
+    def start(classifier=None, **service_args):
+        job_service = ClassificationService(
+            classifier or FakeClassifier(), LABELS, model_path, {},
+            **service_args)
+        server = service.make_server(job_service, 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((server, job_service))
+        return server.server_address[1], job_service
+
+    yield start
+
+    for server, job_service in servers:
+        server.shutdown()
+        server.server_close()
+        job_service.classifier.release.set()
+        job_service.stop()
+
+
+def _wait_for(port, job_id, state):
+    deadline = time.time() + WAIT_SECS
+    job = service.job_status(job_id, port)
+    while job["state"] != state and time.time() < deadline:
+        time.sleep(0.02)
+        job = service.job_status(job_id, port)
+    assert job["state"] == state, job
+    return job
+
+
+def _raw_request(port, method, path, body=b"", headers=None):
+    connection = http.client.HTTPConnection(service.HOST, port, timeout=5)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def test_submit_and_status(running_service, reconyx_dir):
+    port, job_service = running_service()
+    directory = reconyx_dir(events=1)
+
+    assert service.service_running(port)
+    job = service.submit_job(directory, job_service.model_path, {}, port)
+    assert job["state"] in (service.QUEUED, service.RUNNING, service.DONE)
+
+    job = _wait_for(port, job["id"], service.DONE)
+    assert job["progress"] == 100.0
+    assert job["result"]["images"] == 6
+    assert job["result"]["labels"] == {"unknown": 0, "cheetah": 6,
+                                       "leopard": 0}
+
+
+def test_submit_other_settings_conflicts(running_service, reconyx_dir):
+    port, job_service = running_service()
+
+    with pytest.raises(SettingsMismatch):
+        service.submit_job(reconyx_dir(events=1), job_service.model_path,
+                           {"decoder": "pil_draft"}, port)
+
+
+def test_cancel_running_and_queued_jobs(running_service, reconyx_dir):
+    port, job_service = running_service(FakeClassifier(blocking=True))
+    directory = reconyx_dir(events=1)
+
+    running = service.submit_job(directory, job_service.model_path, {}, port)
+    queued = service.submit_job(directory, job_service.model_path, {}, port)
+    _wait_for(port, running["id"], service.RUNNING)
+
+    assert service.cancel_job(queued["id"], port)["state"] == \
+        service.CANCELLED
+    service.cancel_job(running["id"], port)
+    _wait_for(port, running["id"], service.CANCELLED)
+
+    with pytest.raises(ValueError, match="No such job"):
+        service.cancel_job(1000, port)
+
+
+def test_finished_jobs_are_removed(running_service, reconyx_dir):
+    port, job_service = running_service(max_finished_jobs=2)
+    directory = reconyx_dir(events=1)
+
+    for _ in range(4):
+        job = service.submit_job(directory, job_service.model_path, {}, port)
+    _wait_for(port, job["id"], service.DONE)
+    service.submit_job(directory, job_service.model_path, {}, port)
+
+    assert [job.id for job in job_service.job_list()] == [3, 4, 5]
+    with pytest.raises(ValueError, match="No such job"):
+        service.job_status(1, port)
+
+
+def test_foreign_host_is_forbidden(running_service):
+    port, _ = running_service()
+
+    status, _ = _raw_request(port, "GET", "/status",
+                             headers={"Host": "attacker.example:{}"
+                                      .format(port)})
+    assert status == 403
+    status, _ = _raw_request(port, "GET", "/status",
+                             headers={"Host": "localhost:{}".format(port)})
+    assert status == 200
+
+
+def test_submit_needs_json_content_type(running_service, reconyx_dir):
+    port, job_service = running_service()
+
+    body = '{{"directory": "{}", "model": "{}"}}'.format(
+        reconyx_dir(events=1), job_service.model_path).encode()
+    status, _ = _raw_request(port, "POST", "/jobs", body,
+                             {"Content-Type": "text/plain"})
+    assert status == 415
+    assert job_service.job_list() == []
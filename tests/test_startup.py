@@ -0,0 +1,24 @@
+import os
+import sys
+import subprocess
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, 'reconyx_classifier')
+
+HEAVY_MODULES = ["tensorflow", "keras", "onnxruntime"]
+
+
+def test_modules_import_without_inference_libraries():
+    # a fresh interpreter, the other tests may have imported them
+    code = "\n".join([
+        "import sys",
+        "sys.path.insert(0, {!r})".format(PACKAGE_DIR),
+        "import cheetah_classifier",
+        "from data_utils import classifier, io, service, auto_tune",
+        "print(sorted(name for name in {!r} if name in sys.modules))"
+        .format(HEAVY_MODULES)])
+    result = subprocess.run([sys.executable, "-c", code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
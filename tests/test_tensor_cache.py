@@ -0,0 +1,102 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'reconyx_classifier'))
+
+from data_utils.tensor_cache import TensorCache, CROP_BYTES, CROP_SHAPE, \
+    INDEX_FILE_NAME  # noqa: E402
+
+
+def _images(tmp_path, count):
+    """Image files, the cache only looks at their size, mtime and inode."""
+    paths = []
+    for idx in range(count):
+        path = tmp_path / "image_{}.JPG".format(idx)
+        path.write_bytes(b"jpeg" * (idx + 1))
+        paths.append(str(path))
+    return paths
+
+
+def _crop(seed):
+    return np.random.RandomState(seed).randint(
+        0, 255, CROP_SHAPE).astype(np.uint8)
+
+
+def _cache(tmp_path, slots=4, decoder_name="full"):
+    return TensorCache(str(tmp_path / "cache"), slots * CROP_BYTES,
+                       decoder_name)
+
+
+def _slots(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "cache" / INDEX_FILE_NAME))
+    try:
+        return dict(connection.execute("SELECT path, slot FROM entries"))
+    finally:
+        connection.close()
+
+
+def test_get_many_hit_and_miss(tmp_path):
+    paths = _images(tmp_path, 3)
+    cache = _cache(tmp_path)
+    cache.put_many([(paths[0], _crop(0), (12.0, 23.5)),
+                    (paths[1], _crop(1), (-3.0, 0.25))])
+
+    found = cache.get_many(paths)
+    assert sorted(found) == paths[:2]
+    np.testing.assert_array_equal(found[paths[0]][0], _crop(0))
+    np.testing.assert_array_equal(found[paths[1]][0], _crop(1))
+    assert found[paths[0]][1] == (12.0, 23.5)
+    assert found[paths[1]][1] == (-3.0, 0.25)
+    cache.close()
+
+    # entries survive reopening the cache
+    cache = _cache(tmp_path)
+    assert sorted(cache.get_many(paths)) == paths[:2]
+    cache.close()
+
+
+def test_get_many_misses_modified_image(tmp_path):
+    paths = _images(tmp_path, 2)
+    cache = _cache(tmp_path)
+    cache.put_many([(path, _crop(idx), (0.0, 0.0))
+                    for idx, path in enumerate(paths)])
+
+    with open(paths[0], 'ab') as f:
+        f.write(b"edited")
+    assert list(cache.get_many(paths)) == [paths[1]]
+    cache.close()
+
+
+def test_get_many_misses_other_decoder(tmp_path):
+    paths = _images(tmp_path, 1)
+    cache = _cache(tmp_path, decoder_name="full")
+    cache.put_many([(paths[0], _crop(0), (0.0, 0.0))])
+    cache.close()
+
+    cache = _cache(tmp_path, decoder_name="pil_draft")
+    assert cache.get_many(paths) == {}
+    cache.close()
+
+
+def test_full_cache_evicts_least_recently_used(tmp_path):
+    paths = _images(tmp_path, 3)
+    cache = _cache(tmp_path, slots=2)
+    cache.put_many([(paths[0], _crop(0), (0.0, 0.0))])
+    cache.put_many([(paths[1], _crop(1), (1.0, 1.0))])
+    slots = _slots(tmp_path)
+
+    # reading the first image makes the second the least recently used
+    assert list(cache.get_many(paths[:1])) == paths[:1]
+    cache.put_many([(paths[2], _crop(2), (2.0, 2.0))])
+
+    found = cache.get_many(paths)
+    assert sorted(found) == [paths[0], paths[2]]
+    # the evicted slot is reused, without touching the other crop
+    assert _slots(tmp_path)[paths[2]] == slots[paths[1]]
+    np.testing.assert_array_equal(found[paths[0]][0], _crop(0))
+    np.testing.assert_array_equal(found[paths[2]][0], _crop(2))
+    cache.close()
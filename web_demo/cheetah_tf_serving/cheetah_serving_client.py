@@ -1,51 +1,31 @@
+import os
 import sys
 
 import grpc
-import numpy
 import tensorflow as tf
 
 from tensorflow_serving.apis import predict_pb2
 from tensorflow_serving.apis import prediction_service_pb2_grpc
 
-import keras.backend as K
-from keras.applications.inception_resnet_v2 import preprocess_input
-from keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
-
 from exif_utils import make_exif_dict
 
+# share the preprocessing with the classifier
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'reconyx_classifier'))
+from data_utils.preprocessing import BatchBuffer  # noqa: E402
+
 # the app flags functionality supposedly is not official, so use with care
 # we only use it here because this is just a small demo server
 tf.app.flags.DEFINE_string('server', '', 'PredictionService host:port')
 tf.app.flags.DEFINE_string('image', '', 'Image to classify')
 FLAGS = tf.app.flags.FLAGS
 
-IMAGE_SHAPE = (299+20, 299+20, 3)
-predict_generator = ImageDataGenerator()
-
 
 def make_image_input_data(image_path):
-    batch_x = numpy.zeros((1, 299 + 20, 299 + 20, 3),
-                       dtype=K.floatx())
-    batch_t = numpy.zeros((1,), dtype=K.floatx())
-    batch_h = numpy.zeros((1,), dtype=K.floatx())
-
     image_meta = make_exif_dict(image_path, None)
 
-    img = load_img(image_path, grayscale=False,
-                   target_size=IMAGE_SHAPE)
-    x = img_to_array(img)
-    x = predict_generator.random_transform(x.astype(K.floatx()))
-    x = predict_generator.standardize(x)
-
-    batch_x[0] = x
-    batch_t[0] = image_meta['ambient_temp']
-    batch_h[0] = image_meta['hour']
-
-    batch_x = batch_x[:, 10:-10, 10:-10, :]
-    batch_x = [preprocess_input(batch_x),
-               numpy.stack((batch_t, batch_h), axis=1)]
-
-    return batch_x
+    return BatchBuffer(1).fill([image_path], [image_meta['ambient_temp']],
+                               [image_meta['hour']])
 
 
 def classify_image_rpc(hostport, image_path):